@@ -0,0 +1,265 @@
+"""
+并发获取K线
+akshare等数据源的调用是阻塞的，逐个品种获取时总耗时由网络延迟决定，一个卡住的请求会拖住整个流程。
+这里用asyncio在有界线程池中并发执行阻塞调用：
+    并发上限    - 同时进行的请求数
+    令牌桶限速  - 平均每秒最多rate个请求，允许burst个的突发
+    指数退避重试 - 失败（异常、返回空数据或超时）后等待backoff×2^(n-1)秒（带随机抖动，不超过max_backoff）再试
+    单次超时    - 每次请求最多等待timeout秒
+fetch_many按完成顺序逐个返回结果，单个品种失败不影响其他品种：
+    async for result in fetch_many(symbols, provider='flaky'):
+        ...
+同步代码（预热线程、命令行）使用iter_fetch，用法相同
+    python async_fetch.py sh000001 sz399001 --concurrency 4 --rate 2
+    python async_fetch.py --benchmark       # 用模拟延迟和失败的数据源比较逐个获取和并发获取
+"""
+import argparse
+import asyncio
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+from functools import partial
+
+# 默认的并发上限、限速、重试和超时设置
+CONCURRENCY = 4
+RATE = 5.0
+RETRIES = 3
+BACKOFF = 0.5
+MAX_BACKOFF = 8.0
+TIMEOUT = 30.0
+
+
+class TokenBucket:
+    """令牌桶：每秒补充rate个令牌，最多积累capacity个，每个请求消耗一个"""
+
+    def __init__(self, rate=RATE, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(self.rate, 1.0))
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        """等待并取走一个令牌；rate为0或负数时不限速"""
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            self._refill()
+            while self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+
+class FetchResult:
+    """一个品种的获取结果：frame为K线（失败时为None），error为最后一次失败的原因"""
+
+    __slots__ = ('symbol', 'frame', 'error', 'attempts', 'seconds')
+
+    def __init__(self, symbol, frame=None, error=None, attempts=0, seconds=0.0):
+        self.symbol = symbol
+        self.frame = frame
+        self.error = error
+        self.attempts = attempts
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.frame is not None
+
+    def __repr__(self):
+        status = f"{len(self.frame)}行" if self.ok else self.error
+        return f"FetchResult({self.symbol!r}, {status}, 尝试{self.attempts}次, {self.seconds:.2f}秒)"
+
+
+class AsyncFetcher:
+    """
+    并发获取器
+    fetch(symbol)为阻塞的获取函数，默认为judge_strategy.get_stock_data（使用provider指定的数据源）；
+    返回None或空表视为失败。超时的调用无法中断，会在线程中继续运行到结束，
+    因此线程池的大小为并发上限的两倍，少量卡住的请求不会占满线程池
+    """
+
+    def __init__(self, fetch=None, provider=None, concurrency=CONCURRENCY, rate=RATE, burst=None,
+                 retries=RETRIES, backoff=BACKOFF, max_backoff=MAX_BACKOFF, timeout=TIMEOUT):
+        if fetch is None:
+            from judge_strategy import get_stock_data
+            from data_providers import get_provider
+            # 只创建一次数据源，所有请求共用
+            fetch = partial(get_stock_data, provider=get_provider(provider))
+        self.fetch_func = fetch
+        self.concurrency = max(int(concurrency), 1)
+        self.rate = rate
+        self.burst = burst
+        self.retries = max(int(retries), 0)
+        self.backoff = float(backoff)
+        self.max_backoff = float(max_backoff)
+        self.timeout = timeout
+
+    def backoff_delay(self, attempt):
+        """第attempt次重试前的等待时间，在指数退避的50%-100%之间随机，避免多个品种同时重试"""
+        delay = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    async def _fetch_one(self, symbol, executor, semaphore, bucket):
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff_delay(attempt))
+            async with semaphore:
+                await bucket.acquire()
+                try:
+                    frame = await asyncio.wait_for(loop.run_in_executor(executor, self.fetch_func, symbol),
+                                                   self.timeout)
+                except asyncio.TimeoutError:
+                    error = f"超时（{self.timeout}秒）"
+                    continue
+                except Exception as e:
+                    error = f"{type(e).__name__}: {e}"
+                    continue
+            if frame is None or frame.empty:
+                error = "数据获取失败"
+                continue
+            return FetchResult(symbol, frame, None, attempt + 1, time.perf_counter() - start)
+        return FetchResult(symbol, None, error, self.retries + 1, time.perf_counter() - start)
+
+    async def fetch_many(self, symbols):
+        """按完成顺序逐个产出FetchResult；提前退出时取消还没有完成的品种"""
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return
+        semaphore = asyncio.Semaphore(self.concurrency)
+        bucket = TokenBucket(self.rate, self.burst)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix='fetch')
+        tasks = [asyncio.create_task(self._fetch_one(symbol, executor, semaphore, bucket))
+                 for symbol in symbols]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    async def fetch_all(self, symbols):
+        """全部完成后返回{品种: FetchResult}，顺序与symbols相同"""
+        results = {result.symbol: result async for result in self.fetch_many(symbols)}
+        return {symbol: results[symbol] for symbol in dict.fromkeys(symbols)}
+
+
+def fetch_many(symbols, fetch=None, provider=None, **options):
+    """AsyncFetcher(fetch, provider, **options).fetch_many(symbols)的简写，返回异步迭代器"""
+    return AsyncFetcher(fetch, provider, **options).fetch_many(symbols)
+
+
+def iter_fetch(symbols, fetch=None, provider=None, **options):
+    """
+    在同步代码中使用fetch_many：事件循环在后台线程中运行，本函数按完成顺序逐个返回FetchResult；
+    提前结束迭代时，还没有开始的请求不再发出
+    """
+    results = queue.Queue()
+    stop = threading.Event()
+    finished = object()
+
+    async def run():
+        async with aclosing(fetch_many(symbols, fetch, provider, **options)) as stream:
+            async for result in stream:
+                results.put(result)
+                if stop.is_set():
+                    break
+
+    def worker():
+        try:
+            asyncio.run(run())
+        except BaseException as e:
+            results.put(e)
+        finally:
+            results.put(finished)
+
+    thread = threading.Thread(target=worker, name='fetch-loop', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = results.get()
+            if item is finished:
+                break
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+def fetch_all(symbols, fetch=None, provider=None, **options):
+    """同步获取全部品种，返回{品种: FetchResult}，顺序与symbols相同"""
+    results = {result.symbol: result for result in iter_fetch(symbols, fetch, provider, **options)}
+    return {symbol: results[symbol] for symbol in dict.fromkeys(symbols)}
+
+
+def benchmark(symbol_count=40, latency=0.2, failure_rate=0.2, concurrency=8, rate=20.0):
+    """用模拟延迟和失败的数据源比较逐个获取（不重试）和并发获取（带重试）的耗时和成功数"""
+    from data_providers import FlakyProvider
+
+    symbols = [f"syn{i:05d}" for i in range(symbol_count)]
+
+    provider = FlakyProvider(latency=latency, failure_rate=failure_rate, periods=500, seed=1)
+    start = time.perf_counter()
+    serial = {}
+    for symbol in symbols:
+        try:
+            serial[symbol] = provider.fetch(symbol)
+        except ConnectionError:
+            pass
+    serial_seconds = time.perf_counter() - start
+    print(f"逐个获取: {len(serial)}/{symbol_count}个成功，{provider.calls}次请求，{serial_seconds:.2f}秒")
+
+    provider = FlakyProvider(latency=latency, failure_rate=failure_rate, periods=500, seed=1)
+    start = time.perf_counter()
+    results = fetch_all(symbols, fetch=provider.fetch, concurrency=concurrency, rate=rate,
+                        backoff=0.1, timeout=5)
+    elapsed = time.perf_counter() - start
+    succeeded = sum(result.ok for result in results.values())
+    print(f"并发获取（并发{concurrency}，每秒{rate:g}次）: {succeeded}/{symbol_count}个成功，"
+          f"{provider.calls}次请求，同时进行最多{provider.max_active}个，{elapsed:.2f}秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="并发获取多个品种的K线")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认为全部配置的指数")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录、synthetic 或 flaky，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="同时进行的请求数")
+    parser.add_argument('--rate', type=float, default=RATE, help="每秒最多发出的请求数，0为不限速")
+    parser.add_argument('--retries', type=int, default=RETRIES, help="失败后的重试次数")
+    parser.add_argument('--timeout', type=float, default=TIMEOUT, help="单次请求的超时时间（秒）")
+    parser.add_argument('--benchmark', action='store_true', help="用模拟的数据源比较逐个获取和并发获取")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    from judge_strategy import INDICES_CONFIG
+
+    symbols = args.symbols or list(INDICES_CONFIG.values())
+    start = time.perf_counter()
+    for result in iter_fetch(symbols, provider=args.provider, concurrency=args.concurrency, rate=args.rate,
+                             retries=args.retries, timeout=args.timeout):
+        print(result)
+    print(f"完成 {len(symbols)} 个品种，耗时 {time.perf_counter() - start:.1f}秒")
+
+
+if __name__ == "__main__":
+    main()
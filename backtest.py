@@ -0,0 +1,247 @@
+"""
+信号回测
+把TG/BG/低位金叉/二次金叉/主升等信号按规则转换为持仓，计算收益、最大回撤和胜率。
+所有计算在日期×品种的二维数组上向量化完成：多个品种（或同一品种的多组指标参数）一次算完，多组规则依次计算；
+输入可以直接使用macd_panel.calculate_macd_panel的结果，也可以用panel_from_frames把
+calculate_macd_indicators_new的结果拼成面板
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# 汇总表的列
+SUMMARY_COLUMNS = [
+    'rule', 'symbol', 'bars', 'total_return', 'annual_return', 'volatility', 'sharpe',
+    'max_drawdown', 'trades', 'hit_rate', 'avg_trade', 'exposure'
+]
+
+
+class SignalRule:
+    """
+    入场和出场规则：
+    entry中任一信号出现时在当根K线收盘开仓（direction=1做多，-1做空），
+    exit中任一信号出现、或开仓后持有满hold根K线（None为不限）时在当根K线收盘平仓；
+    持仓期间再次出现入场信号时重新计时，同一根K线同时出现入场和出场信号时不持仓；
+    cost为单边交易成本（占成交金额的比例），开仓和平仓各扣一次
+    """
+
+    def __init__(self, entry=('低位金叉',), exit=('TG',), hold=None, cost=0.0005, direction=1, name=None):
+        self.entry = (entry,) if isinstance(entry, str) else tuple(entry)
+        self.exit = (exit,) if isinstance(exit, str) else tuple(exit)
+        self.hold = None if hold is None else int(hold)
+        self.cost = float(cost)
+        self.direction = 1 if direction >= 0 else -1
+        self.name = name or self._default_name()
+
+    def _default_name(self):
+        name = f"{'+'.join(self.entry)}→{'+'.join(self.exit) or '无'}"
+        if self.hold is not None:
+            name += f"/{self.hold}根"
+        return name if self.direction > 0 else f"空:{name}"
+
+    def signals(self):
+        """规则用到的全部信号列"""
+        return list(dict.fromkeys(self.entry + self.exit))
+
+    def __repr__(self):
+        return f"SignalRule({self.name!r}, cost={self.cost})"
+
+
+# 默认规则：各主要信号做多，顶结构（TG）或死叉出场
+DEFAULT_RULES = [
+    SignalRule(entry='低位金叉', exit='TG'),
+    SignalRule(entry='二次金叉', exit='TG'),
+    SignalRule(entry='BG', exit='TG'),
+    SignalRule(entry='主升', exit=(), hold=20),
+]
+
+
+def _any(signals, names, shape):
+    """多个信号面板按位或，没有信号时全为False"""
+    result = np.zeros(shape, dtype=bool)
+    for name in names:
+        result |= np.asarray(signals[name], dtype=bool)
+    return result
+
+
+def positions(entry, exit, hold=None):
+    """
+    由入场和出场信号（T×N布尔数组）计算每根K线收盘后的持仓（布尔数组）
+    最近一次入场晚于最近一次出场时持仓，hold不为None时从最近一次入场起最多持有hold根K线
+    """
+    bars = np.arange(len(entry))[:, None]
+    last_entry = np.maximum.accumulate(np.where(entry, bars, -1), axis=0)
+    last_exit = np.maximum.accumulate(np.where(exit, bars, -1), axis=0)
+    held = last_entry > last_exit
+    if hold is not None:
+        held &= bars - last_entry < hold
+    return held
+
+
+def bar_returns(closes):
+    """
+    逐根K线的收盘价涨跌幅（T×N），停牌的K线按前一收盘价计算，复牌当天计入停牌期间的涨跌；
+    上市前和第一根K线为0
+    """
+    values = closes.ffill().to_numpy(dtype=float) if isinstance(closes, pd.DataFrame) else closes
+    returns = np.zeros(values.shape)
+    returns[1:] = values[1:] / values[:-1] - 1
+    return np.nan_to_num(returns, nan=0.0, posinf=0.0, neginf=0.0)
+
+
+def _evaluate(returns, held, valid, rule, periods_per_year):
+    """计算一组规则在全部品种上的指标，返回{指标名: 长度为N的数组}"""
+    prev = np.zeros_like(held)
+    prev[1:] = held[:-1]
+
+    # 每根K线的对数收益：持仓收益加上开平仓成本
+    trade_log = np.log1p(rule.direction * prev * returns)
+    cost_log = np.log1p(-rule.cost * (held != prev))
+    log_returns = trade_log + cost_log
+    equity = np.exp(np.cumsum(log_returns, axis=0))
+    drawdown = equity / np.maximum.accumulate(equity, axis=0) - 1
+
+    # 连续持仓为一笔交易，按列优先编号使每笔交易的编号全局唯一
+    starts = held & ~prev
+    numbers = np.cumsum(starts.T.ravel()).reshape(starts.T.shape).T
+    trade_id = np.where(held, numbers, 0)
+    prev_id = np.zeros_like(trade_id)
+    prev_id[1:] = trade_id[:-1]
+    trade_count = int(starts.sum())
+    # 当根收益属于上一根收盘时的持仓，开仓成本属于新开的交易，平仓成本属于刚结束的交易
+    trade_returns = (np.bincount(prev_id.ravel(), trade_log.ravel(), minlength=trade_count + 1) +
+                     np.bincount(np.maximum(trade_id, prev_id).ravel(), cost_log.ravel(),
+                                 minlength=trade_count + 1))[1:]
+    trade_column = np.nonzero(starts.T)[0]
+    columns = held.shape[1]
+    trades = np.bincount(trade_column, minlength=columns)
+    wins = np.bincount(trade_column, trade_returns > 0, minlength=columns)
+    trade_sum = np.bincount(trade_column, np.expm1(trade_returns), minlength=columns)
+
+    bars = valid.sum(axis=0)
+    simple = np.expm1(log_returns)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = np.where(valid, simple, 0).sum(axis=0) / bars
+        std = np.sqrt(np.where(valid, (simple - mean) ** 2, 0).sum(axis=0) / (bars - 1))
+        years = bars / periods_per_year
+        total = equity[-1] - 1 if len(equity) else np.zeros(columns)
+        return {
+            'bars': bars,
+            'total_return': total,
+            'annual_return': np.power(1 + total, 1 / years) - 1,
+            'volatility': std * np.sqrt(periods_per_year),
+            'sharpe': np.where(std > 0, mean / std * np.sqrt(periods_per_year), np.nan),
+            'max_drawdown': drawdown.min(axis=0) if len(drawdown) else np.zeros(columns),
+            'trades': trades,
+            'hit_rate': np.where(trades > 0, wins / trades, np.nan),
+            'avg_trade': np.where(trades > 0, trade_sum / trades, np.nan),
+            'exposure': np.where(valid, held, False).sum(axis=0) / bars,
+        }
+
+
+def backtest_panel(closes, signals, rules=None, periods_per_year=250):
+    """
+    在日期×品种的面板上回测多组规则
+    closes为收盘价DataFrame（停牌或未上市为NaN），signals为{信号名: 同样形状的布尔DataFrame}，
+    rules为SignalRule列表（默认DEFAULT_RULES）；返回汇总表，每组规则的每个品种一行
+    """
+    rules = DEFAULT_RULES if rules is None else rules
+    returns = bar_returns(closes)
+    valid = closes.notna().to_numpy()
+    shape = returns.shape
+
+    frames = []
+    for rule in rules:
+        entry = _any(signals, rule.entry, shape) & valid
+        exit = _any(signals, rule.exit, shape) & valid
+        metrics = _evaluate(returns, positions(entry, exit, rule.hold), valid, rule, periods_per_year)
+        frame = pd.DataFrame(metrics)
+        frame.insert(0, 'symbol', list(closes.columns))
+        frame.insert(0, 'rule', rule.name)
+        frames.append(frame)
+    return pd.concat(frames, ignore_index=True)[SUMMARY_COLUMNS]
+
+
+def panel_from_frames(frames, signal_names):
+    """
+    把{键: calculate_macd_indicators_new的结果}按日期对齐成面板，键可以是品种代码，
+    也可以是sweep_indicators返回的参数组（同一品种的多组参数一次回测）
+    返回(收盘价面板, {信号名: 布尔面板})
+    """
+    closes = pd.DataFrame({key: df['close'] for key, df in frames.items()})
+    signals = {name: pd.DataFrame({key: df[name] for key, df in frames.items()}, index=closes.index)
+                     .fillna(False).astype(bool)
+               for name in signal_names}
+    return closes, signals
+
+
+def backtest_frames(frames, rules=None, periods_per_year=250):
+    """对{键: calculate_macd_indicators_new的结果}回测，返回与backtest_panel相同的汇总表"""
+    rules = DEFAULT_RULES if rules is None else rules
+    names = list(dict.fromkeys(name for rule in rules for name in rule.signals()))
+    closes, signals = panel_from_frames(frames, names)
+    return backtest_panel(closes, signals, rules, periods_per_year)
+
+
+def benchmark(symbol_count=300, periods=1500, rules=None):
+    """用面板模式的离线随机数据测试回测吞吐量（品种·年/秒，每年按250根K线计）"""
+    from macd_panel import calculate_macd_panel, _synthetic_closes
+
+    rules = DEFAULT_RULES if rules is None else rules
+    closes = _synthetic_closes(symbol_count, periods)
+    signals = calculate_macd_panel(closes)
+
+    start = time.perf_counter()
+    summary = backtest_panel(closes, signals, rules)
+    elapsed = time.perf_counter() - start
+    symbol_years = symbol_count * periods / 250 * len(rules)
+    print(f"{symbol_count}个品种 × {periods}根K线 × {len(rules)}组规则: {elapsed:.3f}秒，"
+          f"{symbol_years / elapsed:,.0f} 品种·年/秒")
+    print(summary.groupby('rule')[['total_return', 'max_drawdown', 'trades', 'hit_rate']].mean())
+
+
+def main():
+    from judge_strategy import get_stock_data, calculate_macd_indicators_new, INDICES_CONFIG
+
+    parser = argparse.ArgumentParser(description="按MACD结构信号回测")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认为全部配置的指数")
+    parser.add_argument('--entry', nargs='+', default=None, help="入场信号，如 低位金叉 BG，默认使用内置的几组规则")
+    parser.add_argument('--exit', nargs='*', default=['TG'], help="出场信号，默认TG")
+    parser.add_argument('--hold', type=int, default=None, help="最多持有的K线数量")
+    parser.add_argument('--cost', type=float, default=0.0005, help="单边交易成本，默认0.0005")
+    parser.add_argument('--short', action='store_true', help="做空")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--output', help="汇总表保存路径（.csv）")
+    parser.add_argument('--benchmark', action='store_true', help="用离线随机数据测试吞吐量")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    rules = None
+    if args.entry:
+        rules = [SignalRule(args.entry, args.exit, args.hold, args.cost, -1 if args.short else 1)]
+    names = list(dict.fromkeys(name for rule in (rules or DEFAULT_RULES) for name in rule.signals()))
+
+    frames = {}
+    for symbol in args.symbols or list(INDICES_CONFIG.values()):
+        df = get_stock_data(symbol, provider=args.provider)
+        if df is not None:
+            frames[symbol] = calculate_macd_indicators_new(df, columns=['close'] + names)
+    if not frames:
+        print("没有可回测的数据")
+        return
+
+    summary = backtest_frames(frames, rules)
+    print(summary.to_string())
+    if args.output:
+        summary.to_csv(args.output, index=False)
+        print(f"汇总表已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+本地K线库
+每个品种的日线历史保存为一个Parquet文件，之后只从网络获取最后几根K线及之后的数据并合并：
+重叠部分的K线被修订时（如收盘后数据修正）只覆盖这几根，
+重叠部分之前的K线也不一致时（如除权导致的复权价格变化）才重新获取完整历史
+"""
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from data_providers import PRICE_COLUMNS, get_provider
+
+# 本地K线库目录，可用环境变量BAR_STORE_DIR修改
+BAR_STORE_DIR = os.environ.get('BAR_STORE_DIR', 'bar_store')
+
+# 判断K线是否被修订时允许的相对误差
+REVISION_TOLERANCE = 1e-6
+
+# 增量更新时重新获取并覆盖的最后几根K线
+OVERLAP_BARS = 5
+
+
+def _store_path(symbol, root):
+    return os.path.join(root, f"{symbol}.parquet")
+
+
+def read_bars(symbol, root=BAR_STORE_DIR):
+    """读取本地保存的K线，不存在时返回None"""
+    path = _store_path(symbol, root)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path)
+
+
+def write_bars(symbol, df, root=BAR_STORE_DIR):
+    """
+    保存K线，先写临时文件再替换，避免中断时损坏已有数据；
+    临时文件名各不相同，多个进程同时写同一品种时不会写进同一个临时文件，最后完成的一次生效
+    """
+    os.makedirs(root, exist_ok=True)
+    path = _store_path(symbol, root)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{symbol}.", suffix='.tmp', dir=os.path.dirname(path))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            df.to_parquet(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _is_revised(stored_bar, fetched_bar):
+    """比较同一日期的两根K线是否不同"""
+    columns = [col for col in PRICE_COLUMNS if col in stored_bar.index and col in fetched_bar.index]
+    return not np.allclose(stored_bar[columns].to_numpy(dtype=float),
+                           fetched_bar[columns].to_numpy(dtype=float),
+                           rtol=REVISION_TOLERANCE, equal_nan=True)
+
+
+def sync_bars(symbol, refresh=False, root=BAR_STORE_DIR, provider=None):
+    """
+    从数据源（默认akshare）更新并返回某个品种的完整日线历史（日期为索引）
+    本地已有数据时从倒数第OVERLAP_BARS+1根K线开始获取：第一根用于核对，与网络数据不一致说明
+    更早的历史也变了（除权等），重新获取完整历史；其余重叠的K线直接用网络数据覆盖，再追加新的K线。
+    本地文件损坏或refresh=True时也重新获取完整历史
+    """
+    fetch = get_provider(provider).fetch
+    stored = None
+    if not refresh:
+        try:
+            stored = read_bars(symbol, root)
+        except Exception as e:
+            print(f"读取本地K线 {symbol} 失败，重新获取完整历史: {e}")
+
+    if stored is None or stored.empty:
+        df = fetch(symbol)
+        if df is None:
+            return None
+        write_bars(symbol, df, root)
+        return df
+
+    anchor_date = stored.index[max(len(stored) - OVERLAP_BARS - 1, 0)]
+    delta = fetch(symbol, anchor_date)
+    if delta is None or delta.empty:
+        return stored
+
+    # 用本地和网络都有的最早一根K线核对（第一根可能因停牌等在网络数据中缺失）
+    common = delta.index[delta.index.isin(stored.index)]
+    if len(common):
+        check_date = common[0]
+        if _is_revised(stored.loc[check_date], delta.loc[check_date]):
+            print(f"{symbol} {check_date:%Y-%m-%d} 的K线与本地不一致（可能除权），重新获取完整历史")
+            return sync_bars(symbol, refresh=True, root=root, provider=provider)
+        tail = stored[stored.index >= check_date]
+        revised = [date for date in tail.index.intersection(delta.index)
+                   if _is_revised(tail.loc[date], delta.loc[date])]
+        if revised:
+            print(f"{symbol} 最后{len(revised)}根K线已被修订，用网络数据覆盖: "
+                  f"{', '.join(f'{date:%Y-%m-%d}' for date in revised)}")
+        elif not (delta.index > stored.index[-1]).any() and tail.index.isin(delta.index).all():
+            return stored
+        df = pd.concat([stored[stored.index < check_date], delta[delta.index >= check_date]])
+    else:
+        new_bars = delta[delta.index > stored.index[-1]]
+        if new_bars.empty:
+            return stored
+        df = pd.concat([stored, new_bars])
+    write_bars(symbol, df, root)
+    return df
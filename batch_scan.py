@@ -0,0 +1,140 @@
+"""
+多品种批量扫描
+并行获取数据并计算MACD指标，汇总每个品种最新一根K线的TG/BG/主升/低位金叉等状态
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from judge_strategy import get_stock_data, calculate_macd_indicators_new, INDICES_CONFIG
+from data_providers import SyntheticProvider, get_provider
+
+# 汇总表中每个品种的最新状态，扫描时只计算这些指标列及其依赖
+SCAN_COLUMNS = ['close', 'DIF', 'DEA', 'MACD', 'TG', 'BG', '主升', '低位金叉', '二次金叉']
+SUMMARY_COLUMNS = ['symbol', 'date'] + SCAN_COLUMNS + ['error']
+
+
+def scan_symbol(symbol, provider=None):
+    """获取单个品种的数据并计算指标，返回最新一根K线的状态；出错时只记录错误信息"""
+    summary = {'symbol': symbol}
+    try:
+        df = get_stock_data(symbol, provider=provider)
+        if df is None or df.empty:
+            summary['error'] = "数据获取失败"
+            return summary
+
+        df = calculate_macd_indicators_new(df, columns=SCAN_COLUMNS)
+        latest = df.iloc[-1]
+        summary['date'] = df.index[-1]
+        for name in SUMMARY_COLUMNS:
+            if name in latest.index:
+                summary[name] = latest[name]
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+    return summary
+
+
+def print_progress(done, total, summary):
+    """默认的进度输出"""
+    status = summary.get('error') or "完成"
+    print(f"[{done}/{total}] {summary['symbol']} {status}")
+
+
+def scan_symbols(symbols, workers=None, provider=None, progress=print_progress):
+    """
+    用进程池批量扫描多个品种，返回汇总表（每个品种一行）
+    workers为进程数，默认使用全部CPU核心，为1时在当前进程中串行计算；
+    provider为数据源（见data_providers）；progress(done, total, summary)在每个品种完成时调用
+    """
+    symbols = list(symbols)
+    provider = get_provider(provider)
+    total = len(symbols)
+    workers = workers or os.cpu_count() or 1
+    summaries = []
+
+    if workers == 1:
+        for symbol in symbols:
+            summaries.append(scan_symbol(symbol, provider))
+            if progress:
+                progress(len(summaries), total, summaries[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(scan_symbol, symbol, provider): symbol for symbol in symbols}
+            for future in as_completed(futures):
+                try:
+                    summary = future.result()
+                except Exception as e:  # 子进程异常退出等情况
+                    summary = {'symbol': futures[future], 'error': f"{type(e).__name__}: {e}"}
+                summaries.append(summary)
+                if progress:
+                    progress(len(summaries), total, summary)
+
+    result = pd.DataFrame(summaries, columns=SUMMARY_COLUMNS)
+    # 按输入顺序排列
+    result['symbol'] = pd.Categorical(result['symbol'], categories=list(dict.fromkeys(symbols)))
+    result = result.sort_values('symbol').reset_index(drop=True)
+    result['symbol'] = result['symbol'].astype(str)
+    return result
+
+
+def benchmark(symbol_count=64, worker_counts=None):
+    """
+    用离线随机数据测试不同进程数下的扫描吞吐量
+    只测量不超过本机CPU核心数的进程数；加速比取决于核心数和数据获取的耗时，须在多核机器上实测
+    """
+    cpu_count = os.cpu_count() or 1
+    if worker_counts is None:
+        worker_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+    provider = SyntheticProvider(periods=1500, start='2020-01-01', symbol_count=symbol_count)
+    symbols = provider.symbols()
+
+    print(f"{'进程数':>6} {'耗时(秒)':>10} {'品种/秒':>10} {'加速比':>8}")
+    base = None
+    for workers in worker_counts:
+        start = time.perf_counter()
+        scan_symbols(symbols, workers=workers, provider=provider, progress=None)
+        elapsed = time.perf_counter() - start
+        base = base or elapsed
+        print(f"{workers:>6} {elapsed:>10.2f} {symbol_count / elapsed:>10.1f} {base / elapsed:>8.2f}")
+    if cpu_count < 2:
+        print(f"本机只有{cpu_count}个CPU核心，无法测量多进程的加速比")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="多品种MACD结构信号批量扫描")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认扫描全部配置的指数")
+    parser.add_argument('--symbols-file', help="品种代码文件，每行一个")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认使用全部CPU核心")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--output', help="汇总表保存路径（.csv或.xlsx）")
+    parser.add_argument('--benchmark', action='store_true', help="用离线随机数据测试吞吐量")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    symbols = list(args.symbols)
+    if args.symbols_file:
+        with open(args.symbols_file, encoding='utf-8') as f:
+            symbols += [line.strip() for line in f if line.strip()]
+    if not symbols:
+        symbols = list(INDICES_CONFIG.values())
+
+    result = scan_symbols(symbols, workers=args.workers, provider=args.provider)
+    print(result.to_string())
+
+    if args.output:
+        if args.output.endswith('.xlsx'):
+            result.to_excel(args.output, index=False)
+        else:
+            result.to_csv(args.output, index=False)
+        print(f"汇总表已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+性能基准和结果回归检查
+用离线随机数据测试EMA、CROSS、BARSLAST、calculate_macd_indicators_new（500/5千/5万/50万根K线）、
+plot_macd_system_new和Excel导出的耗时，并把指标计算结果与golden目录中保存的标准结果逐列比较，
+任何一列（如TG/BG信号）发生变化都会使检查失败，退出码不为0；
+绘图结果与golden目录中的标准图片在容差内比较（允许少量像素和1-2像素的尺寸差异，字体和matplotlib版本会影响渲染）。
+    python benchmark_suite.py                     # 检查结果并运行全部基准，与保存的基线对比
+    python benchmark_suite.py --save-baseline     # 把本次耗时保存为基线
+    python benchmark_suite.py --check-only        # 只检查结果
+    python benchmark_suite.py --update-golden     # 确认指标定义有意修改后，重新生成标准结果
+    python benchmark_suite.py --formulas          # 比较BARSLASTN/HHV/LLV/REF与原来逐根循环的耗时
+结果和绘图检查也在test_benchmark_suite.py中作为pytest测试运行，计时部分使用pytest-benchmark：
+    python -m pytest -q test_benchmark_suite.py --benchmark-skip   # 只检查结果，跳过计时
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from judge_strategy import (EMA, CROSS, BARSLAST, BARSLASTN, HHV, LLV, REF, BAR_COLUMNS,
+                            calculate_macd_indicators_new, plot_macd_system_new, export_indicators)
+from data_providers import SyntheticProvider
+import kernels
+
+warnings.filterwarnings('ignore')
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+BASELINE_PATH = 'benchmark_baseline.json'
+
+# 标准结果：名称 -> 生成输入K线的随机数据参数；检查时使用文件中保存的K线，不依赖随机数生成器的实现
+GOLDEN_CASES = {
+    'synthetic_a': dict(periods=2000, seed=0, start='2015-01-01'),
+    'synthetic_b': dict(periods=2000, seed=1, start='2015-01-01'),
+}
+
+# 各基准的K线数量；绘图和导出在数据量大时没有实际意义，只测较小的规模
+CALC_SIZES = (500, 5000, 50000, 500000)
+PLOT_SIZES = (500, 5000)
+EXPORT_SIZES = (500, 5000)
+
+# 浮点列的比较容差，布尔和整数列必须完全相同
+FLOAT_RTOL = 1e-9
+FLOAT_ATOL = 1e-12
+
+# 标准图片：用哪个标准结果的前多少根K线绘图；尺寸最多相差几个像素，
+# 颜色差异超过RENDER_THRESHOLD（0-1）的像素最多占多大比例
+GOLDEN_PLOT_CASE = 'synthetic_a'
+GOLDEN_PLOT_BARS = 500
+RENDER_SIZE_TOLERANCE = 2
+RENDER_PIXEL_TOLERANCE = 0.02
+RENDER_THRESHOLD = 0.1
+
+# 与基线相差不到1毫秒时不标记变慢，避免微秒级的基准因计时抖动误报
+MIN_REGRESSION_SECONDS = 0.001
+
+
+# 向量化之前的逐根循环实现，作为BARSLASTN/HHV/LLV/REF的参照（测试和--formulas基准使用）
+
+def loop_barslastn(condition, n):
+    """逐根取当前位置之前全部条件成立的位置，倒数第n次到当前的周期数，不足n次时为0"""
+    flags = np.asarray(condition, dtype=bool)
+    result = np.zeros(len(flags), dtype=np.int64)
+    for i in range(len(flags)):
+        positions = np.flatnonzero(flags[:i + 1])
+        if len(positions) >= n:
+            result[i] = i - positions[-n]
+    return pd.Series(result, index=condition.index)
+
+
+def _loop_window(series, periods, method):
+    values = pd.Series(np.asarray(series, dtype=float))
+    periods = np.broadcast_to(np.asarray(periods, dtype=np.int64), len(values))
+    result = np.full(len(values), np.nan)
+    for i in range(len(values)):
+        start = max(0, i - periods[i] + 1)
+        result[i] = getattr(values.iloc[start:i + 1], method)()  # Series.max/min跳过NaN
+    return pd.Series(result, index=series.index)
+
+
+def loop_hhv(series, periods):
+    return _loop_window(series, periods, 'max')
+
+
+def loop_llv(series, periods):
+    return _loop_window(series, periods, 'min')
+
+
+def loop_ref(series, periods):
+    """逐根引用periods周期前的值，超出数据起点时为0"""
+    values = np.asarray(series, dtype=float)
+    periods = np.broadcast_to(np.asarray(periods, dtype=np.int64), len(values))
+    result = np.zeros(len(values))
+    for i in range(len(values)):
+        if i - periods[i] >= 0:
+            result[i] = values[i - periods[i]]
+    return pd.Series(result, index=series.index)
+
+
+def formula_inputs(periods, seed=0):
+    """与指标计算中用法相同的输入：金叉信号、DIF和按M1+2变化的窗口长度"""
+    df = SyntheticProvider(periods=periods, seed=seed, freq='min').fetch('formulas')
+    close = df['close']
+    dif = (EMA(close, 12) - EMA(close, 26)) * 100
+    golden_cross = CROSS(dif, EMA(dif, 9))
+    window = BARSLAST(golden_cross).astype(np.int64) + 2
+    return golden_cross, dif, window
+
+
+def benchmark_formulas(sizes=(500, 2000, 5000)):
+    """BARSLASTN/HHV/LLV/REF与原来逐根循环的耗时对比"""
+    print(f"{'公式':<12} {'K线数量':>8} {'逐根循环(ms)':>14} {'向量化(ms)':>12} {'加速':>10}")
+    for periods in sizes:
+        golden_cross, dif, window = formula_inputs(periods)
+        cases = (
+            ('BARSLASTN', lambda: loop_barslastn(golden_cross, 2), lambda: BARSLASTN(golden_cross, 2)),
+            ('HHV', lambda: loop_hhv(dif, window), lambda: HHV(dif, window)),
+            ('LLV', lambda: loop_llv(dif, window), lambda: LLV(dif, window)),
+            ('REF', lambda: loop_ref(dif, window - 1), lambda: REF(dif, window - 1)),
+        )
+        for name, loop, vectorized in cases:
+            loop_seconds = measure(loop, min_time=0.2, max_rounds=3)[0]
+            fast_seconds = measure(vectorized)[0]
+            print(f"{name:<12} {periods:>8} {loop_seconds * 1000:>14.2f} {fast_seconds * 1000:>12.3f} "
+                  f"{loop_seconds / fast_seconds:>9.0f}x", flush=True)
+
+
+def golden_path(name):
+    return os.path.join(GOLDEN_DIR, f'{name}.parquet')
+
+
+def compare_columns(result, expected):
+    """
+    逐列比较result和expected，返回问题列表（为空表示一致）
+    检查列名和顺序、数据类型和数值；浮点列允许FLOAT_RTOL的相对误差，其他列必须完全相同
+    """
+    problems = []
+    missing = [name for name in expected.columns if name not in result.columns]
+    extra = [name for name in result.columns if name not in expected.columns]
+    if missing:
+        problems.append(f"缺少列: {missing}")
+    if extra:
+        problems.append(f"多出列: {extra}")
+    if not missing and not extra and list(result.columns) != list(expected.columns):
+        problems.append("列的顺序不同")
+    if len(result) != len(expected) or not result.index.equals(expected.index):
+        problems.append(f"索引不同: {len(result)}行，应为{len(expected)}行")
+        return problems
+
+    for name in expected.columns:
+        if name not in result.columns:
+            continue
+        actual, wanted = result[name], expected[name]
+        if actual.dtype != wanted.dtype:
+            problems.append(f"{name}: 数据类型为{actual.dtype}，应为{wanted.dtype}")
+            continue
+        if wanted.dtype.kind == 'f':
+            same = np.isclose(actual.to_numpy(), wanted.to_numpy(),
+                              rtol=FLOAT_RTOL, atol=FLOAT_ATOL, equal_nan=True)
+        else:
+            same = actual.to_numpy() == wanted.to_numpy()
+        if not same.all():
+            rows = np.flatnonzero(~same)
+            problems.append(f"{name}: {len(rows)}行不同，第一处在{expected.index[rows[0]]:%Y-%m-%d}")
+    return problems
+
+
+def golden_plot_path():
+    return os.path.join(GOLDEN_DIR, f'plot_{GOLDEN_PLOT_CASE}.png')
+
+
+def render_golden_plot(path):
+    """用标准结果的前GOLDEN_PLOT_BARS根K线绘图"""
+    bars = pd.read_parquet(golden_path(GOLDEN_PLOT_CASE))[list(BAR_COLUMNS)].iloc[:GOLDEN_PLOT_BARS]
+    plot_macd_system_new(calculate_macd_indicators_new(bars), GOLDEN_PLOT_CASE, output_path=path)
+
+
+def update_golden():
+    """用当前实现重新生成标准结果和标准图片，只应在指标定义或图表有意修改后使用"""
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name, params in GOLDEN_CASES.items():
+        df = SyntheticProvider(**params).fetch(name)
+        result = calculate_macd_indicators_new(df)
+        result.to_parquet(golden_path(name), compression='zstd')
+        print(f"已生成标准结果 {golden_path(name)}: {len(result)}行×{len(result.columns)}列")
+    render_golden_plot(golden_plot_path())
+    print(f"已生成标准图片 {golden_plot_path()}")
+
+
+def compare_renders(expected_path, actual_path, size_tolerance=RENDER_SIZE_TOLERANCE,
+                    pixel_tolerance=RENDER_PIXEL_TOLERANCE, threshold=RENDER_THRESHOLD):
+    """
+    在容差内比较两张图片，返回(问题列表, 不同像素的比例)
+    宽高最多相差size_tolerance像素，在左上角对齐的公共区域内比较，
+    任一通道相差超过threshold的像素视为不同，不同的像素最多占pixel_tolerance
+    """
+    import matplotlib.image as mpimg
+
+    expected = mpimg.imread(expected_path)[..., :3]
+    actual = mpimg.imread(actual_path)[..., :3]
+    problems = []
+    size_diff = np.abs(np.subtract(expected.shape[:2], actual.shape[:2]))
+    if (size_diff > size_tolerance).any():
+        problems.append(f"尺寸为{actual.shape[1]}×{actual.shape[0]}，"
+                        f"标准图片为{expected.shape[1]}×{expected.shape[0]}")
+    height, width = np.minimum(expected.shape[:2], actual.shape[:2])
+    diff = np.abs(expected[:height, :width] - actual[:height, :width]).max(axis=-1)
+    changed = float((diff > threshold).mean())
+    if changed > pixel_tolerance:
+        problems.append(f"{changed:.2%}的像素不同，容差为{pixel_tolerance:.2%}")
+    return problems, changed
+
+
+def check_render():
+    """用当前实现重新绘制标准图片并在容差内比较，返回是否一致"""
+    path = golden_plot_path()
+    if not os.path.exists(path):
+        print(f"[绘图检查] 缺少标准图片 {path}，请先运行 --update-golden")
+        return False
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        actual_path = os.path.join(tmp_dir, 'plot.png')
+        render_golden_plot(actual_path)
+        problems, changed = compare_renders(path, actual_path)
+    if problems:
+        print(f"[绘图检查] {GOLDEN_PLOT_CASE}: 不一致")
+        for problem in problems:
+            print(f"    {problem}")
+        return False
+    print(f"[绘图检查] {GOLDEN_PLOT_CASE}: 在容差内一致（{changed:.2%}的像素不同）")
+    return True
+
+
+def check_golden(backends=None):
+    """
+    把每个标准结果的输入K线重新计算一遍并逐列比较，返回是否全部一致
+    backends为要检查的计算内核（见kernels），默认检查全部可用的内核
+    """
+    ok = True
+    for backend in backends or kernels.available_backends():
+        with kernels.use_backend(backend):
+            ok = _check_golden_cases(f"[结果检查:{backend}]") and ok
+    return ok
+
+
+def _check_golden_cases(label):
+    ok = True
+    for name in GOLDEN_CASES:
+        path = golden_path(name)
+        if not os.path.exists(path):
+            print(f"{label} {name}: 缺少标准结果文件 {path}，请先运行 --update-golden")
+            ok = False
+            continue
+        expected = pd.read_parquet(path)
+        bars = expected[list(BAR_COLUMNS)]
+        problems = compare_columns(calculate_macd_indicators_new(bars), expected)
+        signals = {col: int(expected[col].sum()) for col in ('TG', 'BG', '主升')}
+        if problems:
+            ok = False
+            print(f"{label} {name}: 不一致")
+            for problem in problems:
+                print(f"    {problem}")
+        else:
+            print(f"{label} {name}: 一致（{len(expected.columns)}列，信号数 {signals}）")
+    return ok
+
+
+def measure(func, min_time=0.5, max_rounds=5):
+    """重复运行func直到累计min_time秒或max_rounds次，返回(最短耗时, 平均耗时, 次数)"""
+    times = []
+    while not times or (sum(times) < min_time and len(times) < max_rounds):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times), sum(times) / len(times), len(times)
+
+
+def benchmark_cases(calc_sizes=CALC_SIZES, plot_sizes=PLOT_SIZES, export_sizes=EXPORT_SIZES, tmp_dir=None):
+    """生成(名称, K线数量, 待测函数)，输入数据在生成时准备好，不计入耗时"""
+    def bars(periods):
+        # 分钟频率，50万根K线也不会超出pandas的日期范围
+        return SyntheticProvider(periods=periods, freq='min').fetch('benchmark')
+
+    for periods in calc_sizes:
+        df = bars(periods)
+        close = df['close']
+        dif = (EMA(close, 12) - EMA(close, 26)) * 100
+        dea = EMA(dif, 9)
+        golden_cross = CROSS(dif, dea)
+        yield 'EMA', periods, lambda: EMA(close, 26)
+        yield 'CROSS', periods, lambda: CROSS(dif, dea)
+        yield 'BARSLAST', periods, lambda: BARSLAST(golden_cross)
+        yield 'calculate_macd_indicators_new', periods, lambda: calculate_macd_indicators_new(df)
+
+    for periods in plot_sizes:
+        result = calculate_macd_indicators_new(bars(periods))
+        path = os.path.join(tmp_dir, f'plot_{periods}.png')
+        yield 'plot_macd_system_new', periods, lambda: plot_macd_system_new(result, 'benchmark', output_path=path)
+
+    for periods in export_sizes:
+        result = calculate_macd_indicators_new(bars(periods))
+        path = os.path.join(tmp_dir, f'export_{periods}.xlsx')
+        yield 'export_indicators', periods, lambda: export_indicators(result, path)
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f).get('results', {})
+
+
+def save_baseline(results, path):
+    data = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'results': results,
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"基线已保存到: {path}")
+
+
+def run_benchmarks(baseline=None, tolerance=0.2, **sizes):
+    """
+    运行全部基准，打印与基线对比的表格，返回({名称@K线数量: 最短耗时}, 变慢的项目)
+    最短耗时比基线慢tolerance（默认20%）以上的项目标记为变慢
+    """
+    baseline = baseline or {}
+    results, slower = {}, []
+    print(f"{'基准':<30} {'K线数量':>8} {'最短(ms)':>10} {'平均(ms)':>10} {'次数':>4} "
+          f"{'基线(ms)':>10} {'对比':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, periods, func in benchmark_cases(tmp_dir=tmp_dir, **sizes):
+            key = f'{name}@{periods}'
+            best, mean, rounds = measure(func)
+            results[key] = best
+            line = f"{name:<30} {periods:>8} {best * 1000:>10.2f} {mean * 1000:>10.2f} {rounds:>4}"
+            if key in baseline:
+                ratio = best / baseline[key]
+                mark = ''
+                if ratio > 1 + tolerance and best - baseline[key] > MIN_REGRESSION_SECONDS:
+                    mark = ' 变慢'
+                    slower.append(key)
+                elif ratio < 1 / (1 + tolerance):
+                    mark = ' 变快'
+                line += f" {baseline[key] * 1000:>10.2f} {ratio:>7.2f}x{mark}"
+            print(line, flush=True)
+    return results, slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description="性能基准和指标结果回归检查（离线随机数据）")
+    parser.add_argument('--check-only', action='store_true', help="只检查指标结果，不运行基准")
+    parser.add_argument('--formulas', action='store_true', help="只比较BARSLASTN/HHV/LLV/REF与逐根循环的耗时")
+    parser.add_argument('--update-golden', action='store_true', help="用当前实现重新生成标准结果")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(CALC_SIZES),
+                        help="指标计算基准的K线数量，默认 500 5000 50000 500000")
+    parser.add_argument('--backend', choices=kernels.BACKENDS, default=None,
+                        help="基准使用的计算内核，默认为kernels的当前选择；结果检查覆盖全部可用的内核")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="基线文件路径")
+    parser.add_argument('--save-baseline', action='store_true', help="把本次耗时保存为基线")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="比基线慢多少算变慢，默认0.2即20%%")
+    parser.add_argument('--fail-on-regression', action='store_true', help="有变慢的项目时退出码为1")
+    args = parser.parse_args()
+
+    if args.update_golden:
+        update_golden()
+        return 0
+    if args.formulas:
+        benchmark_formulas()
+        return 0
+
+    ok = check_golden()
+    ok = check_render() and ok
+    if args.backend:
+        kernels.set_backend(args.backend)
+    print(f"计算内核: {kernels.get_backend()}")
+    if args.check_only:
+        return 0 if ok else 1
+
+    results, slower = run_benchmarks(load_baseline(args.baseline), args.tolerance,
+                                     calc_sizes=args.sizes)
+    if args.save_baseline:
+        save_baseline(results, args.baseline)
+    if slower:
+        print(f"比基线慢{args.tolerance:.0%}以上: {', '.join(slower)}")
+    if not ok:
+        print("指标结果或绘图与标准结果不一致")
+        return 1
+    return 1 if slower and args.fail_on_regression else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
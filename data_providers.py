@@ -0,0 +1,207 @@
+"""
+数据源
+get_stock_data等入口通过数据源获取日线，可选akshare网络数据、本地CSV/Parquet目录或随机生成的模拟数据，
+便于离线回归测试和性能测试；flaky数据源在模拟数据上加入网络延迟和失败，用于测试并发获取
+"""
+import os
+import random
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+PRICE_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def normalize_bars(df):
+    """统一为按日期升序排列、日期为索引的K线数据，空数据返回None"""
+    if df is None or df.empty:
+        return None
+    df = df.copy()
+    if 'date' in df.columns:
+        df = df.set_index('date')
+    df.index = pd.to_datetime(df.index)
+    df.index.name = 'date'
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    columns = [col for col in PRICE_COLUMNS if col in df.columns]
+    return df[columns].astype(float)
+
+
+def _since(df, start_date):
+    if df is None or start_date is None:
+        return df
+    return df[df.index >= pd.Timestamp(start_date)]
+
+
+class DataProvider:
+    """数据源接口：fetch(symbol, start_date)返回start_date（含）之后的日线，日期为索引"""
+
+    name = ''
+    remote = False  # 是否为网络数据源，网络数据源会经过本地K线库缓存
+
+    def fetch(self, symbol, start_date=None):
+        raise NotImplementedError
+
+    def symbols(self):
+        """数据源中可用的品种代码，无法列出时返回空列表"""
+        return []
+
+
+class AkshareProvider(DataProvider):
+    """
+    akshare网络数据：优先使用东方财富指数日线（支持按起始日期获取），
+    接口出错时改用新浪指数日线（只能获取完整历史，再按起始日期筛选）
+    """
+
+    name = 'akshare'
+    remote = True
+
+    def fetch(self, symbol, start_date=None):
+        import akshare as ak
+        start = '19900101' if start_date is None else pd.Timestamp(start_date).strftime('%Y%m%d')
+        try:
+            df = ak.stock_zh_index_daily_em(symbol=symbol, start_date=start, end_date='20500101')
+        except Exception as e:
+            print(f"东方财富指数日线获取失败，改用新浪指数日线: {e}")
+            df = ak.stock_zh_index_daily(symbol=symbol)
+        return _since(normalize_bars(df), start_date)
+
+
+class LocalFileProvider(DataProvider):
+    """本地目录中的K线文件，每个品种一个{symbol}.parquet或{symbol}.csv（含date列）"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+
+    def fetch(self, symbol, start_date=None):
+        parquet_path = os.path.join(self.root, f"{symbol}.parquet")
+        csv_path = os.path.join(self.root, f"{symbol}.csv")
+        if os.path.exists(parquet_path):
+            df = pd.read_parquet(parquet_path)
+        elif os.path.exists(csv_path):
+            df = pd.read_csv(csv_path)
+        else:
+            return None
+        return _since(normalize_bars(df), start_date)
+
+    def symbols(self):
+        if not os.path.isdir(self.root):
+            return []
+        names = [os.path.splitext(name) for name in sorted(os.listdir(self.root))]
+        return list(dict.fromkeys(stem for stem, ext in names if ext in ('.parquet', '.csv')))
+
+
+class SyntheticProvider(DataProvider):
+    """
+    按品种代码和种子生成固定的随机游走行情，可设置K线数量、起始或结束时间和频率；
+    未指定start时最后一根K线为end（默认今天），与按日期范围筛选的入口（如get_stock_data）配合时不会被整段筛掉
+    """
+
+    name = 'synthetic'
+
+    def __init__(self, periods=2000, seed=0, start=None, end=None, freq='B',
+                 symbol_count=10, volatility=0.012):
+        self.periods = int(periods)
+        self.seed = int(seed)
+        self.start = start
+        self.end = end
+        self.freq = freq
+        self.symbol_count = int(symbol_count)
+        self.volatility = float(volatility)
+
+    def fetch(self, symbol, start_date=None):
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode())])
+        close = 3000 * np.exp(np.cumsum(rng.normal(0, self.volatility, self.periods)))
+        spread = np.abs(rng.normal(0, self.volatility / 2, self.periods))
+        if self.start is not None:
+            index = pd.date_range(self.start, periods=self.periods, freq=self.freq, name='date')
+        else:
+            end = pd.Timestamp(self.end) if self.end is not None else pd.Timestamp.today().normalize()
+            index = pd.date_range(end=end, periods=self.periods, freq=self.freq, name='date')
+        df = pd.DataFrame({
+            'open': close * (1 + rng.normal(0, self.volatility / 4, self.periods)),
+            'high': close * (1 + spread),
+            'low': close * (1 - spread),
+            'close': close,
+            'volume': rng.integers(1_000_000, 10_000_000, self.periods).astype(float)
+        }, index=index)
+        df['high'] = df[['open', 'high']].max(axis=1)
+        df['low'] = df[['open', 'low']].min(axis=1)
+        return _since(df, start_date)
+
+    def symbols(self):
+        return [f"syn{i:05d}" for i in range(self.symbol_count)]
+
+
+class FlakyProvider(DataProvider):
+    """
+    模拟网络数据源的本地替身：每次调用先阻塞latency±jitter秒，按failure_rate抛出ConnectionError，
+    按hang_rate阻塞hang_seconds秒（模拟卡住的请求），其余返回SyntheticProvider的数据；
+    用于在离线环境中测试并发获取、限速、重试和超时（见async_fetch）
+    """
+
+    name = 'flaky'
+
+    def __init__(self, latency=0.2, jitter=0.1, failure_rate=0.2, hang_rate=0.0, hang_seconds=30,
+                 seed=0, **synthetic):
+        self.latency = float(latency)
+        self.jitter = float(jitter)
+        self.failure_rate = float(failure_rate)
+        self.hang_rate = float(hang_rate)
+        self.hang_seconds = float(hang_seconds)
+        self.synthetic = SyntheticProvider(seed=seed, **synthetic)
+        self.calls = 0
+        self.active = 0      # 正在进行的调用数
+        self.max_active = 0  # 同时进行的调用数的最大值
+        self._random = random.Random(int(seed))
+        self._lock = threading.Lock()
+
+    def fetch(self, symbol, start_date=None):
+        with self._lock:
+            self.calls += 1
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+            draw = self._random.random()
+            delay = max(self.latency + self._random.uniform(-self.jitter, self.jitter), 0)
+        try:
+            if draw < self.hang_rate:
+                time.sleep(self.hang_seconds)
+            else:
+                time.sleep(delay)
+            if draw < self.hang_rate + self.failure_rate:
+                raise ConnectionError(f"模拟的网络错误: {symbol}")
+            return self.synthetic.fetch(symbol, start_date)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def symbols(self):
+        return self.synthetic.symbols()
+
+
+def get_provider(spec=None):
+    """
+    按名称创建数据源，默认读取环境变量DATA_PROVIDER（未设置时为akshare）
+    可选 'akshare'、'local:目录'、'synthetic'（可带参数，如 'synthetic:periods=5000,seed=1'）
+    或 'flaky'（模拟延迟和失败，如 'flaky:latency=0.5,failure_rate=0.3'）
+    """
+    if isinstance(spec, DataProvider):
+        return spec
+    spec = spec or os.environ.get('DATA_PROVIDER', 'akshare')
+    name, _, options = spec.partition(':')
+
+    if name == 'akshare':
+        return AkshareProvider()
+    if name == 'local':
+        return LocalFileProvider(options or 'data')
+    if name == 'synthetic':
+        params = dict(item.split('=', 1) for item in options.split(',') if item)
+        return SyntheticProvider(**params)
+    if name == 'flaky':
+        params = dict(item.split('=', 1) for item in options.split(',') if item)
+        return FlakyProvider(**params)
+    raise ValueError(f"未知的数据源: {spec}")
@@ -0,0 +1,241 @@
+"""
+指标数据导出
+支持流式写入的xlsx（内存占用与数据行数无关）、Parquet和Arrow IPC三种格式，
+以及把多个品种一次写入同一个文件的多工作表模式
+"""
+import argparse
+import os
+import time
+import tracemalloc
+from datetime import date
+from io import BytesIO
+
+import pandas as pd
+
+from profiling import profiled
+
+# 可选的导出格式及默认扩展名
+EXPORT_FORMATS = {
+    'xlsx': '.xlsx',      # 流式xlsx，优先使用xlsxwriter的constant_memory模式
+    'openpyxl': '.xlsx',  # 原来的DataFrame.to_excel写法，用于对比
+    'parquet': '.parquet',
+    'arrow': '.arrow',    # Arrow IPC文件格式
+}
+
+# 流式写入时每次转换的行数
+CHUNK_ROWS = 1000
+
+
+def infer_format(path, fmt=None):
+    """未指定格式时按扩展名判断，无法判断时使用xlsx"""
+    if fmt is not None:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"未知的导出格式: {fmt}，可选 {', '.join(EXPORT_FORMATS)}")
+        return fmt
+    ext = os.path.splitext(path)[1].lower() if isinstance(path, str) else ''
+    if ext in ('.arrow', '.feather', '.ipc'):
+        return 'arrow'
+    if ext == '.parquet':
+        return 'parquet'
+    return 'xlsx'
+
+
+def _iter_rows(df):
+    """逐行生成[索引, 各列的值]，转换为Python原生类型，NaN转为空单元格；每次只转换CHUNK_ROWS行"""
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS]
+        index = chunk.index.to_pydatetime() if isinstance(chunk.index, pd.DatetimeIndex) else chunk.index
+        columns = [chunk[col].astype(object).where(chunk[col].notna(), None).tolist()
+                   for col in chunk.columns]
+        for i, label in enumerate(index):
+            yield [label] + [values[i] for values in columns]
+
+
+def _sheet_name(name, used):
+    """工作表名最长31个字符且不能重复"""
+    name = str(name)[:31]
+    base, k = name, 1
+    while name in used:
+        k += 1
+        name = f"{base[:31 - len(str(k)) - 1]}_{k}"
+    used.add(name)
+    return name
+
+
+def _write_xlsx_streaming(sheets, target):
+    """
+    按行流式写入xlsx，sheets为[(工作表名, DataFrame)]
+    有xlsxwriter时使用constant_memory模式，否则使用openpyxl的write_only模式
+    """
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    used = set()
+    if xlsxwriter is not None:
+        workbook = xlsxwriter.Workbook(target, {'constant_memory': True, 'nan_inf_to_errors': True})
+        header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center'})
+        date_format = workbook.add_format({'num_format': 'yyyy-mm-dd'})
+        for name, df in sheets:
+            worksheet = workbook.add_worksheet(_sheet_name(name, used))
+            worksheet.write_row(0, 0, [df.index.name or ''] + [str(col) for col in df.columns], header_format)
+            worksheet.set_column(0, 0, 12)
+            for row, values in enumerate(_iter_rows(df), start=1):
+                if isinstance(values[0], date):
+                    worksheet.write_datetime(row, 0, values[0], date_format)
+                else:
+                    worksheet.write(row, 0, values[0])
+                worksheet.write_row(row, 1, values[1:])
+        workbook.close()
+    else:
+        from openpyxl import Workbook
+        workbook = Workbook(write_only=True)
+        for name, df in sheets:
+            worksheet = workbook.create_sheet(_sheet_name(name, used))
+            worksheet.append([df.index.name or ''] + [str(col) for col in df.columns])
+            for values in _iter_rows(df):
+                worksheet.append(values)
+        workbook.save(target)
+
+
+def _write_openpyxl(sheets, target):
+    """原来的写法：pandas通过openpyxl在内存中构建完整的工作簿"""
+    used = set()
+    with pd.ExcelWriter(target, engine='openpyxl') as writer:
+        for name, df in sheets:
+            df.to_excel(writer, index=True, sheet_name=_sheet_name(name, used))
+
+
+def _combine(sheets):
+    """列式格式没有工作表，多个品种合并为一张表并增加symbol列"""
+    sheets = list(sheets)
+    if len(sheets) == 1:
+        return sheets[0][1]
+    return pd.concat([df.assign(symbol=name) for name, df in sheets])
+
+
+def _write_parquet(sheets, target):
+    _combine(sheets).to_parquet(target)
+
+
+def _write_arrow(sheets, target):
+    import pyarrow as pa
+    table = pa.Table.from_pandas(_combine(sheets))
+    sink = target if not isinstance(target, str) else pa.OSFile(target, 'wb')
+    with pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    if isinstance(target, str):
+        sink.close()
+
+
+_WRITERS = {
+    'xlsx': _write_xlsx_streaming,
+    'openpyxl': _write_openpyxl,
+    'parquet': _write_parquet,
+    'arrow': _write_arrow,
+}
+
+
+@profiled('导出')
+def export_frame(df, target, fmt=None, sheet_name='MACD分析数据'):
+    """
+    导出单个DataFrame（保留索引），target为文件路径或BytesIO等可写对象
+    fmt为EXPORT_FORMATS中的格式，默认按扩展名判断
+    """
+    _WRITERS[infer_format(target, fmt)]([(sheet_name, df)], target)
+
+
+@profiled('导出')
+def export_workbook(frames, target, fmt=None):
+    """
+    多品种模式：把{品种: DataFrame}一次写入同一个文件
+    xlsx每个品种一个工作表；Parquet和Arrow合并为一张表，用symbol列区分品种
+    """
+    _WRITERS[infer_format(target, fmt)](list(frames.items()), target)
+
+
+def export_bytes(df, fmt='xlsx', sheet_name='MACD分析数据'):
+    """导出到内存，返回文件内容，用于网页下载"""
+    output = BytesIO()
+    export_frame(df, output, fmt, sheet_name)
+    return output.getvalue()
+
+
+def _measure(func):
+    """
+    返回(耗时秒数, Python内存峰值MB)；tracemalloc会拖慢纯Python代码，耗时和内存分两次测量
+    tracemalloc不统计Arrow等C扩展自行分配的缓冲区
+    """
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024 / 1024
+
+
+def benchmark(lengths=(2000, 20000), symbol_count=8, output_dir=None):
+    """用离线随机数据比较各导出格式的耗时和内存峰值，最后一行为多品种模式"""
+    import tempfile
+    from judge_strategy import calculate_macd_indicators_new, EXPORT_COLUMNS
+    from data_providers import SyntheticProvider
+
+    def indicators(symbol, periods):
+        df = calculate_macd_indicators_new(SyntheticProvider(periods=periods).fetch(symbol))
+        return df[[col for col in EXPORT_COLUMNS if col in df.columns]]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_dir = output_dir or tmp_dir
+        print(f"{'数据':>16} {'格式':>10} {'耗时(秒)':>10} {'内存峰值(MB)':>12} {'文件(MB)':>10}")
+        cases = []
+        for periods in lengths:
+            df = indicators('syn00000', periods)
+            cases.append((f"{periods}行×{len(df.columns)}列", {'syn00000': df}))
+        frames = {f"syn{i:05d}": indicators(f"syn{i:05d}", lengths[0]) for i in range(symbol_count)}
+        cases.append((f"{symbol_count}个品种×{lengths[0]}行", frames))
+
+        for label, case in cases:
+            for fmt, ext in EXPORT_FORMATS.items():
+                path = os.path.join(output_dir, f"benchmark_{fmt}{ext}")
+                elapsed, peak = _measure(lambda: export_workbook(case, path, fmt))
+                size = os.path.getsize(path) / 1024 / 1024
+                print(f"{label:>16} {fmt:>10} {elapsed:>10.2f} {peak:>12.1f} {size:>10.2f}")
+
+
+def main():
+    from judge_strategy import get_stock_data, calculate_macd_indicators_new, EXPORT_COLUMNS, INDICES_CONFIG
+
+    parser = argparse.ArgumentParser(description="把多个品种的MACD指标导出到同一个文件")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认为全部配置的指数")
+    parser.add_argument('--output', default='macd_analysis_all.xlsx', help="输出文件路径")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default=None,
+                        help="导出格式，默认按扩展名判断")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--benchmark', action='store_true', help="比较各导出格式的耗时和内存")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    frames = {}
+    for symbol in args.symbols or list(INDICES_CONFIG.values()):
+        df = get_stock_data(symbol, provider=args.provider)
+        if df is None:
+            continue
+        df = calculate_macd_indicators_new(df)
+        frames[symbol] = df[[col for col in EXPORT_COLUMNS if col in df.columns]]
+
+    if not frames:
+        print("没有可导出的数据")
+        return
+    export_workbook(frames, args.output, args.format)
+    print(f"{len(frames)}个品种的数据已保存到: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""
+指标计算结果缓存
+以(数据源, 品种, K线周期, 最后一根K线日期, K线数量, 收盘价摘要, 指标参数, 请求的列)为键，只保存计算出的指标数组，不保存输入的K线；
+最后一根K线盘中更新或被修订（日期和数量不变）时收盘价摘要随之改变，不会取到旧的指标；
+同一进程内所有用户会话共享，按LRU + 过期时间淘汰，并限制总内存，记录命中和未命中次数
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+from judge_strategy import calculate_macd_indicators_new, MACDParams
+
+# 默认容量：最多缓存的条目数、总内存上限（字节）和过期时间（秒）
+MAX_ENTRIES = 64
+MAX_BYTES = 256 * 1024 * 1024
+TTL_SECONDS = 6 * 3600
+
+
+def bars_digest(df):
+    """
+    K线日期和收盘价的摘要（全部指标只由收盘价计算），任何一根K线的收盘价或日期变化时摘要都会变化；
+    只对两个数值数组求哈希，2000根K线约几十微秒
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    index = df.index.asi8 if isinstance(df.index, pd.DatetimeIndex) else pd.util.hash_array(df.index.to_numpy())
+    digest.update(np.ascontiguousarray(index).tobytes())
+    digest.update(np.ascontiguousarray(df['close'].to_numpy(dtype=float)).tobytes())
+    return digest.hexdigest()
+
+
+def cache_key(symbol, df, params=None, provider=None, columns=None, timeframe='D'):
+    """
+    缓存键取K线的最后日期、数量和收盘价摘要（见bars_digest）
+    params为指标参数（MACDParams或参数字典，None为默认参数），provider为数据源名称，不同数据源的同一代码分开缓存；
+    columns为请求的指标列，None表示全部指标；timeframe为K线周期（见timeframes），同一品种的各周期分开缓存
+    """
+    params = MACDParams.coerce(params)
+    if columns is not None:
+        columns = tuple(columns)
+    last_date = df.index[-1] if len(df) else None
+    return (str(provider or ''), symbol, timeframe, last_date, len(df), bars_digest(df), params, columns)
+
+
+class _Entry:
+    __slots__ = ('columns', 'nbytes', 'expires')
+
+    def __init__(self, columns, expires):
+        self.columns = columns
+        self.nbytes = sum(values.nbytes for values in columns.values())
+        self.expires = expires
+
+
+class IndicatorCache:
+    """线程安全的LRU + TTL缓存，值为{指标列名: numpy数组}"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES, ttl=TTL_SECONDS,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._computing = {}  # 正在计算的键 -> 锁，同一个键只计算一次
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self._nbytes -= entry.nbytes
+
+    def _evict(self):
+        """先删除过期条目，再按最近最少使用删除，直到满足条目数和内存上限"""
+        now = self.clock()
+        for key in [key for key, entry in self._entries.items() if entry.expires <= now]:
+            self._drop(key)
+            self.evictions += 1
+        while self._entries and (len(self._entries) > self.max_entries or self._nbytes > self.max_bytes):
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _lookup(self, key):
+        """取出未过期的条目并标记为最近使用，调用时需持有锁"""
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires <= self.clock():
+            self._drop(key)
+            self.evictions += 1
+            entry = None
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry.columns
+
+    def get(self, key):
+        """返回缓存的指标数组字典，不存在或已过期时返回None"""
+        with self._lock:
+            columns = self._lookup(key)
+            if columns is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return columns
+
+    def put(self, key, columns):
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            for values in columns.values():
+                values.flags.writeable = False  # 多个会话共享，防止被修改
+            entry = _Entry(columns, self.clock() + self.ttl)
+            if entry.nbytes > self.max_bytes:
+                return  # 单个结果超过内存上限时不缓存
+            self._entries[key] = entry
+            self._nbytes += entry.nbytes
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+
+    def stats(self):
+        """命中和未命中次数、淘汰次数、当前条目数和占用内存"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / total if total else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._nbytes,
+            }
+
+    def get_or_compute(self, key, df, compute=calculate_macd_indicators_new):
+        """
+        返回df加上指标列后的新DataFrame，不修改df
+        未命中时调用compute计算并缓存；多个会话同时请求同一个键时只有一个会话计算，其余等待后直接使用结果
+        """
+        computed = False
+        with self._lock:
+            columns = self._lookup(key)
+            if columns is None:
+                key_lock = self._computing.setdefault(key, threading.Lock())
+        if columns is None:
+            try:
+                with key_lock:
+                    # 等待期间其他会话可能已经算好
+                    with self._lock:
+                        columns = self._lookup(key)
+                    if columns is None:
+                        result = compute(df)
+                        columns = {name: result[name].to_numpy() for name in result.columns
+                                   if name not in df.columns}
+                        self.put(key, columns)
+                        computed = True
+            finally:
+                # compute出错时也要移除，否则该键的锁一直留在_computing中；
+                # 只移除自己用的锁，等待中的会话之后会重新计算
+                with self._lock:
+                    if self._computing.get(key) is key_lock:
+                        del self._computing[key]
+        with self._lock:
+            if computed:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return _rebuild(df, columns)
+
+
+def _rebuild(df, columns):
+    """用输入K线和缓存的指标数组拼出与calculate_macd_indicators_new相同的结果"""
+    indicators = pd.DataFrame(columns, index=df.index, copy=False)
+    return pd.concat([df.fillna(0), indicators], axis=1)
+
+
+# 进程内共享的默认缓存
+default_cache = IndicatorCache()
+
+
+def cached_indicators(symbol, df, params=None, provider=None, cache=None, columns=None, timeframe='D'):
+    """
+    按(品种, 周期, 最后K线日期, 参数)从缓存取指标，未命中时计算并缓存
+    columns不为None时只计算并缓存这些指标列（及其依赖），返回df的全部列加上这些列
+    """
+    cache = default_cache if cache is None else cache
+    params = MACDParams.coerce(params)
+    compute = partial(calculate_macd_indicators_new, params=params,
+                      columns=None if columns is None else list(columns))
+    return cache.get_or_compute(cache_key(symbol, df, params, provider, columns, timeframe), df, compute)
@@ -1,23 +1,57 @@
 import pandas as pd
 import numpy as np
-import akshare as ak
 import matplotlib.pyplot as plt
+from matplotlib.collections import PolyCollection
 from datetime import datetime, timedelta
+from collections import deque
+from functools import lru_cache
 import warnings
 warnings.filterwarnings('ignore')
 import pytz  # 需安装：pip install pytz
+from bar_store import sync_bars
+from data_providers import get_provider
+from exporters import export_frame
+from profiling import profile_run, profile_stage, profiled
+import kernels
 
-def get_stock_data(stock_code):
-    """获取股票数据"""
+# 指数配置 - 使用akshare要求的完整代码格式
+INDICES_CONFIG = {
+    "上证指数 (000001.SH)": "sh000001",
+    "深证成指 (399001.SZ)": "sz399001", 
+    "创业板指 (399006.SZ)": "sz399006",
+    "沪深300 (000300.SH)": "sh000300",
+    "上证50 (000016.SH)": "sh000016",
+    "中证500 (000905.SH)": "sh000905",
+    "中证1000 (000852.SH)": "sh000852",
+    "中证2000ETF (159531.SZ)": "sz159531",
+    "科创综指 (000680.SH)": "sh000688"
+}
+
+@profiled('获取数据')
+def get_stock_data(stock_code, refresh=False, provider=None, start_date='2020-01-01'):
+    """
+    获取股票数据
+    provider为数据源（见data_providers，默认由环境变量DATA_PROVIDER决定）；网络数据源优先读取本地K线库，
+    只补充新增K线，refresh=True时重新获取完整历史；默认只保留2020年1月1日之后的数据，start_date为None时保留全部
+    """
     try:
-        # 设置开始日期为2020年1月1日
         beijing_tz = pytz.timezone('Asia/Shanghai')
         now = datetime.now(beijing_tz)
-        start_date = '2020-01-01'
         end_date = now.strftime('%Y-%m-%d')
         
-        # 使用akshare获取指数数据
-        df = ak.stock_zh_index_daily(symbol=stock_code)
+        # 网络数据源从本地K线库读取并补充最新数据，K线库不可用（如读写失败）时不经K线库直接从数据源获取；
+        # akshare数据源在东方财富接口出错时自行改用新浪接口（见data_providers.AkshareProvider）
+        provider = get_provider(provider)
+        if provider.remote:
+            try:
+                df = sync_bars(stock_code, refresh=refresh, provider=provider)
+            except Exception as e:
+                print(f"本地K线库不可用，不经K线库直接从{provider.name}数据源获取: {e}")
+                df = provider.fetch(stock_code)
+        else:
+            df = provider.fetch(stock_code)
+        if df is not None:
+            df = df.reset_index()
         
         if df is None or df.empty:
             print(f"无法获取股票 {stock_code} 的数据")
@@ -31,7 +65,9 @@ def get_stock_data(stock_code):
             df['date'] = pd.to_datetime(df.index)
         
         # 过滤日期范围
-        df = df[(df['date'] >= start_date) & (df['date'] <= end_date)]
+        if start_date is not None:
+            df = df[df['date'] >= start_date]
+        df = df[df['date'] <= end_date]
         
         if df.empty:
             print(f"过滤后数据为空，请检查日期范围")
@@ -64,357 +100,836 @@ def CROSS(series1, series2):
     return (series1 > series2) & (series1.shift(1) <= series2.shift(1))
 
 def BARSLAST(condition):
-    """计算上一次条件成立到当前的周期数"""
-    result = np.zeros(len(condition))
-    count = 0
-    last_true = False
-    
-    for i in range(len(condition)):
-        if condition.iloc[i]:  # 当前位置条件成立
-            count = 0  # 改为0
-            last_true = True
-        elif last_true:  # 之前有条件成立
-            count += 1
-        result[i] = count
-    
-    return pd.Series(result, index=condition.index)
-
-def calculate_macd_indicators_new(df):
-    """计算修改后的MACD相关指标"""
-    # 基础参数
-    SHORT = 12
-    LONG = 26
-    MID = 9
-    
-    # 基础MACD计算
-    df['DIF'] = (EMA(df['close'], SHORT) - EMA(df['close'], LONG)) * 100
-    df['DEA'] = EMA(df['DIF'], MID)
-    df['MACD'] = 2 * (df['DIF'] - df['DEA'])
-    
-    # MACD柱状图历史数据
-    df['MACD1'] = df['MACD']
-    df['MACD2'] = df['MACD1'].shift(1)  # MACDSR: 1周期前的MACD
-    df['MACD3'] = df['MACD1'].shift(2)  # MACDSSR: 2周期前的MACD
-
-    # DIF转折信号（新增）
-    df['DIF4'] = df['DIF'].shift(1)  # 1周期前的DIF
-    df['DIF5'] = df['DIF'].shift(2)  # 2周期前的DIF
-    df['DIF顶转折'] = (df['DIF'] > df['DEA']) & (df['DIF4'] > df['DIF']) & (df['DIF5'] < df['DIF4'])
-    df['DIF底转折'] = (df['DIF'] < df['DEA']) & (df['DIF4'] < df['DIF']) & (df['DIF5'] > df['DIF4'])
-    
-    # 金叉和死叉
-    df['金叉'] = CROSS(df['DIF'], df['DEA'])
-    df['死叉'] = CROSS(df['DEA'], df['DIF'])
-    
-    # 计算各周期金叉死叉位置
-    df['M1'] = BARSLAST(df['金叉'])  # 最近一次金叉的位置
-    df['N1'] = BARSLAST(df['死叉'])  # 最近一次死叉的位置
-    
-    # 计算M2和M3（到当前的周期数）
-    df['M2'] = 0  # 初始化M2
-    df['M3'] = 0  # 初始化M3
-    
-    for i in range(len(df)):
-        # 获取当前位置之前的所有金叉位置
-        prev_data = df.iloc[:i+1]
-        cross_positions = prev_data[prev_data['金叉']].index
-        
-        if len(cross_positions) >= 2:  # 至少有两次金叉才能计算M2
-            second_last_cross = cross_positions[-2]  # 倒数第二次金叉位置
-            df.loc[df.index[i], 'M2'] = len(df.loc[second_last_cross:df.index[i]]) - 1
-            
-        if len(cross_positions) >= 3:  # 至少有三次金叉才能计算M3
-            third_last_cross = cross_positions[-3]  # 倒数第三次金叉位置
-            df.loc[df.index[i], 'M3'] = len(df.loc[third_last_cross:df.index[i]]) - 1
+    """计算上一次条件成立到当前的周期数，逐根递推由kernels中当前选择的计算内核完成"""
+    return pd.Series(kernels.barslast(condition), index=condition.index)
+
+def _wrap(values, like):
+    """把计算结果包装成与like相同形状的Series或DataFrame（面板数据为日期×品种）"""
+    if isinstance(like, pd.DataFrame):
+        return pd.DataFrame(values, index=like.index, columns=like.columns)
+    return pd.Series(values, index=like.index)
+
+def _as_columns(values):
+    """一维数组视为单列，二维数组按列计算"""
+    return values[:, None] if values.ndim == 1 else values
+
+def BARSLASTN(condition, n):
+    """计算倒数第n次条件成立到当前的周期数，不足n次时为0"""
+    flags = np.asarray(condition, dtype=bool)
+    columns = _as_columns(flags)  # 面板数据按列分别计算
+    order = np.cumsum(columns, axis=0) - n  # 当前位置之前倒数第n次成立是该列的第几次成立
+    event_cols, event_rows = np.nonzero(columns.T)  # 所有条件成立的位置，按列排列
+    offsets = np.concatenate([[0], np.cumsum(columns.sum(axis=0))[:-1]])
     
-    # 填充NaN值
-    df['M2'] = df['M2'].fillna(0)
-    df['M3'] = df['M3'].fillna(0)
+    result = np.zeros(columns.shape, dtype=np.int64)
+    rows, cols = np.nonzero(order >= 0)
+    result[rows, cols] = rows - event_rows[offsets[cols] + order[rows, cols]]
+    return _wrap(result.reshape(flags.shape), condition)
+
+def _range_extreme(values, start, end, func):
+    """用稀疏表计算每列中每个区间[start, end]内的极值，func为np.fmax或np.fmin"""
+    # 第k层的第j行为values[j:j+2**k]的极值
+    table = [values]
+    span = 1
+    while span * 2 <= len(values):
+        prev = table[-1]
+        table.append(func(prev[:-span], prev[span:]))
+        span *= 2
     
-    # 计算N2和N3（到当前的周期数）
-    df['N2'] = 0  # 初始化N2
-    df['N3'] = 0  # 初始化N3
+    result = np.full(start.shape, np.nan)
+    cols = np.broadcast_to(np.arange(values.shape[1]), start.shape)
+    level = np.floor(np.log2(end - start + 1)).astype(np.int64)
+    for k in np.unique(level):
+        mask = level == k
+        result[mask] = func(table[k][start[mask], cols[mask]],
+                            table[k][end[mask] - 2 ** k + 1, cols[mask]])
+    return result
+
+def _window_extreme(series, periods, func):
+    """计算以当前位置结尾、长度为periods的窗口内的极值，periods可逐行变化"""
+    values = np.asarray(series, dtype=float)
+    columns = _as_columns(values)
+    end = np.broadcast_to(np.arange(len(values))[:, None], columns.shape)
+    periods = np.broadcast_to(np.asarray(periods, dtype=np.int64), values.shape).reshape(columns.shape)
+    start = np.maximum(end - periods + 1, 0)
+    result = _range_extreme(columns, start, end, func)
+    return _wrap(result.reshape(values.shape), series)
+
+def HHV(series, periods):
+    """计算periods周期内的最高值"""
+    return _window_extreme(series, periods, np.fmax)
+
+def LLV(series, periods):
+    """计算periods周期内的最低值"""
+    return _window_extreme(series, periods, np.fmin)
+
+def REF(series, periods):
+    """引用periods周期前的值，超出数据起点时为0"""
+    values = np.asarray(series, dtype=float)
+    columns = _as_columns(values)
+    periods = np.broadcast_to(np.asarray(periods, dtype=np.int64), values.shape).reshape(columns.shape)
+    ref = np.arange(len(values))[:, None] - periods
+    cols = np.broadcast_to(np.arange(columns.shape[1]), columns.shape)
     
-    for i in range(len(df)):
-        # 获取当前位置之前的所有死叉位置
-        prev_data = df.iloc[:i+1]
-        cross_positions = prev_data[prev_data['死叉']].index
-        
-        if len(cross_positions) >= 2:  # 至少有两次死叉才能计算N2
-            second_last_cross = cross_positions[-2]  # 倒数第二次死叉位置
-            df.loc[df.index[i], 'N2'] = len(df.loc[second_last_cross:df.index[i]]) - 1
-            
-        if len(cross_positions) >= 3:  # 至少有三次死叉才能计算N3
-            third_last_cross = cross_positions[-3]  # 倒数第三次死叉位置
-            df.loc[df.index[i], 'N3'] = len(df.loc[third_last_cross:df.index[i]]) - 1
+    result = np.zeros(columns.shape)
+    valid = ref >= 0
+    result[valid] = columns[ref[valid], cols[valid]]
+    return _wrap(result.reshape(values.shape), series)
+
+class RollingArgExtreme:
+    """滚动窗口内最近一次极值的位置，单调队列实现，每根K线均摊O(1)"""
     
-    # 填充NaN值
-    df['N2'] = df['N2'].fillna(0)
-    df['N3'] = df['N3'].fillna(0)
+    def __init__(self, window, highest=True):
+        self.window = window
+        self.highest = highest
+        self.count = 0  # 已输入的K线数量
+        self._queue = deque()  # (位置, 值)，值单调，队首为当前极值
     
-    # 计算各周期高低点位置
-    for i in range(len(df)):
-        m1 = int(df['M1'].iloc[i])
-        
-        # 初始化列（如果不存在）
-        for col in ['CH1', 'CH2', 'CH3', 'DIFH1', 'DIFH2', 'DIFH3']:
-            if col not in df.columns:
-                df[col] = 0
-        
-        # CH1和DIFH1：M1+1日内的最高值
-        if i >= m1:
-            start_idx = max(0, i-m1-1)  # M1+1日前的位置
-            df.loc[df.index[i], 'CH1'] = df['close'].iloc[start_idx:i+1].max()
-            df.loc[df.index[i], 'DIFH1'] = df['DIF'].iloc[start_idx:i+1].max()
+    def update(self, value):
+        """输入下一根K线的值，返回窗口内最近一次极值的位置，窗口内全为NaN时返回None"""
+        pos = self.count
+        self.count += 1
         
-        # CH2和DIFH2：M1+1日前的CH1和DIFH1
-        if i > m1:
-            ref_idx = i - (m1 + 1)  # 向前推M1+1日
-            if ref_idx >= 0:
-                df.loc[df.index[i], 'CH2'] = df['CH1'].iloc[ref_idx]
-                df.loc[df.index[i], 'DIFH2'] = df['DIFH1'].iloc[ref_idx]
+        if not np.isnan(value):
+            # 相等的旧值也出队，保证并列时最近一次极值优先
+            if self.highest:
+                while self._queue and self._queue[-1][1] <= value:
+                    self._queue.pop()
+            else:
+                while self._queue and self._queue[-1][1] >= value:
+                    self._queue.pop()
+            self._queue.append((pos, value))
         
-        # CH3和DIFH3：M1+1日前的CH2和DIFH2
-        if i > m1:
-            ref_idx = i - (m1 + 1)  # 向前推M1+1日
-            if ref_idx >= 0:
-                df.loc[df.index[i], 'CH3'] = df['CH2'].iloc[ref_idx]
-                df.loc[df.index[i], 'DIFH3'] = df['DIFH2'].iloc[ref_idx]
+        # 移除滑出窗口的元素
+        while self._queue and self._queue[0][0] <= pos - self.window:
+            self._queue.popleft()
         
-        n1 = int(df['N1'].iloc[i])
-        
-        # 初始化列（如果不存在）
-        for col in ['CL1', 'CL2', 'CL3', 'DIFL1', 'DIFL2', 'DIFL3']:
-            if col not in df.columns:
-                df[col] = 0
-        
-        # CL1和DIFL1：N1+1日内的最低值
-        if i >= n1:
-            start_idx = max(0, i-n1-1)  # N1+1日前的位置
-            df.loc[df.index[i], 'CL1'] = df['close'].iloc[start_idx:i+1].min()
-            df.loc[df.index[i], 'DIFL1'] = df['DIF'].iloc[start_idx:i+1].min()
-        
-        # CL2和DIFL2：N1+1日前的CL1和DIFL1
-        if i > n1:
-            ref_idx = i - (n1 + 1)  # 向前推N1+1日
-            if ref_idx >= 0:
-                df.loc[df.index[i], 'CL2'] = df['CL1'].iloc[ref_idx]
-                df.loc[df.index[i], 'DIFL2'] = df['DIFL1'].iloc[ref_idx]
-        
-        # CL3和DIFL3：N1+1日前的CL2和DIFL2
-        if i > n1:
-            ref_idx = i - (n1 + 1)  # 向前推N1+1日
-            if ref_idx >= 0:
-                df.loc[df.index[i], 'CL3'] = df['CL2'].iloc[ref_idx]
-                df.loc[df.index[i], 'DIFL3'] = df['DIFL2'].iloc[ref_idx]
-    
-    # 计算PDIFH1和MDIFH1（新增）
-    df['PDIFH1'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFH1']))) - 1 if x['DIFH1'] > 0 
-        else int(np.log10(abs(x['DIFH1']))) - 1 if x['DIFH1'] < 0 
-        else 0, axis=1)
-    df['MDIFH1'] = df.apply(lambda x: 
-        int(x['DIFH1'] / (10 ** x['PDIFH1'])) if x['PDIFH1'] != 0 
-        else int(x['DIFH1']), axis=1)
-    
-    # 计算PDIFH2和MDIFH2
-    df['PDIFH2'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFH2']))) - 1 if x['DIFH2'] > 0 
-        else int(np.log10(abs(x['DIFH2']))) - 1 if x['DIFH2'] < 0 
-        else 0, axis=1)
-    df['MDIFH2'] = df.apply(lambda x: 
-        int(x['DIFH2'] / (10 ** x['PDIFH2'])) if x['PDIFH2'] != 0 
-        else int(x['DIFH2']), axis=1)
-
-    # 计算PDIFH3和MDIFH3
-    df['PDIFH3'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFH3']))) - 1 if x['DIFH3'] > 0 
-        else int(np.log10(abs(x['DIFH3']))) - 1 if x['DIFH3'] < 0 
-        else 0, axis=1)
-    df['MDIFH3'] = df.apply(lambda x: 
-        int(x['DIFH3'] / (10 ** x['PDIFH3'])) if x['PDIFH3'] != 0 
-        else int(x['DIFH3']), axis=1)
-
-    # 计算MDIFT2和MDIFT3
-    df['MDIFT2'] = df.apply(lambda x: 
-        int(x['DIF'] / (10 ** x['PDIFH2'])) if x['PDIFH2'] != 0 
-        else int(x['DIF']), axis=1)
-    df['MDIFT3'] = df.apply(lambda x: 
-        int(x['DIF'] / (10 ** x['PDIFH3'])) if x['PDIFH3'] != 0 
-        else int(x['DIF']), axis=1)
-
-    # 计算PDIFL1和MDIFL1（新增）
-    df['PDIFL1'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFL1']))) - 1 if x['DIFL1'] > 0 
-        else int(np.log10(abs(x['DIFL1']))) - 1 if x['DIFL1'] < 0 
-        else 0, axis=1)
-    df['MDIFL1'] = df.apply(lambda x: 
-        int(x['DIFL1'] / (10 ** x['PDIFL1'])) if x['PDIFL1'] != 0 
-        else int(x['DIFL1']), axis=1)
-
-    # 计算PDIFL2和MDIFL2（底背离）
-    df['PDIFL2'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFL2']))) - 1 if x['DIFL2'] > 0 
-        else int(np.log10(abs(x['DIFL2']))) - 1 if x['DIFL2'] < 0 
-        else 0, axis=1)
-    df['MDIFL2'] = df.apply(lambda x: 
-        int(x['DIFL2'] / (10 ** x['PDIFL2'])) if x['PDIFL2'] != 0 
-        else int(x['DIFL2']), axis=1)
-
-    # 计算PDIFL3和MDIFL3
-    df['PDIFL3'] = df.apply(lambda x: 
-        int(np.log10(abs(x['DIFL3']))) - 1 if x['DIFL3'] > 0 
-        else int(np.log10(abs(x['DIFL3']))) - 1 if x['DIFL3'] < 0 
-        else 0, axis=1)
-    df['MDIFL3'] = df.apply(lambda x: 
-        int(x['DIFL3'] / (10 ** x['PDIFL3'])) if x['PDIFL3'] != 0 
-        else int(x['DIFL3']), axis=1)
-
-    # 计算MDIFB2和MDIFB3
-    df['MDIFB2'] = df.apply(lambda x: 
-        int(x['DIF'] / (10 ** x['PDIFL2'])) if x['PDIFL2'] != 0 
-        else int(x['DIF']), axis=1)
-    df['MDIFB3'] = df.apply(lambda x: 
-        int(x['DIF'] / (10 ** x['PDIFL3'])) if x['PDIFL3'] != 0 
-        else int(x['DIF']), axis=1)
-    
-    # 修改后的顶背离判断（新增DEA>0条件）
-    df['直接顶背离'] = ((df['CH1'] > df['CH2']) & 
-                    (df['MDIFT2'] < df['MDIFH2']) & 
-                    ((df['MACD'] > 0) & (df['MACD'].shift(1) > 0)) & 
-                    (df['MDIFT2'] >= df['MDIFT2'].shift(1)) &
-                    (df['DEA'] > 0))
-    
-    df['隔峰顶背离'] = ((df['CH1'] > df['CH3']) & (df['MDIFH3'] >= df['MDIFH2']) &
-                    (df['MDIFT3'] < df['MDIFH3']) & 
-                    ((df['MACD'] > 0) & (df['MACD'].shift(1) > 0)) & 
-                    (df['MDIFT3'] >= df['MDIFT3'].shift(1)) &
-                    (df['DEA'] > 0))
-    
-    # 修改后的底背离判断（新增DEA<0条件）
-    df['直接底背离'] = ((df['CL1'] < df['CL2']) & 
-                    (df['MDIFB2'] > df['MDIFL2']) & 
-                    ((df['MACD'] < 0) & (df['MACD'].shift(1) < 0)) & 
-                    (df['MDIFB2'] <= df['MDIFB2'].shift(1)) &
-                    (df['DEA'] < 0))
-    
-    df['隔峰底背离'] = ((df['CL1'] < df['CL3']) & 
-                    (df['MDIFB3'] > df['MDIFL3']) & 
-                    ((df['MACD'] < 0) & (df['MACD'].shift(1) < 0)) & 
-                    (df['MDIFB3'] <= df['MDIFB3'].shift(1)) &
-                    (df['DEA'] < 0))
-    
-    # 顶底背离信号合并
-    df['T'] = df['直接顶背离'] | df['隔峰顶背离']
-    df['B'] = df['直接底背离'] | df['隔峰底背离']
-    
-    # 修改后的顶底背离确认信号(TG和BG) - 基于DIF转折
-    df['直接TG'] = (df['DIF']<df['DIF4'] & df['直接顶背离'].shift(1) & (df['DIF'] > 0))
-    df['隔峰TG'] = (df['DIF']<df['DIF4'] & df['隔峰顶背离'].shift(1) & (df['DIF'] > 0))
-    df['TG'] = df['直接TG'] | df['隔峰TG']
+        return self._queue[0][0] if self._queue else None
     
-    df['直接BG'] = (df['DIF']>df['DIF4'] & df['直接底背离'].shift(1) & (df['DIF'] < 0))
-    df['隔峰BG'] = (df['DIF']>df['DIF4'] & df['隔峰底背离'].shift(1) & (df['DIF'] < 0))
-    df['BG'] = df['直接BG'] | df['隔峰BG']
-    
-    # 将TG和BG转换为数值：TG=True时为1，BG=True时为-1，其他为0
-    df['TG_数值'] = df['TG'].astype(int)
-    df['BG_数值'] = -df['BG'].astype(int)
-    
-    # 修改后的背离消失条件
-    df['直接顶背离消失'] = (df['直接顶背离'].shift(1) & (df['MDIFH1'] > df['MDIFH2']))
-    df['隔峰顶背离消失'] = (df['隔峰顶背离'].shift(1) & (df['MDIFH1'] > df['MDIFH3']))
-    
-    df['直接底背离消失'] = (df['直接底背离'].shift(1) & (df['MDIFL1'] <= df['MDIFL2']))
-    df['隔峰底背离消失'] = (df['隔峰底背离'].shift(1) & (df['MDIFL1'] <= df['MDIFL3']))
-    
-    # 钝化信号
-    df['底钝化'] = df['B']  
-    df['顶钝化'] = df['T']
-    
-    # 结构信号
-    df['顶结构'] = df['TG']
-    df['底结构'] = df['BG']
-    
-    # 最终背离信号
-    df['顶背离'] = df['T'] | df['顶结构']
-    df['底背离'] = df['B'] | df['底结构']
-    
-    # 买卖信号
-    df['GOLDEN_CROSS'] = CROSS(df['DIF'], df['DEA'])
-    df['DEATH_CROSS'] = CROSS(df['DEA'], df['DIF'])
-    
-    df['低位金叉'] = df['GOLDEN_CROSS'] & (df['DIF'] < -0.1)
-    df['二次金叉'] = (df['GOLDEN_CROSS'] & 
-                   (df['DEA'] < 0) & 
-                   (df['金叉'].rolling(21).sum() == 2))
-    
-    # 趋势判断
-    # 计算120和250日内MACD最大值
-    df['MACD120_MAX'] = df['MACD'].rolling(120).max()
-    df['MACD250_MAX'] = df['MACD'].rolling(250).max()
+    @property
+    def value(self):
+        """当前窗口内的极值"""
+        return self._queue[0][1] if self._queue else np.nan
+
+def _bars_since_extreme(series, periods, highest):
+    """计算periods周期内最近一次极值到当前的周期数，逐根递推由kernels中当前选择的计算内核完成"""
+    return pd.Series(kernels.bars_since_extreme(series, periods, highest), index=series.index)
+
+def HHVBARS(series, periods):
+    """计算periods周期内最近一次最高值到当前的周期数"""
+    return _bars_since_extreme(series, periods, highest=True)
+
+def LLVBARS(series, periods):
+    """计算periods周期内最近一次最低值到当前的周期数"""
+    return _bars_since_extreme(series, periods, highest=False)
+
+def magnitude_normalize(values, magnitude=None):
+    """
+    按数量级截断标准化，支持一维或二维数组（如多个品种的T×N面板）
+    数量级P = int(log10(|x|)) - 1，x为0或NaN时P为0；截断值M = int(x / 10**P)，NaN时为0
+    传入magnitude时按给定数量级截断，返回(P, M)
+    """
+    values = np.asarray(values, dtype=float)
+    valid = np.isfinite(values)
     
-    # 计算MACD120和MACD250
-    for i in range(len(df)):
-        # 对于MACD120
-        if i >= 120:
-            window = df['MACD'].iloc[i-120:i+1]
-            max_pos = window[window == window.max()].index[-1]  # 找到最近的最大值位置
-            df.loc[df.index[i], 'MACD120'] = df.loc[max_pos, 'MACD'] / 2
-        else:
-            df.loc[df.index[i], 'MACD120'] = df.loc[df.index[i], 'MACD'] / 2
-            
-        # 对于MACD250
-        if i >= 250:
-            window = df['MACD'].iloc[i-250:i+1]
-            max_pos = window[window == window.max()].index[-1]  # 找到最近的最大值位置
-            df.loc[df.index[i], 'MACD250'] = df.loc[max_pos, 'MACD'] / 2
-        else:
-            df.loc[df.index[i], 'MACD250'] = df.loc[df.index[i], 'MACD'] / 2
+    if magnitude is None:
+        magnitude = np.zeros(values.shape, dtype=np.int64)
+        nonzero = valid & (values != 0)
+        magnitude[nonzero] = np.trunc(np.log10(np.abs(values[nonzero]))).astype(np.int64) - 1
+    else:
+        magnitude = np.broadcast_to(np.asarray(magnitude, dtype=np.int64), values.shape)
     
-    # XG信号和强势区判断
-    df['XG'] = (df['MACD120'] != df['MACD120'].shift(1))
-    df['强势区'] = (df['MACD'] >= df['MACD250'])
+    scaled = np.zeros(values.shape, dtype=np.int64)
+    scaled[valid] = np.trunc(values[valid] / np.power(10.0, magnitude[valid])).astype(np.int64)
+    return magnitude, scaled
+
+class _Columns(dict):
+    """
+    指标计算的工作区：按列保存计算结果，写法与DataFrame的列赋值相同，
+    但不会逐列插入调用方的DataFrame，最后只组装一次结果；
+    params为本次计算的指标参数，memo保存可以在多组参数之间共用的中间结果（如收盘价的EMA）
+    """
+
+    def __init__(self, df, params=None, memo=None):
+        super().__init__((name, df[name]) for name in df.columns)
+        self.index = df.index
+        self.source_columns = set(df.columns)
+        self.params = DEFAULT_PARAMS if params is None else params
+        self.memo = {} if memo is None else memo
+
+    def __setitem__(self, name, values):
+        if not isinstance(values, pd.Series):
+            values = pd.Series(values, index=self.index)
+        super().__setitem__(name, values)
+
+    def __getitem__(self, name):
+        if isinstance(name, list):
+            return pd.DataFrame({key: self[key] for key in name})
+        return super().__getitem__(name)
+
+    def to_frame(self, columns=None, compact=False, release=False):
+        """
+        把NaN填为0后组装成DataFrame，只对含NaN的列做填充，其余列直接使用计算结果，不再整体复制；
+        来自输入的列和与其他列共用数据的列（如MACD1）复制一份，结果与df及各列之间互不影响；
+        release=True表示工作区之后不再使用，紧凑输出时边转换边释放原来的数据
+        """
+        if columns is None:
+            columns = COMPACT_COLUMNS if compact else list(self.keys())
+        release = release and compact
+        if release:
+            # 先释放不输出的中间列，再逐列转换，转换后释放原来的float64/int64数据
+            for name in set(self) - set(columns):
+                dict.pop(self, name)
+        data = {}
+        used = set()
+        for name in columns:
+            if name not in self:
+                continue
+            values = dict.pop(self, name) if release else self[name]
+            if values.hasnans:
+                values = values.fillna(0)
+            elif name in self.source_columns or id(values) in used:
+                values = values.copy()
+            used.add(id(values))
+            data[name] = _compact_values(name, values) if compact else values
+        return pd.DataFrame(data, index=self.index, copy=False)
+
+# 紧凑输出中的整数列：周期数、数量级（float64的数量级在±308以内）和取值为-1/0/1的列
+COUNTER_COLUMNS = ['M1', 'M2', 'M3', 'N1', 'N2', 'N3']
+MAGNITUDE_COLUMNS = [f'PDIF{side}{k}' for side in 'HL' for k in (1, 2, 3)]
+SIGN_COLUMNS = ['TG_数值', 'BG_数值']
+
+def _compact_values(name, values):
+    """
+    按列的含义选择数据类型，同样长度的数据得到相同的类型：
+    周期数不超过K线数量，K线不超过32767根时为int16，否则为int32；其他整数为int32，超出范围时保留int64
+    """
+    if name in SIGN_COLUMNS or name in MAGNITUDE_COLUMNS:
+        return values.astype(np.int8)
+    if name in COUNTER_COLUMNS:
+        return values.astype(np.int16 if len(values) <= np.iinfo(np.int16).max else np.int32)
+    if values.dtype == object:
+        return values.astype(bool)
+    if values.dtype.kind == 'i':
+        info = np.iinfo(np.int32)
+        in_range = len(values) == 0 or (info.min <= values.min() and values.max() <= info.max)
+        return values.astype(np.int32) if in_range else values
+    if values.dtype.kind == 'f':
+        return values.astype(np.float32)
+    return values
+
+# 基础参数（默认值）
+SHORT = 12
+LONG = 26
+MID = 9
+
+class MACDParams:
+    """
+    指标参数，创建后不应修改，可以作为字典的键和缓存键：
+    short/long/mid为DIF和DEA的EMA周期；trend_short/trend_long为MACD120/MACD250的回看周期（列名不随参数变化）；
+    second_cross_window为二次金叉统计金叉次数的窗口；low_cross_level为低位金叉要求DIF低于的值
+    """
+
+    FIELDS = ('short', 'long', 'mid', 'trend_short', 'trend_long', 'second_cross_window', 'low_cross_level')
+
+    def __init__(self, short=SHORT, long=LONG, mid=MID, trend_short=120, trend_long=250,
+                 second_cross_window=21, low_cross_level=-0.1):
+        self.short = int(short)
+        self.long = int(long)
+        self.mid = int(mid)
+        self.trend_short = int(trend_short)
+        self.trend_long = int(trend_long)
+        self.second_cross_window = int(second_cross_window)
+        self.low_cross_level = float(low_cross_level)
+
+    def values(self, fields=FIELDS):
+        return tuple(getattr(self, name) for name in fields)
+
+    def __eq__(self, other):
+        return isinstance(other, MACDParams) and self.values() == other.values()
+
+    def __hash__(self):
+        return hash(self.values())
+
+    def __repr__(self):
+        changed = [f"{name}={getattr(self, name)!r}" for name in self.FIELDS
+                   if getattr(self, name) != getattr(DEFAULT_PARAMS, name, None)]
+        return f"MACDParams({', '.join(changed)})"
+
+    def to_dict(self):
+        return dict(zip(self.FIELDS, self.values()))
+
+    def replace(self, **changes):
+        """返回修改了部分参数的新对象"""
+        return MACDParams(**{**self.to_dict(), **changes})
+
+    @classmethod
+    def coerce(cls, params):
+        """None为默认参数，字典按参数名创建"""
+        if params is None:
+            return DEFAULT_PARAMS
+        if isinstance(params, MACDParams):
+            return params
+        if isinstance(params, dict):
+            return cls(**params)
+        raise TypeError(f"无法转换为指标参数: {params!r}")
+
+    @classmethod
+    def grid(cls, base=None, **values):
+        """参数网格：每个参数给出取值列表，返回所有组合，未给出的参数取base（默认参数）中的值"""
+        base = cls.coerce(base)
+        names = list(values)
+        for name in names:
+            if name not in cls.FIELDS:
+                raise ValueError(f"未知的参数: {name}，可选 {', '.join(cls.FIELDS)}")
+        combos = [{}]
+        for name in names:
+            combos = [{**combo, name: value} for combo in combos for value in values[name]]
+        return [base.replace(**combo) for combo in combos]
+
+DEFAULT_PARAMS = MACDParams()
+
+class IndicatorNode:
+    """
+    指标计算图中的一个节点：func(d)在工作区d中写入outputs列，计算前需要deps列已经存在；
+    params为节点直接用到的参数，all_params还包括上游节点用到的参数，这些参数相同时节点的结果相同
+    """
+
+    def __init__(self, name, outputs, deps, stage, func, params=()):
+        self.name = name
+        self.outputs = outputs
+        self.deps = deps
+        self.stage = stage
+        self.func = func
+        self.params = params
+        upstream = set(params)
+        for dep in deps:
+            if dep in INDICATOR_OUTPUTS:
+                upstream.update(INDICATOR_OUTPUTS[dep].all_params)
+        self.all_params = tuple(name for name in MACDParams.FIELDS if name in upstream)
+
+    def __repr__(self):
+        return f"IndicatorNode({self.name!r}, outputs={self.outputs}, deps={self.deps})"
+
+    def evaluate(self, d):
+        """在工作区d中计算本节点，启用性能记录时按阶段和节点名记录耗时"""
+        with profile_stage(self.stage, len(d.index), self.name):
+            self.func(d)
+
+# 输入K线的列
+BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume')
+
+# 全部指标节点，按注册顺序排列；依赖的节点总是先注册，注册顺序即为计算顺序
+INDICATOR_NODES = {}
+# 指标列名 -> 计算该列的节点
+INDICATOR_OUTPUTS = {}
+
+def indicator(*outputs, deps=(), params=(), stage=None):
+    """
+    注册指标节点的装饰器，outputs为节点写入的列，deps为用到的列（输入K线的列或其他节点的输出），
+    params为节点直接读取的MACDParams参数名
+    """
+    def register(func):
+        for dep in deps:
+            if dep not in INDICATOR_OUTPUTS and dep not in BAR_COLUMNS:
+                raise ValueError(f"节点 {func.__name__} 依赖的列 {dep} 尚未注册")
+        for name in params:
+            if name not in MACDParams.FIELDS:
+                raise ValueError(f"节点 {func.__name__} 使用了未知的参数 {name}")
+        node = IndicatorNode(func.__name__, tuple(outputs), tuple(deps), stage, func, tuple(params))
+        INDICATOR_NODES[node.name] = node
+        for name in outputs:
+            INDICATOR_OUTPUTS[name] = node
+        return func
+    return register
+
+def required_nodes(columns):
+    """计算columns需要的全部节点（含间接依赖），按计算顺序返回；输入K线的列和未知的列不需要节点"""
+    needed = set()
+    stack = [INDICATOR_OUTPUTS[name] for name in columns if name in INDICATOR_OUTPUTS]
+    while stack:
+        node = stack.pop()
+        if node.name in needed:
+            continue
+        needed.add(node.name)
+        stack.extend(INDICATOR_OUTPUTS[dep] for dep in node.deps if dep in INDICATOR_OUTPUTS)
+    return [node for name, node in INDICATOR_NODES.items() if name in needed]
+
+def _close_ema(d, span):
+    """收盘价的EMA，同一个周期在多组参数之间只计算一次"""
+    key = ('EMA', 'close', span)
+    if key not in d.memo:
+        d.memo[key] = EMA(d['close'], span)
+    return d.memo[key]
+
+# 基础MACD计算
+@indicator('DIF', deps=['close'], params=['short', 'long'], stage='EMA/MACD')
+def _dif(d):
+    d['DIF'] = (_close_ema(d, d.params.short) - _close_ema(d, d.params.long)) * 100
+
+@indicator('DEA', 'MACD', deps=['DIF'], params=['mid'], stage='EMA/MACD')
+def _dea(d):
+    d['DEA'] = EMA(d['DIF'], d.params.mid)
+    d['MACD'] = 2 * (d['DIF'] - d['DEA'])
+
+# MACD柱状图历史数据
+@indicator('MACD1', 'MACD2', 'MACD3', deps=['MACD'], stage='EMA/MACD')
+def _macd_history(d):
+    d['MACD1'] = d['MACD']
+    d['MACD2'] = d['MACD1'].shift(1)  # MACDSR: 1周期前的MACD
+    d['MACD3'] = d['MACD1'].shift(2)  # MACDSSR: 2周期前的MACD
+
+# DIF转折信号（新增）
+@indicator('DIF4', 'DIF5', deps=['DIF'], stage='EMA/MACD')
+def _dif_history(d):
+    d['DIF4'] = d['DIF'].shift(1)  # 1周期前的DIF
+    d['DIF5'] = d['DIF'].shift(2)  # 2周期前的DIF
+
+@indicator('DIF顶转折', 'DIF底转折', deps=['DIF', 'DEA', 'DIF4', 'DIF5'], stage='EMA/MACD')
+def _dif_turn(d):
+    d['DIF顶转折'] = (d['DIF'] > d['DEA']) & (d['DIF4'] > d['DIF']) & (d['DIF5'] < d['DIF4'])
+    d['DIF底转折'] = (d['DIF'] < d['DEA']) & (d['DIF4'] < d['DIF']) & (d['DIF5'] > d['DIF4'])
+
+# 金叉和死叉
+@indicator('金叉', '死叉', deps=['DIF', 'DEA'], stage='金叉死叉')
+def _cross(d):
+    d['金叉'] = CROSS(d['DIF'], d['DEA'])
+    d['死叉'] = CROSS(d['DEA'], d['DIF'])
+
+# 计算各周期金叉死叉位置
+@indicator('M1', deps=['金叉'], stage='金叉死叉')
+def _m1(d):
+    d['M1'] = BARSLAST(d['金叉'])  # 最近一次金叉的位置
+
+@indicator('N1', deps=['死叉'], stage='金叉死叉')
+def _n1(d):
+    d['N1'] = BARSLAST(d['死叉'])  # 最近一次死叉的位置
+
+# 计算M2、M3和N2、N3（倒数第2、3次金叉/死叉到当前的周期数）
+@indicator('M2', 'M3', deps=['金叉'], stage='金叉死叉')
+def _m23(d):
+    for k in (2, 3):
+        d[f'M{k}'] = BARSLASTN(d['金叉'], k)
+
+@indicator('N2', 'N3', deps=['死叉'], stage='金叉死叉')
+def _n23(d):
+    for k in (2, 3):
+        d[f'N{k}'] = BARSLASTN(d['死叉'], k)
+
+# 计算各周期高低点位置
+# CH1和DIFH1：M1+1日内的最高值；CH2/CH3：M1+1日前的CH1/CH2
+@indicator('CH1', 'CH2', 'CH3', deps=['close', 'M1'], stage='高低点')
+def _close_highs(d):
+    d['CH1'] = HHV(d['close'], d['M1'] + 2)
+    d['CH2'] = REF(d['CH1'], d['M1'] + 1)
+    d['CH3'] = REF(d['CH2'], d['M1'] + 1)
+
+@indicator('DIFH1', 'DIFH2', 'DIFH3', deps=['DIF', 'M1'], stage='高低点')
+def _dif_highs(d):
+    d['DIFH1'] = HHV(d['DIF'], d['M1'] + 2)
+    d['DIFH2'] = REF(d['DIFH1'], d['M1'] + 1)
+    d['DIFH3'] = REF(d['DIFH2'], d['M1'] + 1)
+
+# CL1和DIFL1：N1+1日内的最低值；CL2/CL3：N1+1日前的CL1/CL2
+@indicator('CL1', 'CL2', 'CL3', deps=['close', 'N1'], stage='高低点')
+def _close_lows(d):
+    d['CL1'] = LLV(d['close'], d['N1'] + 2)
+    d['CL2'] = REF(d['CL1'], d['N1'] + 1)
+    d['CL3'] = REF(d['CL2'], d['N1'] + 1)
+
+@indicator('DIFL1', 'DIFL2', 'DIFL3', deps=['DIF', 'N1'], stage='高低点')
+def _dif_lows(d):
+    d['DIFL1'] = LLV(d['DIF'], d['N1'] + 2)
+    d['DIFL2'] = REF(d['DIFL1'], d['N1'] + 1)
+    d['DIFL3'] = REF(d['DIFL2'], d['N1'] + 1)
+
+def _normalize_levels(d, side, current):
+    """
+    计算PDIF{side}*/MDIF{side}*：高低点DIF的数量级及按数量级截断后的值；
+    MDIF{current}2/3：当前DIF按PDIF{side}2/3截断
+    """
+    magnitude, scaled = magnitude_normalize(d[[f'DIF{side}{k}' for k in (1, 2, 3)]].to_numpy())
+    _, current_scaled = magnitude_normalize(
+        np.repeat(d['DIF'].to_numpy()[:, None], 2, axis=1), magnitude[:, 1:])
+    for k in range(3):
+        d[f'PDIF{side}{k + 1}'] = magnitude[:, k]
+        d[f'MDIF{side}{k + 1}'] = scaled[:, k]
+    for k in range(2):
+        d[f'MDIF{current}{k + 2}'] = current_scaled[:, k]
+
+@indicator('PDIFH1', 'MDIFH1', 'PDIFH2', 'MDIFH2', 'PDIFH3', 'MDIFH3', 'MDIFT2', 'MDIFT3',
+           deps=['DIF', 'DIFH1', 'DIFH2', 'DIFH3'], stage='标准化')
+def _normalize_highs(d):
+    _normalize_levels(d, 'H', 'T')
+
+@indicator('PDIFL1', 'MDIFL1', 'PDIFL2', 'MDIFL2', 'PDIFL3', 'MDIFL3', 'MDIFB2', 'MDIFB3',
+           deps=['DIF', 'DIFL1', 'DIFL2', 'DIFL3'], stage='标准化')
+def _normalize_lows(d):
+    _normalize_levels(d, 'L', 'B')
+
+# 修改后的顶背离判断（新增DEA>0条件）
+@indicator('直接顶背离', '隔峰顶背离',
+           deps=['CH1', 'CH2', 'CH3', 'MDIFH2', 'MDIFH3', 'MDIFT2', 'MDIFT3', 'MACD', 'DEA'], stage='背离')
+def _top_divergence(d):
+    d['直接顶背离'] = ((d['CH1'] > d['CH2']) & 
+                    (d['MDIFT2'] < d['MDIFH2']) & 
+                    ((d['MACD'] > 0) & (d['MACD'].shift(1) > 0)) & 
+                    (d['MDIFT2'] >= d['MDIFT2'].shift(1)) &
+                    (d['DEA'] > 0))
     
-    # 主升判断
-    df['主升'] = (df['XG'] & 
-                (df['XG'] > df['XG'].shift(1)) & 
-                df['强势区'] & 
-                (df['强势区'] > df['强势区'].shift(1)))
+    d['隔峰顶背离'] = ((d['CH1'] > d['CH3']) & (d['MDIFH3'] >= d['MDIFH2']) &
+                    (d['MDIFT3'] < d['MDIFH3']) & 
+                    ((d['MACD'] > 0) & (d['MACD'].shift(1) > 0)) & 
+                    (d['MDIFT3'] >= d['MDIFT3'].shift(1)) &
+                    (d['DEA'] > 0))
+
+# 修改后的底背离判断（新增DEA<0条件）
+@indicator('直接底背离', '隔峰底背离',
+           deps=['CL1', 'CL2', 'CL3', 'MDIFL2', 'MDIFL3', 'MDIFB2', 'MDIFB3', 'MACD', 'DEA'], stage='背离')
+def _bottom_divergence(d):
+    d['直接底背离'] = ((d['CL1'] < d['CL2']) & 
+                    (d['MDIFB2'] > d['MDIFL2']) & 
+                    ((d['MACD'] < 0) & (d['MACD'].shift(1) < 0)) & 
+                    (d['MDIFB2'] <= d['MDIFB2'].shift(1)) &
+                    (d['DEA'] < 0))
     
-    # 填充所有可能的NaN值
-    df = df.fillna(0)
+    d['隔峰底背离'] = ((d['CL1'] < d['CL3']) & 
+                    (d['MDIFB3'] > d['MDIFL3']) & 
+                    ((d['MACD'] < 0) & (d['MACD'].shift(1) < 0)) & 
+                    (d['MDIFB3'] <= d['MDIFB3'].shift(1)) &
+                    (d['DEA'] < 0))
+
+# 顶底背离信号合并
+@indicator('T', deps=['直接顶背离', '隔峰顶背离'], stage='背离')
+def _t(d):
+    d['T'] = d['直接顶背离'] | d['隔峰顶背离']
+
+@indicator('B', deps=['直接底背离', '隔峰底背离'], stage='背离')
+def _b(d):
+    d['B'] = d['直接底背离'] | d['隔峰底背离']
+
+# 修改后的顶底背离确认信号(TG和BG) - 基于DIF转折
+@indicator('直接TG', '隔峰TG', 'TG', deps=['DIF', 'DIF4', '直接顶背离', '隔峰顶背离'], stage='背离')
+def _tg(d):
+    d['直接TG'] = ((d['DIF'] < d['DIF4']) & d['直接顶背离'].shift(1, fill_value=False) & (d['DIF'] > 0))
+    d['隔峰TG'] = ((d['DIF'] < d['DIF4']) & d['隔峰顶背离'].shift(1, fill_value=False) & (d['DIF'] > 0))
+    d['TG'] = d['直接TG'] | d['隔峰TG']
+
+@indicator('直接BG', '隔峰BG', 'BG', deps=['DIF', 'DIF4', '直接底背离', '隔峰底背离'], stage='背离')
+def _bg(d):
+    d['直接BG'] = ((d['DIF'] > d['DIF4']) & d['直接底背离'].shift(1, fill_value=False) & (d['DIF'] < 0))
+    d['隔峰BG'] = ((d['DIF'] > d['DIF4']) & d['隔峰底背离'].shift(1, fill_value=False) & (d['DIF'] < 0))
+    d['BG'] = d['直接BG'] | d['隔峰BG']
+
+# 将TG和BG转换为数值：TG=True时为1，BG=True时为-1，其他为0
+@indicator('TG_数值', deps=['TG'], stage='背离')
+def _tg_value(d):
+    d['TG_数值'] = d['TG'].astype(int)
+
+@indicator('BG_数值', deps=['BG'], stage='背离')
+def _bg_value(d):
+    d['BG_数值'] = -d['BG'].astype(int)
+
+# 修改后的背离消失条件
+@indicator('直接顶背离消失', '隔峰顶背离消失',
+           deps=['直接顶背离', '隔峰顶背离', 'MDIFH1', 'MDIFH2', 'MDIFH3'], stage='背离')
+def _top_divergence_gone(d):
+    d['直接顶背离消失'] = (d['直接顶背离'].shift(1) & (d['MDIFH1'] > d['MDIFH2']))
+    d['隔峰顶背离消失'] = (d['隔峰顶背离'].shift(1) & (d['MDIFH1'] > d['MDIFH3']))
+
+@indicator('直接底背离消失', '隔峰底背离消失',
+           deps=['直接底背离', '隔峰底背离', 'MDIFL1', 'MDIFL2', 'MDIFL3'], stage='背离')
+def _bottom_divergence_gone(d):
+    d['直接底背离消失'] = (d['直接底背离'].shift(1) & (d['MDIFL1'] <= d['MDIFL2']))
+    d['隔峰底背离消失'] = (d['隔峰底背离'].shift(1) & (d['MDIFL1'] <= d['MDIFL3']))
+
+# 钝化信号
+@indicator('底钝化', deps=['B'], stage='背离')
+def _bottom_blunt(d):
+    d['底钝化'] = d['B']
+
+@indicator('顶钝化', deps=['T'], stage='背离')
+def _top_blunt(d):
+    d['顶钝化'] = d['T']
+
+# 结构信号
+@indicator('顶结构', deps=['TG'], stage='背离')
+def _top_structure(d):
+    d['顶结构'] = d['TG']
+
+@indicator('底结构', deps=['BG'], stage='背离')
+def _bottom_structure(d):
+    d['底结构'] = d['BG']
+
+# 最终背离信号
+@indicator('顶背离', deps=['T', '顶结构'], stage='背离')
+def _top_signal(d):
+    d['顶背离'] = d['T'] | d['顶结构']
+
+@indicator('底背离', deps=['B', '底结构'], stage='背离')
+def _bottom_signal(d):
+    d['底背离'] = d['B'] | d['底结构']
+
+# 买卖信号
+@indicator('GOLDEN_CROSS', 'DEATH_CROSS', deps=['DIF', 'DEA'], stage='金叉死叉')
+def _trade_cross(d):
+    d['GOLDEN_CROSS'] = CROSS(d['DIF'], d['DEA'])
+    d['DEATH_CROSS'] = CROSS(d['DEA'], d['DIF'])
+
+@indicator('低位金叉', deps=['GOLDEN_CROSS', 'DIF'], params=['low_cross_level'], stage='金叉死叉')
+def _low_cross(d):
+    d['低位金叉'] = d['GOLDEN_CROSS'] & (d['DIF'] < d.params.low_cross_level)
+
+@indicator('二次金叉', deps=['GOLDEN_CROSS', 'DEA', '金叉'], params=['second_cross_window'], stage='金叉死叉')
+def _second_cross(d):
+    d['二次金叉'] = (d['GOLDEN_CROSS'] & 
+                   (d['DEA'] < 0) & 
+                   (d['金叉'].rolling(d.params.second_cross_window).sum() == 2))
+
+# 趋势判断
+# 计算120和250日内MACD最大值（周期为trend_short/trend_long，列名不变）
+@indicator('MACD120_MAX', 'MACD250_MAX', deps=['MACD'], params=['trend_short', 'trend_long'], stage='趋势')
+def _macd_rolling_max(d):
+    d['MACD120_MAX'] = d['MACD'].rolling(d.params.trend_short).max()
+    d['MACD250_MAX'] = d['MACD'].rolling(d.params.trend_long).max()
+
+# 计算MACD120和MACD250：最近120/250日内（含当日共121/251根）最近一次最大值的一半，
+# 数据不足时取当日MACD的一半
+def _macd_half_max(d, periods):
+    latest_max = REF(d['MACD'], HHVBARS(d['MACD'], periods + 1))
+    return np.where(np.arange(len(d.index)) >= periods, latest_max, d['MACD']) / 2
+
+@indicator('MACD120', deps=['MACD'], params=['trend_short'], stage='趋势')
+def _macd120(d):
+    d['MACD120'] = _macd_half_max(d, d.params.trend_short)
+
+@indicator('MACD250', deps=['MACD'], params=['trend_long'], stage='趋势')
+def _macd250(d):
+    d['MACD250'] = _macd_half_max(d, d.params.trend_long)
+
+# XG信号和强势区判断
+@indicator('XG', deps=['MACD120'], stage='趋势')
+def _xg(d):
+    d['XG'] = (d['MACD120'] != d['MACD120'].shift(1))
+
+@indicator('强势区', deps=['MACD', 'MACD250'], stage='趋势')
+def _strong_zone(d):
+    d['强势区'] = (d['MACD'] >= d['MACD250'])
+
+# 主升判断
+@indicator('主升', deps=['XG', '强势区'], stage='趋势')
+def _main_rise(d):
+    d['主升'] = (d['XG'] & 
+                (d['XG'] > d['XG'].shift(1)) & 
+                d['强势区'] & 
+                (d['强势区'] > d['强势区'].shift(1)))
+
+class IndicatorFrame:
+    """
+    按需计算指标：同一份K线上已经算过的节点不再重复计算，
+    只计算请求的列及其依赖，例如只要TG/BG时不计算MACD120/MACD250和背离消失等列；params为指标参数
+    """
+
+    def __init__(self, df, params=None):
+        self.data = _Columns(df, MACDParams.coerce(params))
+        self.input_columns = list(df.columns)
+        self.done = set()  # 已计算的节点名
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def compute(self, columns):
+        """计算columns（单个列名或列名列表）及其依赖中还没有计算的节点，返回本次计算的节点名"""
+        if isinstance(columns, str):
+            columns = [columns]
+        for name in columns:
+            if name not in INDICATOR_OUTPUTS and name not in self.data:
+                raise KeyError(f"未知的指标: {name}")
+        computed = []
+        for node in required_nodes(columns):
+            if node.name not in self.done:
+                node.evaluate(self.data)
+                self.done.add(node.name)
+                computed.append(node.name)
+        return computed
+
+    def __getitem__(self, name):
+        """取单列或多列指标，需要时先计算"""
+        self.compute(name)
+        return self.data[name]
+
+    def to_frame(self, columns=None, compact=False):
+        """
+        计算columns（默认为df的全部列加上所有指标列）并组装成DataFrame，NaN填为0；
+        结果复制一份，修改结果不影响之后继续计算其他列
+        """
+        if columns is None:
+            columns = list(dict.fromkeys(self.input_columns + list(INDICATOR_OUTPUTS)))
+        self.compute(columns)
+        with profile_stage('组装结果', len(self.data.index)):
+            result = self.data.to_frame(columns, compact)
+            return result if compact else result.copy()
+
+def calculate_macd_indicators_new(df, compact=False, columns=None, params=None):
+    """
+    计算修改后的MACD相关指标，返回新的DataFrame，不修改df
+    默认返回df的全部列加上所有指标列（含DIF4、MACD2等中间列）；
+    compact=True时只返回columns列出的列（默认COMPACT_COLUMNS），并压缩数据类型：
+    信号为bool，周期数为int16/int32，价格和指标值为float32（计算过程仍使用float64）；
+    columns不为None且compact=False时只返回这些列，数据类型不变；
+    指定columns或compact=True时只计算这些列依赖的节点（见INDICATOR_NODES）；
+    params为指标参数（MACDParams或参数字典），默认为DEFAULT_PARAMS
+    """
+    if columns is None and compact:
+        columns = COMPACT_COLUMNS
+    d = _Columns(df, MACDParams.coerce(params))
+    for node in (INDICATOR_NODES.values() if columns is None else required_nodes(columns)):
+        node.evaluate(d)
     
-    return df
+    # 填充所有可能的NaN值并组装结果
+    with profile_stage('组装结果', len(d.index)):
+        return d.to_frame(columns, compact, release=True)
+
+def sweep_indicators(df, param_sets, columns=None, compact=False):
+    """
+    在同一份K线上计算多组参数，返回{MACDParams: DataFrame}，顺序与param_sets相同（重复的参数组只算一次）
+    param_sets为MACDParams或参数字典的列表，如MACDParams.grid(short=[8, 12], low_cross_level=[-0.1, 0])；
+    columns和compact与calculate_macd_indicators_new相同，每组参数的结果与单独调用时完全一致。
+    每个节点的结果只取决于它及上游节点用到的参数（IndicatorNode.all_params），这些参数相同的参数组共用同一份结果，
+    例如只改变low_cross_level时只重新计算低位金叉，相同周期的收盘价EMA只计算一次；
+    共用的中间结果在最后一个用到它的参数组算完后释放。不同参数组的结果之间可能共用数据，修改前请先copy()
+    """
+    param_sets = list(dict.fromkeys(MACDParams.coerce(params) for params in param_sets))
+    if columns is None and compact:
+        columns = COMPACT_COLUMNS
+    nodes = list(INDICATOR_NODES.values()) if columns is None else required_nodes(columns)
+
+    def node_key(node, params):
+        return node.name, params.values(node.all_params)
 
-def plot_macd_system_new(df, stock_code):
+    # 每个(节点, 相关参数)还会被多少组参数用到，用完即释放
+    remaining = {}
+    for params in param_sets:
+        for node in nodes:
+            key = node_key(node, params)
+            remaining[key] = remaining.get(key, 0) + 1
+
+    shared = {}
+    memo = {}
+    results = {}
+    for params in param_sets:
+        d = _Columns(df, params, memo)
+        for node in nodes:
+            key = node_key(node, params)
+            if key in shared:
+                for name, values in shared[key].items():
+                    d[name] = values
+            else:
+                node.evaluate(d)
+                if remaining[key] > 1:
+                    shared[key] = {name: d[name] for name in node.outputs}
+            remaining[key] -= 1
+            if remaining[key] == 0:
+                shared.pop(key, None)
+        with profile_stage('组装结果', len(d.index)):
+            results[params] = d.to_frame(columns, compact, release=True)
+    return results
+
+def sweep_summary(results, signals=('TG', 'BG', '主升', '低位金叉', '二次金叉')):
+    """把sweep_indicators的结果汇总为每组参数一行：各参数的取值和各信号出现的次数"""
+    rows = []
+    for params, df in results.items():
+        row = params.to_dict()
+        for name in signals:
+            if name in df.columns:
+                row[name] = int(df[name].astype(bool).sum())
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+# 绘图时按优先级尝试的中文字体
+CHINESE_FONTS = ['SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB', 'Arial Unicode MS', 'DejaVu Sans']
+
+@lru_cache(maxsize=None)
+def find_chinese_font():
+    """按优先级查找可用的中文字体，没有找到时使用DejaVu Sans；查找结果缓存，只在第一次绘图时扫描字体"""
+    import matplotlib.font_manager as fm
+    for font in CHINESE_FONTS:
+        try:
+            if fm.FontProperties(family=font).get_name() != 'DejaVu Sans':
+                return font
+        except:
+            continue
+    return 'DejaVu Sans'
+
+def _signal_markers(df):
+    """
+    用布尔掩码取出所有背离柱线和文字标记，按K线顺序排列（同一根K线内保持原来的绘制顺序）
+    返回(柱线x, 起点, 终点, 颜色), (标记x, y, 文字, 向上/向下, 颜色)
+    """
+    dif = df['DIF'].to_numpy(dtype=float)
+    dea = df['DEA'].to_numpy(dtype=float)
+    zero = np.zeros(len(df))
+    s = {name: df[name].to_numpy(dtype=bool) for name in [
+        'DIF顶转折', 'DIF底转折', '直接顶背离', '隔峰顶背离', '直接底背离', '隔峰底背离',
+        'TG', '直接TG', '隔峰TG', 'BG', '直接BG', '隔峰BG', '低位金叉', '二次金叉', '主升']}
+
+    # 柱线：(掩码, 起点, 终点, 颜色)
+    line_layers = [
+        (s['DIF顶转折'], dif, dif * 1.3, '#00FF00'),  # DIF转折
+        (s['DIF底转折'], dif, dif * 1.3, 'yellow'),
+        (s['直接顶背离'], dif, dea, '#00FF00'),  # 顶背离柱线（绿色）
+        (s['隔峰顶背离'] & ~s['直接顶背离'], dif, dea, '#00FFFF'),  # 隔峰顶背离柱线（青色）
+        (s['直接底背离'] & (dif < 0), dif, dea, '#FF4444'),  # 底背离柱线（红色和粉色）
+        (~s['直接底背离'] & s['隔峰底背离'] & (dif < 0), dif, dea, '#FF00FF'),
+        (s['TG'], zero, dif, 'white'),  # 顶结构白柱线
+        (s['BG'], zero, dif, 'white'),  # 底结构白柱线
+    ]
+    # 文字标记：(掩码, y, 文字, 是否标在上方, 颜色)
+    text_layers = [
+        (s['DIF顶转折'], dif * 1.2, 'Z', True, '#00FF00'),
+        (s['DIF底转折'], dif * 1.2, 'Z', False, 'yellow'),
+        (s['TG'] & s['直接TG'] & ~s['隔峰TG'], dif * 1.8, '直接顶', True, 'white'),
+        (s['TG'] & ~s['直接TG'] & s['隔峰TG'], dif * 1.8, '隔峰顶', True, '#00FFFF'),
+        (s['TG'] & s['直接TG'] & s['隔峰TG'], dif * 1.8, '直隔顶', True, '#00FFFF'),
+        (s['BG'] & s['直接BG'] & s['隔峰BG'], dif * 1.8, '直隔底', False, 'white'),
+        (s['BG'] & s['直接BG'] & ~s['隔峰BG'], dif * 1.8, '直接底', False, 'gray'),
+        (s['BG'] & ~s['直接BG'] & s['隔峰BG'], dif * 1.8, '隔峰底', False, 'yellow'),
+        (s['低位金叉'], dif * 1.4, 'B', True, '#FF4444'),  # 买卖信号
+        (s['二次金叉'] & ~s['低位金叉'], dif * 1.4, 'B2', True, '#FF4444'),
+        (s['主升'], (dif + dea) / 2, '升', True, '#FF4444'),  # 主升段
+    ]
+
+    def collect(layers):
+        """合并各层的掩码，按(K线, 层)排序，返回行号、层号和对应的y值"""
+        masks = np.stack([layer[0] for layer in layers])
+        layer_ids, rows = np.nonzero(masks)
+        order = np.lexsort((layer_ids, rows))
+        rows, layer_ids = rows[order], layer_ids[order]
+        return rows, layer_ids, np.stack([layer[1] for layer in layers])[layer_ids, rows]
+
+    rows, ids, ymin = collect(line_layers)
+    ymax = np.stack([layer[2] for layer in line_layers])[ids, rows]
+    lines = (rows, ymin, ymax, [line_layers[k][3] for k in ids])
+    rows, ids, y = collect(text_layers)
+    texts = [(i, y_pos) + text_layers[k][2:] for i, y_pos, k in zip(rows, y, ids)]
+    return lines, texts
+
+
+@profiled('绘图')
+def plot_macd_system_new(df, stock_code, output_path=None):
     """
     绘制修改后的MACD指标系统图
+    output_path为图片保存路径，默认为stock_{stock_code}_macd_chart_new.png
     """
     # 设置中文字体 - 改进字体兼容性
     import matplotlib.font_manager as fm
     
     # 强制设置中文字体
-    plt.rcParams['font.sans-serif'] = ['SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB', 'Arial Unicode MS', 'DejaVu Sans']
+    plt.rcParams['font.sans-serif'] = CHINESE_FONTS
     plt.rcParams['axes.unicode_minus'] = False
     
-    # 尝试设置中文字体，按优先级尝试
-    font_options = ['SimHei', 'Microsoft YaHei', 'PingFang SC', 'Hiragino Sans GB', 'Arial Unicode MS', 'DejaVu Sans']
-    font_found = False
-    
-    for font in font_options:
-        try:
-            test_font = fm.FontProperties(family=font)
-            if test_font.get_name() != 'DejaVu Sans':
-                font_found = True
-                selected_font = font
-                break
-        except:
-            continue
-    
-    # 如果没有找到中文字体，使用默认字体并添加字体回退
-    if not font_found:
-        selected_font = 'DejaVu Sans'
+    # 按优先级选择中文字体（只在第一次调用时查找）
+    selected_font = find_chinese_font()
     
     # 设置暗色背景样式
     plt.style.use('dark_background')
@@ -451,112 +966,24 @@ def plot_macd_system_new(df, stock_code):
     # 绘制零轴线
     ax2.axhline(y=0, color='#666666', linestyle='--', alpha=0.5, label='零轴线')
     
-    # 绘制MACD柱状图
-    colors = ['#FF4444' if x >= 0 else '#00FF00' for x in df['MACD']]
-    ax2.bar(x_index, df['MACD'], color=colors, width=0.8, alpha=0.6)
+    # 绘制MACD柱状图：所有柱子合并为一个PolyCollection，效果与ax2.bar相同，但不必为每根K线创建一个矩形
+    macd = df['MACD'].to_numpy(dtype=float)
+    left, right, base = np.arange(len(df)) - 0.4, np.arange(len(df)) + 0.4, np.zeros(len(df))
+    bars = PolyCollection(np.stack([np.column_stack([left, base]), np.column_stack([left, macd]),
+                                    np.column_stack([right, macd]), np.column_stack([right, base])], axis=1),
+                          facecolors=np.where(macd >= 0, '#FF4444', '#00FF00'),
+                          edgecolors='none', alpha=0.6)
+    bars.sticky_edges.y.append(0)  # 与bar一样以零轴为边界，不在零轴外留白
+    ax2.add_collection(bars)
     
-    # 绘制背离柱线和标记
-    for i, idx in enumerate(df.index):
-        x_pos = x_index[i]  # 使用数字索引位置
-        
-        # DIF转折标记
-        if df.loc[idx, 'DIF顶转折']:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DIF']*1.3,
-                      color='#00FF00', linewidth=2, alpha=0.8)
-            ax2.annotate('Z', (x_pos, df.loc[idx, 'DIF']*1.2),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='#00FF00')
-        
-        if df.loc[idx, 'DIF底转折']:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DIF']*1.3,
-                      color='yellow', linewidth=2, alpha=0.8)
-            ax2.annotate('Z', (x_pos, df.loc[idx, 'DIF']*1.2),
-                        xytext=(0, -10), textcoords='offset points',
-                        ha='center', va='top', color='yellow')
-        
-        # 顶背离柱线（绿色）
-        if df.loc[idx, '直接顶背离']:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DEA'],
-                      color='#00FF00', linewidth=2, alpha=0.8)
-        
-        # 隔峰顶背离柱线（青色）
-        if df.loc[idx, '隔峰顶背离'] and not df.loc[idx, '直接顶背离']:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DEA'],
-                      color='#00FFFF', linewidth=2, alpha=0.8)
-        
-        # 底背离柱线（红色和粉色）
-        if df.loc[idx, '直接底背离'] and df.loc[idx, '隔峰底背离'] and df.loc[idx, 'DIF'] < 0:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DEA'],
-                      color='#FF4444', linewidth=2, alpha=0.8)
-        elif df.loc[idx, '直接底背离'] and not df.loc[idx, '隔峰底背离'] and df.loc[idx, 'DIF'] < 0:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DEA'],
-                      color='#FF4444', linewidth=2, alpha=0.8)
-        elif not df.loc[idx, '直接底背离'] and df.loc[idx, '隔峰底背离'] and df.loc[idx, 'DIF'] < 0:
-            ax2.vlines(x_pos, df.loc[idx, 'DIF'], df.loc[idx, 'DEA'],
-                      color='#FF00FF', linewidth=2, alpha=0.8)
-        
-        # 顶结构白柱线
-        if df.loc[idx, 'TG']:
-            ax2.vlines(x_pos, 0, df.loc[idx, 'DIF'],
-                      color='white', linewidth=2, alpha=0.8)
-            # 标记顶结构类型
-            if df.loc[idx, '直接TG'] and not df.loc[idx, '隔峰TG']:
-                ax2.annotate('直接顶', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, 10), textcoords='offset points',
-                            ha='center', va='bottom', color='white')
-            elif not df.loc[idx, '直接TG'] and df.loc[idx, '隔峰TG']:
-                ax2.annotate('隔峰顶', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, 10), textcoords='offset points',
-                            ha='center', va='bottom', color='#00FFFF')
-            elif df.loc[idx, '直接TG'] and df.loc[idx, '隔峰TG']:
-                ax2.annotate('直隔顶', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, 10), textcoords='offset points',
-                            ha='center', va='bottom', color='#00FFFF')
-        
-        # 底结构白柱线
-        if df.loc[idx, 'BG']:
-            ax2.vlines(x_pos, 0, df.loc[idx, 'DIF'],
-                      color='white', linewidth=2, alpha=0.8)
-            # 标记底结构类型
-            if df.loc[idx, '直接BG'] and df.loc[idx, '隔峰BG']:
-                ax2.annotate('直隔底', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, -10), textcoords='offset points',
-                            ha='center', va='top', color='white')
-            elif df.loc[idx, '直接BG'] and not df.loc[idx, '隔峰BG']:
-                ax2.annotate('直接底', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, -10), textcoords='offset points',
-                            ha='center', va='top', color='gray')
-            elif not df.loc[idx, '直接BG'] and df.loc[idx, '隔峰BG']:
-                ax2.annotate('隔峰底', (x_pos, df.loc[idx, 'DIF']*1.8),
-                            xytext=(0, -10), textcoords='offset points',
-                            ha='center', va='top', color='yellow')
-        
-        # 背离消失标记
-        '''
-        if df.loc[idx, '直接顶背离消失']:
-            ax2.annotate('消失1', (x_pos, df.loc[idx, 'DIF']*1.2),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='white')
-        elif df.loc[idx, '隔峰顶背离消失']:
-            ax2.annotate('消失2', (x_pos, df.loc[idx, 'DIF']*1.5),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='white')
-        '''
-        # 买卖信号标记
-        if df.loc[idx, '低位金叉']:
-            ax2.annotate('B', (x_pos, df.loc[idx, 'DIF']*1.4),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='#FF4444')
-        elif df.loc[idx, '二次金叉']:
-            ax2.annotate('B2', (x_pos, df.loc[idx, 'DIF']*1.4),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='#FF4444')
-        
-        # 主升段标记
-        if df.loc[idx, '主升']:
-            ax2.annotate('升', (x_pos, (df.loc[idx, 'DIF']+df.loc[idx, 'DEA'])/2),
-                        xytext=(0, 10), textcoords='offset points',
-                        ha='center', va='bottom', color='#FF4444')
+    # 绘制背离柱线和标记：所有柱线合并为一个LineCollection，按K线顺序绘制
+    (line_x, line_start, line_end, line_colors), texts = _signal_markers(df)
+    if len(line_x):
+        ax2.vlines(line_x, line_start, line_end, colors=line_colors, linewidth=2, alpha=0.8)
+    for x_pos, y_pos, text, above, color in texts:
+        ax2.annotate(text, (x_pos, y_pos),
+                    xytext=(0, 10 if above else -10), textcoords='offset points',
+                    ha='center', va='bottom' if above else 'top', color=color)
     
     # 设置图例
     ax2.legend(loc='upper left', bbox_to_anchor=(0, 1.15), ncol=4,
@@ -580,65 +1007,116 @@ def plot_macd_system_new(df, stock_code):
     plt.tight_layout()
     
     # 保存图表
-    plt.savefig(f'stock_{stock_code}_macd_chart_new.png', 
+    if output_path is None:
+        output_path = f'stock_{stock_code}_macd_chart_new.png'
+    plt.savefig(output_path, 
                 bbox_inches='tight', 
                 dpi=300, 
                 facecolor='black',
                 edgecolor='none')
     plt.close()
 
+def benchmark_plot(lengths=(250, 1000, 2500, 5000)):
+    """用离线随机数据测试不同K线数量下plot_macd_system_new的绘图耗时（dpi=300）"""
+    import os
+    import tempfile
+    import time
+    from data_providers import SyntheticProvider
+
+    print(f"{'K线数量':>8} {'信号标记':>8} {'耗时(秒)':>10}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for periods in lengths:
+            df = calculate_macd_indicators_new(SyntheticProvider(periods=periods).fetch('benchmark'))
+            (line_x, _, _, _), texts = _signal_markers(df)
+            start = time.perf_counter()
+            plot_macd_system_new(df, 'benchmark', output_path=os.path.join(tmp_dir, f'{periods}.png'))
+            elapsed = time.perf_counter() - start
+            print(f"{periods:>8} {len(line_x) + len(texts):>8} {elapsed:>10.2f}")
+
+def benchmark_memory(lengths=(2000, 20000, 200000)):
+    """用离线随机数据比较完整输出和紧凑输出的计算耗时、内存峰值（tracemalloc）和结果大小"""
+    import time
+    import tracemalloc
+    from data_providers import SyntheticProvider
+
+    print(f"{'K线数量':>8} {'模式':>6} {'耗时(秒)':>10} {'内存峰值(MB)':>12} {'结果(MB)':>10} {'列数':>6}")
+    for periods in lengths:
+        df = SyntheticProvider(periods=periods, freq='min').fetch('benchmark')
+        for label, compact in (('完整', False), ('紧凑', True)):
+            tracemalloc.start()
+            start = time.perf_counter()
+            result = calculate_macd_indicators_new(df, compact=compact)
+            elapsed = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            size = result.memory_usage(deep=True).sum()
+            print(f"{periods:>8} {label:>6} {elapsed:>10.2f} {peak / 1024 / 1024:>12.1f} "
+                  f"{size / 1024 / 1024:>10.1f} {len(result.columns):>6}")
+            del result
+
+# 输出到Excel的列
+EXPORT_COLUMNS = [
+    'close',  # 收盘价
+    'DIF',    # DIF线
+    'DEA',    # DEA线
+    'MACD',   # MACD柱
+    'DIF顶转折', 'DIF底转折',  # DIF转折信号
+    '金叉',   # 金叉信号
+    'M1', 'M2', 'M3',  # 金叉周期
+    'CH1', 'CH2', 'CH3',  # 高点价格    
+    'DIFH1', 'DIFH2', 'DIFH3',  # 高点DIF值
+    'PDIFH1', 'PDIFH2','PDIFH3', #取对数
+    'MDIFH1', 'MDIFT2', 'MDIFT3',  # 标准化DIF（顶背离）
+    'MDIFH2', 'MDIFH3',  # 标准化高点DIF
+    '直接顶背离', '隔峰顶背离',  # 顶背离信号
+    'T', # 顶背离信号
+    '直接TG', '隔峰TG', 'TG', # 顶背离确认信号
+    '顶钝化',
+    '直接顶背离消失', '隔峰顶背离消失',
+    '死叉',  # 死叉信号
+    'N1', 'N2', 'N3',  # 死叉周期
+    'CL1', 'CL2', 'CL3',  # 低点价格
+    'DIFL1', 'DIFL2', 'DIFL3',  # 低点DIF值
+    'PDIFL1', 'PDIFL2','PDIFL3', #取对数
+    'MDIFL1', 'MDIFB2', 'MDIFB3',  # 标准化当前DIF（底背离）
+    'MDIFL2', 'MDIFL3',  # 标准化低点DIF
+    '直接底背离', '隔峰底背离',  # 底背离信号
+    'B',  # 底背离信号
+    '直接BG', '隔峰BG', 'BG',  # 底背离确认信号
+    '底钝化',  # 钝化信号
+    '直接底背离消失', '隔峰底背离消失',
+    '主升' # 主升信号   
+]
+
+# 紧凑输出默认保留的列：导出、绘图和网页显示用到的列，不含DIF4、MACD2等中间列
+COMPACT_COLUMNS = EXPORT_COLUMNS + ['低位金叉', '二次金叉', 'TG_数值', 'BG_数值']
+
+def export_indicators(df, path, fmt=None):
+    """
+    把指标计算结果中EXPORT_COLUMNS列出的列保存到文件
+    fmt为导出格式（xlsx、openpyxl、parquet、arrow，见exporters），默认按扩展名判断，xlsx为流式写入
+    """
+    # 确保所有列都存在
+    existing_columns = [col for col in EXPORT_COLUMNS if col in df.columns]
+    export_frame(df[existing_columns], path, fmt)
+
 def main():
     stock_code = input("请输入股票代码（例如：sh000001）：")
-    df = get_stock_data(stock_code)
-    if df is None:
-        return
-    
-    df = calculate_macd_indicators_new(df)
-    
-    # 选择需要输出到Excel的列
-    columns_to_export = [
-        'close',  # 收盘价
-        'DIF',    # DIF线
-        'DEA',    # DEA线
-        'MACD',   # MACD柱
-        'DIF顶转折', 'DIF底转折',  # DIF转折信号
-        '金叉',   # 金叉信号
-        'M1', 'M2', 'M3',  # 金叉周期
-        'CH1', 'CH2', 'CH3',  # 高点价格    
-        'DIFH1', 'DIFH2', 'DIFH3',  # 高点DIF值
-        'PDIFH1', 'PDIFH2','PDIFH3', #取对数
-        'MDIFH1', 'MDIFT2', 'MDIFT3',  # 标准化DIF（顶背离）
-        'MDIFH2', 'MDIFH3',  # 标准化高点DIF
-        '直接顶背离', '隔峰顶背离',  # 顶背离信号
-        'T', # 顶背离信号
-        '直接TG', '隔峰TG', 'TG', # 顶背离确认信号
-        '顶钝化',
-        '直接顶背离消失', '隔峰顶背离消失',
-        '死叉',  # 死叉信号
-        'N1', 'N2', 'N3',  # 死叉周期
-        'CL1', 'CL2', 'CL3',  # 低点价格
-        'DIFL1', 'DIFL2', 'DIFL3',  # 低点DIF值
-        'PDIFL1', 'PDIFL2','PDIFL3', #取对数
-        'MDIFL1', 'MDIFB2', 'MDIFB3',  # 标准化当前DIF（底背离）
-        'MDIFL2', 'MDIFL3',  # 标准化低点DIF
-        '直接底背离', '隔峰底背离',  # 底背离信号
-        'B',  # 底背离信号
-        '直接BG', '隔峰BG', 'BG',  # 底背离确认信号
-        '底钝化',  # 钝化信号
-        '直接底背离消失', '隔峰底背离消失',
-        '主升' # 主升信号   
-    ]
-    
-    # 确保所有列都存在
-    existing_columns = [col for col in columns_to_export if col in df.columns]
-    
-    excel_path = f'stock_{stock_code}_macd_analysis_new.xlsx'
-    df[existing_columns].to_excel(excel_path)
-    print(f"数据已保存到: {excel_path}")
-    
-    plot_path = f'stock_{stock_code}_macd_chart_new.png'
-    plot_macd_system_new(df, stock_code)
-    print(f"图表已保存到: {plot_path}")
+    # 记录各阶段耗时，结束时输出一行性能摘要
+    with profile_run(stock_code):
+        df = get_stock_data(stock_code)
+        if df is None:
+            return
+        
+        df = calculate_macd_indicators_new(df)
+        
+        excel_path = f'stock_{stock_code}_macd_analysis_new.xlsx'
+        export_indicators(df, excel_path)
+        print(f"数据已保存到: {excel_path}")
+        
+        plot_path = f'stock_{stock_code}_macd_chart_new.png'
+        plot_macd_system_new(df, stock_code)
+        print(f"图表已保存到: {plot_path}")
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -0,0 +1,266 @@
+"""
+逐根K线递推的计算内核
+BARSLAST（上一次条件成立到当前的周期数）和HHVBARS/LLVBARS（窗口内最近一次极值到当前的周期数）
+需要带状态逐根计算，提供三种实现，运行时可以切换：
+    numba  - Numba编译的循环，编译结果缓存到磁盘（cache=True），只有第一次运行需要编译
+    numpy  - 纯NumPy的向量化实现，没有安装Numba时的默认选择
+    python - 原来的逐根循环，速度最慢，作为核对其他实现的参照
+默认使用numba（未安装时为numpy），也可以用环境变量MACD_KERNEL_BACKEND或set_backend()指定
+"""
+import os
+from contextlib import contextmanager
+from collections import deque
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('numba', 'numpy', 'python')
+
+
+# ---------- 逐根循环（参照实现） ----------
+
+def _barslast_python(flags):
+    result = np.zeros(len(flags))
+    count = 0
+    last_true = False
+    for i, flag in enumerate(flags):
+        if flag:  # 当前位置条件成立
+            count = 0
+            last_true = True
+        elif last_true:  # 之前有条件成立
+            count += 1
+        result[i] = count
+    return result
+
+
+def _bars_since_extreme_python(values, window, highest):
+    """单调队列，队首为窗口内的极值；相等的旧值也出队，保证并列时最近一次极值优先"""
+    result = np.full(len(values), np.nan)
+    queue = deque()
+    for i, value in enumerate(values):
+        if not np.isnan(value):
+            if highest:
+                while queue and values[queue[-1]] <= value:
+                    queue.pop()
+            else:
+                while queue and values[queue[-1]] >= value:
+                    queue.pop()
+            queue.append(i)
+        while queue and queue[0] <= i - window:
+            queue.popleft()
+        if queue:
+            result[i] = i - queue[0]
+    return result
+
+
+# ---------- 纯NumPy实现 ----------
+
+def _barslast_numpy(flags):
+    """当前位置减去最近一次成立的位置，从未成立过时为0"""
+    positions = np.arange(len(flags))
+    last = np.maximum.accumulate(np.where(flags, positions, -1)) if len(flags) else positions
+    return np.where(last >= 0, positions - last, 0).astype(float)
+
+
+def _bars_since_extreme_numpy(values, window, highest):
+    """
+    稀疏表保存每个区间内最近一次极值的位置：合并相邻区间时，后一段的极值不小于（不大于）前一段就取后一段，
+    查询时两段重叠区间同样处理，得到窗口内最近一次极值的位置；NaN不参与比较，窗口内全为NaN时结果为NaN
+    """
+    n = len(values)
+    if n == 0:
+        return np.full(0, np.nan)
+    keys = np.where(np.isnan(values), -np.inf, values if highest else -values)
+
+    def later_wins(left, right):
+        # right位置在left之后，极值相等时取right
+        return np.where(keys[right] >= keys[left], right, left)
+
+    table = [np.arange(n)]
+    span = 1
+    while span * 2 <= min(window, n):
+        prev = table[-1]
+        table.append(later_wins(prev[:-span], prev[span:]))
+        span *= 2
+
+    end = np.arange(n)
+    start = np.maximum(end - window + 1, 0)
+    level = np.floor(np.log2(end - start + 1)).astype(np.int64)
+    position = np.empty(n, dtype=np.int64)
+    for k in np.unique(level):
+        mask = level == k
+        position[mask] = later_wins(table[k][start[mask]], table[k][end[mask] - 2 ** k + 1])
+
+    # 窗口内没有有效值时为NaN
+    valid = np.concatenate([[0], np.cumsum(~np.isnan(values))])
+    result = (end - position).astype(float)
+    result[valid[end + 1] - valid[start] == 0] = np.nan
+    return result
+
+
+# ---------- Numba实现 ----------
+
+if numba is not None:
+    @numba.njit(cache=True)
+    def _barslast_numba(flags):
+        result = np.zeros(len(flags))
+        count = 0.0
+        last_true = False
+        for i in range(len(flags)):
+            if flags[i]:
+                count = 0.0
+                last_true = True
+            elif last_true:
+                count += 1.0
+            result[i] = count
+        return result
+
+    @numba.njit(cache=True)
+    def _bars_since_extreme_numba(values, window, highest):
+        n = len(values)
+        result = np.full(n, np.nan)
+        queue = np.empty(n, dtype=np.int64)  # 数组实现的双端队列，队首head，队尾tail（不含）
+        head = 0
+        tail = 0
+        for i in range(n):
+            value = values[i]
+            if not np.isnan(value):
+                while tail > head and ((values[queue[tail - 1]] <= value) if highest
+                                       else (values[queue[tail - 1]] >= value)):
+                    tail -= 1
+                queue[tail] = i
+                tail += 1
+            while tail > head and queue[head] <= i - window:
+                head += 1
+            if tail > head:
+                result[i] = i - queue[head]
+        return result
+
+
+_KERNELS = {
+    'python': (_barslast_python, _bars_since_extreme_python),
+    'numpy': (_barslast_numpy, _bars_since_extreme_numpy),
+}
+if numba is not None:
+    _KERNELS['numba'] = (_barslast_numba, _bars_since_extreme_numba)
+
+
+def available_backends():
+    """当前环境可用的实现"""
+    return [name for name in BACKENDS if name in _KERNELS]
+
+
+def _default_backend():
+    name = os.environ.get('MACD_KERNEL_BACKEND')
+    if name in _KERNELS:
+        return name
+    if name:
+        print(f"计算内核 {name} 不可用，可选 {', '.join(available_backends())}")
+    return 'numba' if 'numba' in _KERNELS else 'numpy'
+
+
+_backend = _default_backend()
+
+
+def get_backend():
+    return _backend
+
+
+def set_backend(name):
+    """切换计算内核，返回原来的内核名；未安装Numba时选择numba会报错"""
+    global _backend
+    if name not in BACKENDS:
+        raise ValueError(f"未知的计算内核: {name}，可选 {', '.join(BACKENDS)}")
+    if name not in _KERNELS:
+        raise ValueError(f"计算内核 {name} 不可用（未安装numba），可选 {', '.join(available_backends())}")
+    previous, _backend = _backend, name
+    return previous
+
+
+@contextmanager
+def use_backend(name):
+    """在with块内临时使用指定的计算内核"""
+    previous = set_backend(name)
+    try:
+        yield
+    finally:
+        set_backend(previous)
+
+
+def barslast(flags):
+    """flags为布尔数组，返回上一次为True到当前的周期数（float数组），从未为True时为0"""
+    return _KERNELS[_backend][0](np.ascontiguousarray(flags, dtype=np.bool_))
+
+
+def bars_since_extreme(values, window, highest=True):
+    """values为浮点数组，返回window周期内最近一次最高（最低）值到当前的周期数，窗口内全为NaN时为NaN"""
+    return _KERNELS[_backend][1](np.ascontiguousarray(values, dtype=np.float64), int(window), bool(highest))
+
+
+def check_equivalence(lengths=(0, 1, 2, 50, 1000, 20000), seeds=range(5), windows=(1, 2, 121, 251),
+                      backends=None):
+    """
+    用随机数据（含NaN、重复值和连续的条件成立）比较各实现（默认为全部可用的实现）与逐根循环的结果，
+    返回不一致的情况列表，为空表示全部一致
+    """
+    backends = available_backends() if backends is None else list(backends)
+    problems = []
+    for n in lengths:
+        for seed in seeds:
+            rng = np.random.default_rng([n, seed])
+            flags = rng.random(n) < rng.choice([0.0, 0.05, 0.5, 1.0])
+            values = np.round(rng.normal(0, 1, n), 1)  # 保留一位小数，产生大量并列的极值
+            values[rng.random(n) < 0.1] = np.nan
+            if seed == 0 and n:
+                values[: n // 2] = np.nan  # 开头连续为NaN
+            expected = _barslast_python(flags)
+            for name in backends:
+                with use_backend(name):
+                    if not np.array_equal(barslast(flags), expected):
+                        problems.append(f"barslast {name} n={n} seed={seed}")
+            for window in windows:
+                for highest in (True, False):
+                    expected = _bars_since_extreme_python(values, window, highest)
+                    for name in backends:
+                        with use_backend(name):
+                            actual = bars_since_extreme(values, window, highest)
+                        if not np.array_equal(actual, expected, equal_nan=True):
+                            problems.append(f"bars_since_extreme {name} n={n} seed={seed} "
+                                            f"window={window} highest={highest}")
+    return problems
+
+
+def benchmark(lengths=(5000, 50000, 500000)):
+    """比较各实现的耗时，numba的第一次调用单独列出（从磁盘缓存加载或编译）"""
+    import time
+
+    print(f"{'内核':>8} {'K线数量':>8} {'BARSLAST(ms)':>14} {'HHVBARS(ms)':>14}")
+    for name in available_backends():
+        with use_backend(name):
+            if name == 'numba':
+                start = time.perf_counter()
+                barslast(np.zeros(2, dtype=bool))
+                bars_since_extreme(np.zeros(2), 2)
+                print(f"{name:>8} {'首次调用':>8} {(time.perf_counter() - start) * 1000:>14.1f}")
+            for n in lengths:
+                if name == 'python' and n > 50000:
+                    continue
+                rng = np.random.default_rng(n)
+                flags, values = rng.random(n) < 0.05, rng.normal(0, 1, n)
+                timings = []
+                for func, args in ((barslast, (flags,)), (bars_since_extreme, (values, 251))):
+                    start = time.perf_counter()
+                    func(*args)
+                    timings.append((time.perf_counter() - start) * 1000)
+                print(f"{name:>8} {n:>8} {timings[0]:>14.2f} {timings[1]:>14.2f}")
+
+
+if __name__ == "__main__":
+    problems = check_equivalence()
+    print(f"可用的计算内核: {', '.join(available_backends())}，当前: {get_backend()}")
+    print("各实现结果一致" if not problems else "结果不一致:\n" + "\n".join(problems))
+    benchmark()
@@ -0,0 +1,390 @@
+"""
+MACD指标增量计算
+保存最近一根K线的计算状态（EMA值、最近几次金叉死叉位置、滚动窗口和背离标志），
+新增K线时只计算新增的行，结果与calculate_macd_indicators_new使用同一组参数（MACDParams）全量计算一致；
+收盘价为NaN（停牌等）的K线与全量计算一样沿用之前的EMA
+"""
+import hashlib
+import threading
+from collections import OrderedDict, deque
+
+import numpy as np
+import pandas as pd
+
+from judge_strategy import (EMA, BAR_COLUMNS, INDICATOR_OUTPUTS, MACDParams, RollingArgExtreme,
+                            calculate_macd_indicators_new, magnitude_normalize)
+
+
+def _ema_alpha(periods):
+    """与ewm(span=periods)一致的平滑系数"""
+    return 1 / (1 + (periods - 1) / 2)
+
+
+class _EMA:
+    """
+    递推EMA，计算顺序与pandas的ewm(adjust=False)相同，保证结果逐位一致：
+    输入为NaN时数值不变，旧值的权重继续按(1 - alpha)衰减，下一个有效值到来时按衰减后的权重合并
+    """
+
+    __slots__ = ('alpha', 'value', 'weight')
+
+    def __init__(self, periods, value=np.nan, weight=1.0):
+        self.alpha = _ema_alpha(periods)
+        self.value = value
+        self.weight = weight
+
+    @classmethod
+    def from_series(cls, series, periods):
+        """恢复对series逐个递推后的状态：数值为ewm的最后一个值，权重按末尾连续NaN的个数衰减"""
+        ema = cls(periods, float(EMA(series, periods).iloc[-1]) if len(series) else np.nan)
+        if not np.isnan(ema.value):
+            valid = np.flatnonzero(~np.isnan(series.to_numpy(dtype=float)))
+            for _ in range(len(series) - 1 - valid[-1]):
+                ema.weight *= 1 - ema.alpha
+        return ema
+
+    def update(self, value):
+        if np.isnan(self.value):
+            if not np.isnan(value):
+                self.value = value
+                self.weight = 1.0
+            return self.value
+        self.weight *= 1 - self.alpha
+        if not np.isnan(value):
+            if self.value != value:
+                self.value = (self.weight * self.value + self.alpha * value) / (self.weight + self.alpha)
+            self.weight = 1.0
+        return self.value
+
+
+def _level_chain(prev_levels, prev_value, value, bars, func):
+    """
+    递推CH1/CH2/CH3这类高低点链
+    bars为0时从上一根K线重新开窗，CH2/CH3取上一根K线的CH1/CH2；否则沿用上一根K线的窗口
+    """
+    if prev_levels is None:
+        return value, 0.0, 0.0
+    level1, level2, level3 = prev_levels
+    if bars == 0:
+        return func(prev_value, value), level1, level2
+    return func(level1, value), level2, level3
+
+
+def _warm_tracker(window, values, count):
+    """用最近window个值恢复滚动极值的状态"""
+    tracker = RollingArgExtreme(window)
+    values = np.asarray(values, dtype=float)[-window:]
+    tracker.count = count - len(values)
+    for value in values:
+        tracker.update(value)
+    return tracker
+
+
+class MACDState:
+    """增量计算MACD指标所需的状态，占用的内存只与最长回看周期（params.trend_long）有关"""
+
+    def __init__(self, params=None):
+        self.params = params = MACDParams.coerce(params)
+        self.count = 0  # 已计算的K线数量
+        self.last_index = None  # 最后一根K线的索引（日期）
+        self.last_close = np.nan
+        self.last_row = None  # 最后一根K线的全部指标（NaN填充为0之前的值）
+
+        self.ema_short = _EMA(params.short)
+        self.ema_long = _EMA(params.long)
+        self.dea = _EMA(params.mid)
+        self.difs = deque(maxlen=2)  # 最近两根K线的DIF
+        self.macds = deque(maxlen=2)  # 最近两根K线的MACD
+
+        self.golden_positions = deque(maxlen=3)  # 最近三次金叉的位置
+        self.death_positions = deque(maxlen=3)  # 最近三次死叉的位置
+        # 之前second_cross_window-1根K线的金叉标志，用于二次金叉
+        self.golden_flags = deque(maxlen=params.second_cross_window - 1)
+
+        self.valid_count = 0  # 第一个有效收盘价起的K线数量（之前的MACD为NaN，滚动最大值要求窗口内全部有效）
+        self.macd_max120 = RollingArgExtreme(params.trend_short)
+        self.macd_max250 = RollingArgExtreme(params.trend_long)
+        self.trend120 = RollingArgExtreme(params.trend_short + 1)
+        self.trend250 = RollingArgExtreme(params.trend_long + 1)
+
+    @classmethod
+    def from_frame(cls, df, params=None):
+        """
+        从calculate_macd_indicators_new的计算结果恢复状态，params须与计算时相同
+        df缺少部分指标列（如指定了columns）或只有K线时，先用params重新全量计算；
+        compact=True的结果已压缩为float32，无法恢复逐位一致的状态，抛出ValueError
+        """
+        state = cls(params)
+        if df.empty:
+            return state
+        if 'close' not in df.columns:
+            raise ValueError("恢复增量计算状态需要close列")
+        if df['close'].dtype != np.float64 or ('DIF' in df.columns and df['DIF'].dtype != np.float64):
+            raise ValueError("compact=True的计算结果精度不足，无法恢复增量计算状态，"
+                             "请使用compact=False的完整结果或原始K线")
+        if any(name not in df.columns for name in INDICATOR_OUTPUTS):
+            df = calculate_macd_indicators_new(df[[name for name in BAR_COLUMNS if name in df.columns]],
+                                               params=state.params)
+
+        # 计算结果中的NaN已填充为0：收盘价为0的K线视为缺失，第一个有效收盘价之前的DIF/DEA/MACD恢复为NaN
+        n = len(df)
+        close = df['close'].where(df['close'] != 0)
+        valid = np.flatnonzero(close.notna().to_numpy())
+        start = valid[0] if len(valid) else n
+        before_start = np.arange(n) < start
+
+        def values(name):
+            return np.where(before_start, np.nan, df[name].to_numpy(dtype=float))
+
+        dif, dea, macd = values('DIF'), values('DEA'), values('MACD')
+        state.count = n
+        state.valid_count = n - start
+        state.last_index = df.index[-1]
+        state.last_close = float(close.iloc[-1])
+        state.last_row = df.iloc[-1].to_dict()
+        state.last_row.update(close=state.last_close, DIF=dif[-1], DEA=dea[-1], MACD=macd[-1])
+        if start == n:
+            state.last_row.update(MACD120=np.nan, MACD250=np.nan)
+
+        state.ema_short = _EMA.from_series(close, state.params.short)
+        state.ema_long = _EMA.from_series(close, state.params.long)
+        # DIF从第一个有效收盘价起不再为NaN，DEA的权重总是1
+        state.dea = _EMA(state.params.mid, dea[-1])
+        state.difs.extend(dif[-2:])
+        state.macds.extend(macd[-2:])
+
+        state.golden_positions.extend(np.flatnonzero(df['金叉'].to_numpy(dtype=bool))[-3:])
+        state.death_positions.extend(np.flatnonzero(df['死叉'].to_numpy(dtype=bool))[-3:])
+        state.golden_flags.extend(df['金叉'].iloc[-state.golden_flags.maxlen:].astype(bool))
+
+        trend_short, trend_long = state.params.trend_short, state.params.trend_long
+        state.macd_max120 = _warm_tracker(trend_short, macd, n)
+        state.macd_max250 = _warm_tracker(trend_long, macd, n)
+        state.trend120 = _warm_tracker(trend_short + 1, macd, n)
+        state.trend250 = _warm_tracker(trend_long + 1, macd, n)
+        return state
+
+    def update(self, close):
+        """输入一根新K线的收盘价，返回该K线的全部指标（字典，列顺序与全量计算一致）"""
+        i = self.count
+        params = self.params
+        close = float(close)
+        prev = self.last_row
+        first = prev is None
+        row = {}
+
+        # 基础MACD计算
+        dif = (self.ema_short.update(close) - self.ema_long.update(close)) * 100
+        dea = self.dea.update(dif)
+        macd = 2 * (dif - dea)
+        row['DIF'] = dif
+        row['DEA'] = dea
+        row['MACD'] = macd
+
+        # MACD柱状图历史数据和DIF转折信号
+        prev_macd = self.macds[-1] if self.macds else np.nan
+        dif4 = self.difs[-1] if self.difs else np.nan
+        dif5 = self.difs[0] if len(self.difs) == 2 else np.nan
+        row['MACD1'] = macd
+        row['MACD2'] = prev_macd
+        row['MACD3'] = self.macds[0] if len(self.macds) == 2 else np.nan
+        row['DIF4'] = dif4
+        row['DIF5'] = dif5
+        row['DIF顶转折'] = bool(dif > dea and dif4 > dif and dif5 < dif4)
+        row['DIF底转折'] = bool(dif < dea and dif4 < dif and dif5 > dif4)
+
+        # 金叉和死叉
+        golden = not first and dif > dea and prev['DIF'] <= prev['DEA']
+        death = not first and dea > dif and prev['DEA'] <= prev['DIF']
+        row['金叉'] = golden
+        row['死叉'] = death
+        if golden:
+            self.golden_positions.append(i)
+        if death:
+            self.death_positions.append(i)
+
+        # 计算各周期金叉死叉位置
+        for name, positions in (('M', self.golden_positions), ('N', self.death_positions)):
+            row[f'{name}1'] = float(i - positions[-1]) if positions else 0.0
+        for name, positions in (('M', self.golden_positions), ('N', self.death_positions)):
+            for k in (2, 3):
+                row[f'{name}{k}'] = i - positions[-k] if len(positions) >= k else 0
+
+        # 计算各周期高低点位置
+        def levels(names):
+            return None if first else tuple(prev[name] for name in names)
+
+        m1, n1 = row['M1'], row['N1']
+        row['CH1'], row['CH2'], row['CH3'] = _level_chain(
+            levels(['CH1', 'CH2', 'CH3']), self.last_close, close, m1, np.fmax)
+        row['DIFH1'], row['DIFH2'], row['DIFH3'] = _level_chain(
+            levels(['DIFH1', 'DIFH2', 'DIFH3']), dif4, dif, m1, np.fmax)
+        row['CL1'], row['CL2'], row['CL3'] = _level_chain(
+            levels(['CL1', 'CL2', 'CL3']), self.last_close, close, n1, np.fmin)
+        row['DIFL1'], row['DIFL2'], row['DIFL3'] = _level_chain(
+            levels(['DIFL1', 'DIFL2', 'DIFL3']), dif4, dif, n1, np.fmin)
+
+        # 高低点DIF的数量级截断
+        level_columns = ['DIFH1', 'DIFH2', 'DIFH3', 'DIFL1', 'DIFL2', 'DIFL3']
+        magnitude, scaled = magnitude_normalize([row[name] for name in level_columns])
+        current_magnitude = magnitude[[1, 2, 4, 5]]
+        _, current_scaled = magnitude_normalize([dif] * 4, current_magnitude)
+        for j, (side, current) in enumerate([('H', 'T'), ('L', 'B')]):
+            for k in range(3):
+                row[f'PDIF{side}{k + 1}'] = magnitude[3 * j + k]
+                row[f'MDIF{side}{k + 1}'] = scaled[3 * j + k]
+            for k in range(2):
+                row[f'MDIF{current}{k + 2}'] = current_scaled[2 * j + k]
+
+        # 顶底背离判断
+        def rising(name):
+            return not first and row[name] >= prev[name]
+
+        def falling(name):
+            return not first and row[name] <= prev[name]
+
+        macd_up = macd > 0 and prev_macd > 0
+        macd_down = macd < 0 and prev_macd < 0
+        row['直接顶背离'] = bool(row['CH1'] > row['CH2'] and row['MDIFT2'] < row['MDIFH2'] and
+                            macd_up and rising('MDIFT2') and dea > 0)
+        row['隔峰顶背离'] = bool(row['CH1'] > row['CH3'] and row['MDIFH3'] >= row['MDIFH2'] and
+                            row['MDIFT3'] < row['MDIFH3'] and
+                            macd_up and rising('MDIFT3') and dea > 0)
+        row['直接底背离'] = bool(row['CL1'] < row['CL2'] and row['MDIFB2'] > row['MDIFL2'] and
+                            macd_down and falling('MDIFB2') and dea < 0)
+        row['隔峰底背离'] = bool(row['CL1'] < row['CL3'] and row['MDIFB3'] > row['MDIFL3'] and
+                            macd_down and falling('MDIFB3') and dea < 0)
+        row['T'] = row['直接顶背离'] or row['隔峰顶背离']
+        row['B'] = row['直接底背离'] or row['隔峰底背离']
+
+        # 顶底背离确认信号(TG和BG)
+        def previous(name):
+            return not first and bool(prev[name])
+
+        row['直接TG'] = bool(dif < dif4 and previous('直接顶背离') and dif > 0)
+        row['隔峰TG'] = bool(dif < dif4 and previous('隔峰顶背离') and dif > 0)
+        row['TG'] = row['直接TG'] or row['隔峰TG']
+        row['直接BG'] = bool(dif > dif4 and previous('直接底背离') and dif < 0)
+        row['隔峰BG'] = bool(dif > dif4 and previous('隔峰底背离') and dif < 0)
+        row['BG'] = row['直接BG'] or row['隔峰BG']
+        row['TG_数值'] = int(row['TG'])
+        row['BG_数值'] = -int(row['BG'])
+
+        # 背离消失条件
+        row['直接顶背离消失'] = bool(previous('直接顶背离') and row['MDIFH1'] > row['MDIFH2'])
+        row['隔峰顶背离消失'] = bool(previous('隔峰顶背离') and row['MDIFH1'] > row['MDIFH3'])
+        row['直接底背离消失'] = bool(previous('直接底背离') and row['MDIFL1'] <= row['MDIFL2'])
+        row['隔峰底背离消失'] = bool(previous('隔峰底背离') and row['MDIFL1'] <= row['MDIFL3'])
+
+        # 钝化、结构和最终背离信号
+        row['底钝化'] = row['B']
+        row['顶钝化'] = row['T']
+        row['顶结构'] = row['TG']
+        row['底结构'] = row['BG']
+        row['顶背离'] = row['T'] or row['顶结构']
+        row['底背离'] = row['B'] or row['底结构']
+
+        # 买卖信号
+        row['GOLDEN_CROSS'] = golden
+        row['DEATH_CROSS'] = death
+        row['低位金叉'] = golden and dif < params.low_cross_level
+        row['二次金叉'] = bool(golden and dea < 0 and i >= params.second_cross_window - 1 and
+                           sum(self.golden_flags) + golden == 2)
+
+        # 趋势判断
+        self.macd_max120.update(macd)
+        self.macd_max250.update(macd)
+        self.trend120.update(macd)
+        self.trend250.update(macd)
+        self.valid_count += not np.isnan(macd)
+        row['MACD120_MAX'] = self.macd_max120.value if self.valid_count >= params.trend_short else np.nan
+        row['MACD250_MAX'] = self.macd_max250.value if self.valid_count >= params.trend_long else np.nan
+        row['MACD120'] = (self.trend120.value if i >= params.trend_short else macd) / 2
+        row['MACD250'] = (self.trend250.value if i >= params.trend_long else macd) / 2
+
+        # XG信号、强势区和主升判断
+        row['XG'] = first or row['MACD120'] != prev['MACD120']
+        row['强势区'] = macd >= row['MACD250']
+        row['主升'] = bool(row['XG'] and row['强势区'] and not first and
+                         not prev['XG'] and not prev['强势区'])
+
+        # 更新状态，下一根K线与全量计算一样使用填充NaN之前的值
+        self.count += 1
+        self.last_close = close
+        self.last_row = row
+        self.difs.append(dif)
+        self.macds.append(macd)
+        self.golden_flags.append(golden)
+
+        # 与全量计算一样，NaN填充为0
+        return {name: 0.0 if isinstance(value, float) and np.isnan(value) else value
+                for name, value in row.items()}
+
+
+# 最近一次update_macd_indicators结束时的状态，按(参数, 结果的日期和收盘价摘要)保存，
+# 下次传入拼接后的完整结果时直接取出继续计算，不必用MACDState.from_frame重新扫描全部历史
+STATE_CACHE_SIZE = 32
+_states = OrderedDict()
+_states_lock = threading.Lock()
+
+
+class _FrameDigest:
+    """
+    日期和收盘价的摘要，可以在末尾追加K线后继续计算；
+    只对两个数值数组求哈希（每千根K线约25微秒），比from_frame重新计算EMA和滚动窗口快得多
+    """
+
+    def __init__(self):
+        self.dates = hashlib.blake2b(digest_size=16)
+        self.closes = hashlib.blake2b(digest_size=16)
+        self.count = 0
+
+    def update(self, index, close):
+        dates = index.asi8 if isinstance(index, pd.DatetimeIndex) else pd.util.hash_array(index.to_numpy())
+        self.dates.update(np.ascontiguousarray(dates).tobytes())
+        self.closes.update(np.ascontiguousarray(close, dtype=float).tobytes())
+        self.count += len(close)
+        return self
+
+    def key(self, params):
+        return params, self.count, self.dates.hexdigest(), self.closes.hexdigest()
+
+
+def update_macd_indicators(previous, new_bars, params=None):
+    """
+    增量计算新增K线的MACD指标
+    previous可以是MACDState（会被原地更新，使用其自身的参数），也可以是calculate_macd_indicators_new
+    用params计算的结果；只计算索引晚于上次最后一根K线的新K线，返回新增的行。
+    previous为DataFrame时，若它就是上次的previous与返回结果拼接而成，直接沿用上次保存的状态，
+    只有第一次（或历史被修改后）才用MACDState.from_frame扫描全部历史
+    """
+    digest = None
+    if isinstance(previous, MACDState):
+        state = previous
+    else:
+        params = MACDParams.coerce(params)
+        digest = _FrameDigest().update(previous.index, previous['close'].to_numpy(dtype=float))
+        with _states_lock:
+            state = _states.pop(digest.key(params), None)  # 状态会被原地更新，取出后不再对应原来的键
+        if state is None:
+            state = MACDState.from_frame(previous, params)
+
+    if state.last_index is not None:
+        new_bars = new_bars[new_bars.index > state.last_index]
+
+    rows = []
+    for close_value in new_bars['close'].to_numpy(dtype=float):
+        rows.append(state.update(close_value))
+    if len(new_bars):
+        state.last_index = new_bars.index[-1]
+
+    indicators = pd.DataFrame(rows, index=new_bars.index)
+    result = pd.concat([new_bars, indicators], axis=1).fillna(0)
+
+    if digest is not None:
+        combined = digest.update(result.index, result['close'].to_numpy(dtype=float)).key(params)
+        with _states_lock:
+            _states[combined] = state
+            while len(_states) > STATE_CACHE_SIZE:
+                _states.popitem(last=False)
+    return result
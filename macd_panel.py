@@ -0,0 +1,198 @@
+"""
+面板模式的MACD结构指标计算
+多个品种的收盘价按日期对齐成日期×品种的二维数组，所有指标按列一次向量化计算，
+停牌或尚未上市的位置为NaN，计算时跳过，
+结果与逐个品种用同一组参数（MACDParams）调用calculate_macd_indicators_new一致
+"""
+import time
+
+import numpy as np
+import pandas as pd
+
+from judge_strategy import (EMA, CROSS, BARSLASTN, HHV, LLV, REF, MACDParams, magnitude_normalize,
+                            calculate_macd_indicators_new)
+
+# 默认输出的指标
+PANEL_COLUMNS = [
+    'DIF', 'DEA', 'MACD', '金叉', '死叉',
+    '直接顶背离', '隔峰顶背离', '直接底背离', '隔峰底背离',
+    '直接TG', '隔峰TG', 'TG', '直接BG', '隔峰BG', 'BG',
+    '低位金叉', '二次金叉', '主升'
+]
+
+
+def align_closes(frames):
+    """把{品种: get_stock_data返回的DataFrame}按日期对齐成日期×品种的收盘价面板"""
+    return pd.DataFrame({symbol: df['close'] for symbol, df in frames.items() if df is not None})
+
+
+def _like(values, frame):
+    """用frame的行列标签包装二维数组"""
+    return pd.DataFrame(values, index=frame.index, columns=frame.columns)
+
+
+def _pack(closes):
+    """
+    把每个品种的有效数据依次移到顶部，使行号等于该品种的K线序号
+    所有指标只依赖当前和之前的K线，末尾补齐的NaN不会影响有效数据的计算结果
+    """
+    values = closes.to_numpy(dtype=float)
+    valid = ~np.isnan(values)
+    order = np.argsort(~valid, axis=0, kind='stable')  # 有效行在前，保持时间顺序
+    packed = np.take_along_axis(values, order, axis=0)
+    padding = np.arange(len(values))[:, None] >= valid.sum(axis=0)
+    return pd.DataFrame(packed, columns=closes.columns), order, padding, valid
+
+
+def _unpack(packed, order, padding, like):
+    """把按K线序号排列的结果放回原来的日期位置，无效位置数值为NaN、信号为False"""
+    values = np.asarray(packed)
+    if values.dtype == bool:
+        values = values & ~padding
+    else:
+        values = np.where(padding, np.nan, np.nan_to_num(values.astype(float), nan=0.0))
+    result = np.zeros_like(values) if values.dtype == bool else np.full(values.shape, np.nan)
+    np.put_along_axis(result, order, values, axis=0)
+    return pd.DataFrame(result, index=like.index, columns=like.columns)
+
+
+def _panel_indicators(close, params):
+    """在按K线序号排列的面板上计算全部指标，写法与calculate_macd_indicators_new逐项对应"""
+    p = {}
+
+    # 基础MACD计算
+    p['DIF'] = (EMA(close, params.short) - EMA(close, params.long)) * 100
+    p['DEA'] = EMA(p['DIF'], params.mid)
+    p['MACD'] = 2 * (p['DIF'] - p['DEA'])
+    p['MACD2'] = p['MACD'].shift(1)
+    p['MACD3'] = p['MACD'].shift(2)
+
+    # DIF转折信号
+    p['DIF4'] = p['DIF'].shift(1)
+    p['DIF5'] = p['DIF'].shift(2)
+    p['DIF顶转折'] = (p['DIF'] > p['DEA']) & (p['DIF4'] > p['DIF']) & (p['DIF5'] < p['DIF4'])
+    p['DIF底转折'] = (p['DIF'] < p['DEA']) & (p['DIF4'] < p['DIF']) & (p['DIF5'] > p['DIF4'])
+
+    # 金叉和死叉，各周期金叉死叉位置
+    p['金叉'] = CROSS(p['DIF'], p['DEA'])
+    p['死叉'] = CROSS(p['DEA'], p['DIF'])
+    for k in (1, 2, 3):
+        p[f'M{k}'] = BARSLASTN(p['金叉'], k)
+        p[f'N{k}'] = BARSLASTN(p['死叉'], k)
+
+    # 计算各周期高低点位置
+    for name, source in (('CH', close), ('DIFH', p['DIF'])):
+        p[f'{name}1'] = HHV(source, p['M1'] + 2)
+        p[f'{name}2'] = REF(p[f'{name}1'], p['M1'] + 1)
+        p[f'{name}3'] = REF(p[f'{name}2'], p['M1'] + 1)
+    for name, source in (('CL', close), ('DIFL', p['DIF'])):
+        p[f'{name}1'] = LLV(source, p['N1'] + 2)
+        p[f'{name}2'] = REF(p[f'{name}1'], p['N1'] + 1)
+        p[f'{name}3'] = REF(p[f'{name}2'], p['N1'] + 1)
+
+    # 高低点DIF的数量级截断，所有品种和高低点一起计算
+    level_columns = ['DIFH1', 'DIFH2', 'DIFH3', 'DIFL1', 'DIFL2', 'DIFL3']
+    magnitude, scaled = magnitude_normalize(np.stack([p[name] for name in level_columns], axis=-1))
+    _, current_scaled = magnitude_normalize(
+        np.repeat(p['DIF'].to_numpy()[..., None], 4, axis=-1), magnitude[..., [1, 2, 4, 5]])
+    for j, name in enumerate(level_columns):
+        p[f'P{name}'] = _like(magnitude[..., j], close)
+        p[f'M{name}'] = _like(scaled[..., j], close)
+    for j, name in enumerate(['MDIFT2', 'MDIFT3', 'MDIFB2', 'MDIFB3']):
+        p[name] = _like(current_scaled[..., j], close)
+
+    # 顶底背离判断
+    macd_up = (p['MACD'] > 0) & (p['MACD'].shift(1) > 0)
+    macd_down = (p['MACD'] < 0) & (p['MACD'].shift(1) < 0)
+    p['直接顶背离'] = ((p['CH1'] > p['CH2']) & (p['MDIFT2'] < p['MDIFH2']) & macd_up &
+                   (p['MDIFT2'] >= p['MDIFT2'].shift(1)) & (p['DEA'] > 0))
+    p['隔峰顶背离'] = ((p['CH1'] > p['CH3']) & (p['MDIFH3'] >= p['MDIFH2']) &
+                   (p['MDIFT3'] < p['MDIFH3']) & macd_up &
+                   (p['MDIFT3'] >= p['MDIFT3'].shift(1)) & (p['DEA'] > 0))
+    p['直接底背离'] = ((p['CL1'] < p['CL2']) & (p['MDIFB2'] > p['MDIFL2']) & macd_down &
+                   (p['MDIFB2'] <= p['MDIFB2'].shift(1)) & (p['DEA'] < 0))
+    p['隔峰底背离'] = ((p['CL1'] < p['CL3']) & (p['MDIFB3'] > p['MDIFL3']) & macd_down &
+                   (p['MDIFB3'] <= p['MDIFB3'].shift(1)) & (p['DEA'] < 0))
+    p['T'] = p['直接顶背离'] | p['隔峰顶背离']
+    p['B'] = p['直接底背离'] | p['隔峰底背离']
+
+    # 顶底背离确认信号(TG和BG)
+    for kind in ('直接', '隔峰'):
+        p[f'{kind}TG'] = ((p['DIF'] < p['DIF4']) & p[f'{kind}顶背离'].shift(1, fill_value=False) &
+                          (p['DIF'] > 0))
+        p[f'{kind}BG'] = ((p['DIF'] > p['DIF4']) & p[f'{kind}底背离'].shift(1, fill_value=False) &
+                          (p['DIF'] < 0))
+    p['TG'] = p['直接TG'] | p['隔峰TG']
+    p['BG'] = p['直接BG'] | p['隔峰BG']
+
+    # 买卖信号
+    p['低位金叉'] = p['金叉'] & (p['DIF'] < params.low_cross_level)
+    p['二次金叉'] = p['金叉'] & (p['DEA'] < 0) & (p['金叉'].rolling(params.second_cross_window).sum() == 2)
+
+    # 趋势判断：MACD120/MACD250为最近trend_short+1/trend_long+1根K线内的最大值的一半（列名不随参数变化），
+    # 数据不足时取当日MACD的一半
+    bars = np.broadcast_to(np.arange(len(close))[:, None], close.shape)
+    for name, periods in (('MACD120', params.trend_short), ('MACD250', params.trend_long)):
+        latest_max = p['MACD'].rolling(periods + 1).max()
+        p[name] = p['MACD'].where(bars < periods, latest_max) / 2
+    p['XG'] = p['MACD120'] != p['MACD120'].shift(1)
+    p['强势区'] = p['MACD'] >= p['MACD250']
+    p['主升'] = (p['XG'] & (p['XG'] > p['XG'].shift(1)) &
+               p['强势区'] & (p['强势区'] > p['强势区'].shift(1)))
+    return p
+
+
+def calculate_macd_panel(closes, columns=None, params=None):
+    """
+    面板模式计算MACD结构指标
+    closes为日期×品种的收盘价DataFrame，停牌或尚未上市为NaN；
+    params为指标参数（MACDParams或参数字典），默认为DEFAULT_PARAMS；
+    返回{指标名: 日期×品种的DataFrame}，另含'valid'有效数据掩码
+    """
+    columns = PANEL_COLUMNS if columns is None else columns
+    packed, order, padding, valid = _pack(closes)
+    indicators = _panel_indicators(packed, MACDParams.coerce(params))
+
+    result = {name: _unpack(indicators[name], order, padding, closes) for name in columns}
+    result['valid'] = pd.DataFrame(valid, index=closes.index, columns=closes.columns)
+    return result
+
+
+def _synthetic_closes(symbol_count, periods, seed=0):
+    """生成随机游走的收盘价面板，部分品种晚上市或中途停牌"""
+    rng = np.random.default_rng(seed)
+    index = pd.bdate_range('2015-01-01', periods=periods, name='date')
+    values = 3000 * np.exp(np.cumsum(rng.normal(0, 0.012, (periods, symbol_count)), axis=0))
+    listing = rng.integers(0, periods // 2, symbol_count) * (rng.random(symbol_count) < 0.3)
+    values[np.arange(periods)[:, None] < listing] = np.nan
+    values[rng.random(values.shape) < 0.01] = np.nan
+    columns = [f"s{i:05d}" for i in range(symbol_count)]
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def benchmark(symbol_count=300, periods=1500, params=None):
+    """比较面板模式与逐个品种计算的耗时，并核对两者的信号是否一致"""
+    closes = _synthetic_closes(symbol_count, periods)
+
+    start = time.perf_counter()
+    panel = calculate_macd_panel(closes, params=params)
+    panel_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    mismatched = []
+    for symbol in closes.columns:
+        close = closes[symbol].dropna()
+        df = calculate_macd_indicators_new(close.to_frame('close'), params=params)
+        for name in PANEL_COLUMNS:
+            if not np.array_equal(panel[name][symbol][close.index].to_numpy(), df[name].to_numpy()):
+                mismatched.append((symbol, name))
+    single_elapsed = time.perf_counter() - start
+
+    print(f"{symbol_count}个品种 × {periods}根K线")
+    print(f"面板模式: {panel_elapsed:.2f}秒，逐个品种: {single_elapsed:.2f}秒，"
+          f"加速比 {single_elapsed / panel_elapsed:.1f}")
+    print("结果一致" if not mismatched else f"不一致: {mismatched[:10]}")
+
+
+if __name__ == "__main__":
+    benchmark()
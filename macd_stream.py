@@ -0,0 +1,60 @@
+"""
+逐K线流式计算MACD结构信号，适用于分钟线等实时行情
+每次输入一根已完成的K线，常数时间返回该K线的信号，内存只与最长回看周期（默认250）有关
+"""
+import numpy as np
+import pandas as pd
+
+from macd_incremental import MACDState
+
+# update默认返回的指标
+STREAM_COLUMNS = [
+    'DIF', 'DEA', 'MACD',
+    '金叉', '死叉',
+    '直接顶背离', '隔峰顶背离', '直接底背离', '隔峰底背离',
+    '直接TG', '隔峰TG', 'TG',
+    '直接BG', '隔峰BG', 'BG',
+    '主升'
+]
+
+
+class MACDStream:
+    """流式MACD信号引擎"""
+
+    def __init__(self, state=None, columns=None, params=None):
+        self.state = state if state is not None else MACDState(params)
+        self.columns = list(columns) if columns is not None else STREAM_COLUMNS
+
+    @classmethod
+    def from_frame(cls, df, columns=None, params=None):
+        """从calculate_macd_indicators_new用params计算的结果继续流式计算"""
+        return cls(MACDState.from_frame(df, params), columns)
+
+    def update(self, bar, date=None):
+        """
+        输入下一根已完成的K线，返回该K线的信号字典
+        bar可以是收盘价，也可以是包含close（可选date）的字典或Series
+        """
+        if isinstance(bar, (int, float, np.number)):
+            close = bar
+        else:
+            close = bar['close']
+            date = bar.get('date', date)
+
+        last_index = self.state.last_index
+        if date is not None and last_index is not None and date <= last_index:
+            raise ValueError(f"K线时间 {date} 不晚于上一根K线 {last_index}")
+
+        row = self.state.update(close)
+        if date is not None:
+            self.state.last_index = date
+
+        result = {'date': date}
+        for name in self.columns:
+            result[name] = row[name]
+        return result
+
+    def replay(self, bars):
+        """按顺序回放bars的收盘价，返回每根K线的信号，用于与全量计算结果逐列比对"""
+        rows = [self.update(close, date) for date, close in bars['close'].items()]
+        return pd.DataFrame(rows, index=bars.index, columns=['date'] + self.columns)[self.columns]
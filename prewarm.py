@@ -0,0 +1,211 @@
+"""
+收盘后预热
+后台线程在每个交易日收盘后更新全部指数的K线并预先计算指标，结果放入进程内共享的指标缓存，
+页面加载和点击"计算指标"时直接从内存读取；"最新数据截止至"状态也从预热记录中读取，不再访问网络。
+每个品种由同一份日线增量合成周线、月线等周期（见timeframes），各周期的指标都预先计算，切换周期时不需要重新获取数据；
+预热的同时把各品种日线的信号写入事件记录（signal_events），页面查询最近的信号不需要重新计算。
+全部品种的K线并发获取（见async_fetch），带限速、重试和超时，一个卡住的品种不会拖住其他品种。
+交易时段内行情还在变化，页面通过current_bars读取时，超过intraday_ttl秒没有更新的品种先重新获取一次。
+也可以单独运行 python prewarm.py 作为独立进程，定时更新本地K线库
+"""
+import argparse
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from async_fetch import CONCURRENCY, RATE, iter_fetch
+from judge_strategy import get_stock_data, INDICES_CONFIG
+from indicator_cache import default_cache
+from signal_events import SignalEventLog
+from timeframes import DEFAULT_TIMEFRAMES, TimeframeBars, calculate_timeframes
+
+# 每个交易日的预热时间（北京时间，收盘后半小时）
+REFRESH_TIME = (15, 30)
+BEIJING_TZ = pytz.timezone('Asia/Shanghai')
+
+# 开盘时间；开盘到收盘后预热之前，预热的K线超过INTRADAY_TTL秒（与原来页面缓存的有效期相同）就按需重新获取
+MARKET_OPEN = (9, 30)
+INTRADAY_TTL = 3600
+
+
+def next_refresh(now, refresh_time=REFRESH_TIME):
+    """now之后的下一个预热时间，跳过周末（节假日按正常交易日处理，数据不变时只会命中缓存）"""
+    hour, minute = refresh_time
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() >= 5:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def in_trading_session(now, refresh_time=REFRESH_TIME):
+    """now是否在交易日开盘到收盘后预热之间，这段时间内最后一根K线可能还在变化"""
+    if now.weekday() >= 5:
+        return False
+    return MARKET_OPEN <= (now.hour, now.minute) < tuple(refresh_time)
+
+
+class PrewarmScheduler:
+    """后台预热线程，保存每个品种最新的K线和预热状态"""
+
+    def __init__(self, symbols=None, provider=None, cache=None, refresh_time=REFRESH_TIME, columns=None,
+                 timeframes=DEFAULT_TIMEFRAMES, fetch_options=None, intraday_ttl=INTRADAY_TTL):
+        self.symbols = list(symbols) if symbols is not None else list(INDICES_CONFIG.values())
+        self.provider = provider
+        self.columns = columns  # 预先计算的指标列，与页面请求的列相同才能命中缓存，None为全部指标
+        self.timeframes = list(timeframes)  # 预先计算的K线周期
+        self.fetch_options = dict(fetch_options or {})  # 并发获取的设置，如concurrency、rate、timeout
+        self.cache = default_cache if cache is None else cache
+        self.refresh_time = refresh_time
+        self.intraday_ttl = intraday_ttl  # 交易时段内预热K线的有效期（秒）
+        self.last_refresh = None   # 上次预热完成的时间（北京时间）
+        self.next_run = None
+        self.errors = {}
+        self.events = SignalEventLog()  # 预热过的品种的信号事件，只记录columns中有的信号
+        self._bars = {}
+        self._timeframes = {}  # 品种 -> TimeframeBars
+        self._updated = {}     # 品种 -> 上次更新（或盘中尝试更新）的时间
+        self._symbol_locks = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def bars(self, symbol, timeframe='D'):
+        """预热过的K线（timeframe为日线之外的周期时为合成的K线），还没有预热时返回None"""
+        with self._lock:
+            if timeframe == 'D':
+                return self._bars.get(symbol)
+            bars = self._timeframes.get(symbol)
+            return bars.bars.get(timeframe) if bars is not None else None
+
+    def is_stale(self, symbol, now=None):
+        """预热过的品种在交易时段内超过intraday_ttl秒没有更新；还没有预热的品种返回False"""
+        now = now or datetime.now(BEIJING_TZ)
+        with self._lock:
+            updated = self._updated.get(symbol)
+        if updated is None or not in_trading_session(now, self.refresh_time):
+            return False
+        return (now - updated).total_seconds() > self.intraday_ttl
+
+    def current_bars(self, symbol, timeframe='D'):
+        """
+        页面使用的K线：过期（见is_stale）时先重新获取并计算（同一品种同时只获取一次），
+        获取失败时返回原来的K线，intraday_ttl秒后再试；还没有预热的品种返回None
+        """
+        if self.is_stale(symbol):
+            with self._symbol_lock(symbol):
+                if self.is_stale(symbol):
+                    try:
+                        self.refresh(symbol)
+                    except Exception as e:
+                        print(f"盘中更新 {symbol} 失败，继续使用之前的K线: {e}")
+                        with self._lock:
+                            self._updated[symbol] = datetime.now(BEIJING_TZ)
+        return self.bars(symbol, timeframe)
+
+    def _symbol_lock(self, symbol):
+        """同一品种的更新（后台预热和页面按需更新）依次进行"""
+        with self._lock:
+            return self._symbol_locks.setdefault(symbol, threading.RLock())
+
+    def latest_date(self, symbol=None):
+        """某个品种（默认第一个品种）预热数据的最后日期"""
+        df = self.bars(symbol or self.symbols[0])
+        return None if df is None else df.index[-1]
+
+    def refresh(self, symbol, df=None):
+        """更新一个品种的K线（df为已经获取的K线时直接使用），合成各周期并计算指标放入缓存"""
+        if df is None:
+            df = get_stock_data(symbol, provider=self.provider)
+        if df is None:
+            raise ValueError("数据获取失败")
+        with self._symbol_lock(symbol):
+            with self._lock:
+                bars = self._timeframes.get(symbol) or TimeframeBars(self.timeframes)
+            results = calculate_timeframes(symbol, df, self.timeframes, provider=self.provider, cache=self.cache,
+                                           columns=self.columns, bars=bars)
+            if 'D' in results:
+                self.events.add(symbol, results['D'])
+            with self._lock:
+                self._bars[symbol] = df
+                self._timeframes[symbol] = bars
+                self._updated[symbol] = datetime.now(BEIJING_TZ)
+
+    def refresh_all(self):
+        """并发获取全部品种的K线，按获取完成的顺序计算；单个品种失败不影响其他品种"""
+        start = time.perf_counter()
+        errors = {}
+        for result in iter_fetch(self.symbols, provider=self.provider, **self.fetch_options):
+            if self._stop.is_set():
+                break
+            if not result.ok:
+                errors[result.symbol] = result.error
+                continue
+            try:
+                self.refresh(result.symbol, result.frame)
+            except Exception as e:
+                errors[result.symbol] = f"{type(e).__name__}: {e}"
+        self.errors = errors
+        self.last_refresh = datetime.now(BEIJING_TZ)
+        print(f"预热完成：{len(self.symbols) - len(errors)}/{len(self.symbols)}个品种，"
+              f"耗时{time.perf_counter() - start:.1f}秒" + (f"，失败: {errors}" if errors else ""))
+
+    def _run(self):
+        self.refresh_all()
+        while not self._stop.is_set():
+            self.next_run = next_refresh(datetime.now(BEIJING_TZ), self.refresh_time)
+            wait_seconds = (self.next_run - datetime.now(BEIJING_TZ)).total_seconds()
+            if self._stop.wait(max(wait_seconds, 0)):
+                break
+            self.refresh_all()
+
+    def start(self):
+        """启动后台线程：立即预热一次，之后每个交易日收盘后预热"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='prewarm', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def status_text(self):
+        """页面状态栏文字"""
+        latest_date = self.latest_date()
+        if latest_date is None:
+            return "数据预热中..."
+        text = f"最新数据截止至{latest_date:%Y-%m-%d}"
+        if self.next_run is not None:
+            text += f"，下次更新 {self.next_run:%m-%d %H:%M}"
+        return text
+
+
+def main():
+    parser = argparse.ArgumentParser(description="每个交易日收盘后更新K线并预先计算指标")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认为全部配置的指数")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--once', action='store_true', help="只预热一次后退出")
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY, help="同时获取的品种数")
+    parser.add_argument('--rate', type=float, default=RATE, help="每秒最多发出的请求数，0为不限速")
+    args = parser.parse_args()
+
+    scheduler = PrewarmScheduler(args.symbols or None, provider=args.provider,
+                                 fetch_options={'concurrency': args.concurrency, 'rate': args.rate})
+    if args.once:
+        scheduler.refresh_all()
+        return
+    scheduler.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""
+指标流水线性能分析
+记录每个阶段（获取数据、EMA/MACD、金叉死叉、高低点、标准化、背离、趋势、组装结果、绘图、导出）的耗时、
+处理行数和内存峰值；没有启用时各阶段的记录为空操作，不影响正常计算。
+启用方式：
+    with profile_run('sh000001') as profile:
+        df = calculate_macd_indicators_new(get_stock_data('sh000001'))
+    profile.to_dict() / profile.to_json() 为结构化报告，结束时输出一行日志
+"""
+import contextvars
+import functools
+import json
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+
+import pandas as pd
+
+# 阶段的显示顺序，未列出的阶段排在最后
+STAGES = ['获取数据', 'EMA/MACD', '金叉死叉', '高低点', '标准化', '背离', '趋势', '组装结果', '绘图', '导出']
+
+# 当前线程（或协程）中启用的性能记录，Streamlit的每个会话在各自的线程中运行，互不影响
+_current = contextvars.ContextVar('pipeline_profile', default=None)
+
+# tracemalloc是整个进程共用的：同时启用的多个性能记录（可能在不同线程中）按引用计数启停跟踪；
+# 阶段开始时重置峰值前，先把当前峰值并入所有进行中的阶段，嵌套或并发的阶段不会丢失外层已达到的峰值
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_owned = False  # 跟踪是否由这里启动（外部已启动的跟踪不在这里停止）
+_open_peaks = {}            # 进行中的阶段 -> 其间被重置掉的峰值
+
+
+def _start_tracing():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_owned = True
+        _tracemalloc_users += 1
+
+
+def _stop_tracing():
+    global _tracemalloc_users, _tracemalloc_owned
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_owned:
+            tracemalloc.stop()
+            _tracemalloc_owned = False
+
+
+def _open_memory_stage():
+    """开始记录一个阶段的内存，返回(记号, 开始时的内存)"""
+    token = object()
+    with _tracemalloc_lock:
+        current, peak = tracemalloc.get_traced_memory()
+        for other in _open_peaks:
+            _open_peaks[other] = max(_open_peaks[other], peak)
+        tracemalloc.reset_peak()
+        _open_peaks[token] = current
+    return token, current
+
+
+def _close_memory_stage(token):
+    """结束记录，返回阶段内的内存峰值（含期间被其他阶段重置掉的部分）"""
+    with _tracemalloc_lock:
+        return max(_open_peaks.pop(token), tracemalloc.get_traced_memory()[1])
+
+
+class PipelineProfile:
+    """
+    一次运行的性能记录：每个阶段累计耗时、调用次数、处理行数，memory=True时还记录内存峰值
+    内存峰值为该阶段内比阶段开始时多分配的Python内存（tracemalloc），会明显拖慢纯Python代码，默认不记录；
+    tracemalloc统计整个进程，其他线程同时分配的内存也会计入
+    """
+
+    def __init__(self, name='', memory=False):
+        self.name = name
+        self.memory = memory
+        self.stages = {}
+        self.started_at = None
+        self.total_seconds = None
+        self._start = None
+        self._token = None
+        self._tracing = False
+
+    def start(self):
+        """在当前线程中启用记录，返回self"""
+        self.started_at = datetime.now()
+        self._token = _current.set(self)
+        if self.memory and not self._tracing:
+            _start_tracing()
+            self._tracing = True
+        self._start = time.perf_counter()
+        return self
+
+    def stop(self):
+        """结束记录，可以重复调用"""
+        if self._token is None:
+            return self
+        self.total_seconds = time.perf_counter() - self._start
+        if self._tracing:
+            _stop_tracing()
+            self._tracing = False
+        _current.reset(self._token)
+        self._token = None
+        return self
+
+    def record(self, stage, seconds, rows=None, peak=None, detail=None):
+        """累加一个阶段的一次执行，detail为阶段内的细分项（如指标节点名）"""
+        entry = self.stages.setdefault(stage, {'seconds': 0.0, 'calls': 0, 'rows': 0,
+                                               'peak_mb': None, 'details': {}})
+        entry['seconds'] += seconds
+        entry['calls'] += 1
+        if rows is not None:
+            entry['rows'] = max(entry['rows'], int(rows))
+        if peak is not None:
+            entry['peak_mb'] = max(entry['peak_mb'] or 0.0, peak / 1024 / 1024)
+        if detail is not None:
+            entry['details'][detail] = entry['details'].get(detail, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, name, rows=None, detail=None):
+        """记录with块的耗时；块内可以设置info['rows']，在开始时还不知道行数时使用"""
+        info = {'rows': rows}
+        token, baseline = _open_memory_stage() if self._tracing else (None, None)
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            elapsed = time.perf_counter() - start
+            peak = _close_memory_stage(token) - baseline if token is not None else None
+            self.record(name, elapsed, info['rows'], peak, detail)
+
+    def _ordered_stages(self):
+        order = {name: i for i, name in enumerate(STAGES)}
+        return sorted(self.stages.items(), key=lambda item: order.get(item[0], len(STAGES)))
+
+    def to_dict(self):
+        """结构化报告，各阶段按STAGES的顺序排列"""
+        return {
+            'name': self.name,
+            'started_at': self.started_at.isoformat(timespec='seconds') if self.started_at else None,
+            'total_seconds': self.total_seconds,
+            'stages': [{'stage': name, 'seconds': entry['seconds'], 'calls': entry['calls'],
+                        'rows': entry['rows'], 'peak_mb': entry['peak_mb'],
+                        'details': dict(entry['details'])}
+                       for name, entry in self._ordered_stages()],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.to_dict(), ensure_ascii=False, **kwargs)
+
+    def to_frame(self):
+        """每个阶段一行的汇总表，用于网页显示"""
+        stages = self.to_dict()['stages']
+        return pd.DataFrame([{key: value for key, value in stage.items() if key != 'details'}
+                             for stage in stages],
+                            columns=['stage', 'seconds', 'calls', 'rows', 'peak_mb'])
+
+    def log_line(self):
+        """一行文字的摘要，便于在日志中按品种跟踪耗时变化"""
+        parts = []
+        for name, entry in self._ordered_stages():
+            text = f"{name} {entry['seconds']:.3f}秒/{entry['rows']}行"
+            if entry['peak_mb'] is not None:
+                text += f"/{entry['peak_mb']:.1f}MB"
+            parts.append(text)
+        total = f"{self.total_seconds:.3f}秒" if self.total_seconds is not None else "未结束"
+        return f"[性能] {self.name} 总计{total} | " + " | ".join(parts)
+
+
+@contextmanager
+def profile_run(name='', memory=False, log=print):
+    """在with块内启用性能记录，返回PipelineProfile；结束时调用log输出一行摘要，log=None时不输出"""
+    profile = PipelineProfile(name, memory).start()
+    try:
+        yield profile
+    finally:
+        profile.stop()
+        if log is not None:
+            log(profile.log_line())
+
+
+def current_profile():
+    """当前启用的性能记录，没有启用时返回None"""
+    return _current.get()
+
+
+def profile_stage(name, rows=None, detail=None):
+    """记录一个阶段，没有启用性能记录时不做任何事；with块得到的字典可以设置'rows'"""
+    profile = _current.get()
+    if profile is None:
+        return nullcontext({})
+    return profile.stage(name, rows, detail)
+
+
+def _rows(value):
+    return len(value) if isinstance(value, (pd.DataFrame, pd.Series)) else None
+
+
+def profiled(stage):
+    """
+    把整个函数记录为一个阶段的装饰器
+    行数取第一个DataFrame参数的行数，没有DataFrame参数时取返回值的行数
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            rows = next((_rows(arg) for arg in args if _rows(arg) is not None), None)
+            with profile_stage(stage, rows) as info:
+                result = func(*args, **kwargs)
+                if rows is None:
+                    info['rows'] = _rows(result)
+            return result
+        return wrapper
+    return decorator
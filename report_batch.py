@@ -0,0 +1,276 @@
+"""
+批量生成图表和Excel报告
+按 获取数据 → 计算指标 → 绘图/导出Excel 的流水线处理全部指数和自选列表：数据获取在线程池中进行，
+计算、绘图和导出在进程池中并行，同一品种的图表和Excel复用同一份计算结果同时生成；
+源K线数据、指标参数和代码版本的哈希值与上次生成时相同且输出文件仍存在时跳过该品种；
+重新计算的品种同时更新输出目录中的信号事件记录（signal_events.parquet，见signal_events）
+"""
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import (FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor,
+                                wait)
+
+import pandas as pd
+
+from judge_strategy import (get_stock_data, calculate_macd_indicators_new, plot_macd_system_new,
+                            export_indicators, INDICES_CONFIG, MACDParams)
+from data_providers import get_provider
+from exporters import EXPORT_FORMATS
+from signal_events import SignalEventLog
+
+# 记录每个品种上次生成报告时源数据哈希值的文件
+MANIFEST_NAME = 'report_manifest.json'
+
+# 全部品种的信号事件记录
+EVENTS_NAME = 'signal_events.parquet'
+
+# 决定报告内容的源文件，修改后（如指标定义或导出格式变化）全部报告重新生成
+CODE_VERSION_FILES = ('judge_strategy.py', 'exporters.py')
+
+# 汇总表中每个品种的处理结果
+REPORT_COLUMNS = ['symbol', 'status', 'bars', 'hash', 'chart', 'excel', 'error']
+
+
+def bars_hash(df):
+    """源K线数据（含日期）的内容哈希值，任何一根K线变化都会改变哈希值"""
+    hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+    digest = hashlib.sha256(hashes.tobytes())
+    digest.update(','.join(map(str, df.columns)).encode())
+    return digest.hexdigest()
+
+
+def code_version(files=CODE_VERSION_FILES):
+    """决定报告内容的源文件的哈希值"""
+    digest = hashlib.sha256()
+    root = os.path.dirname(os.path.abspath(__file__))
+    for name in files:
+        with open(os.path.join(root, name), 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+CODE_VERSION = code_version()
+
+
+def report_hash(df, params=None):
+    """报告内容的哈希值：源K线数据、指标参数和代码版本任一变化都会改变"""
+    digest = hashlib.sha256(bars_hash(df).encode())
+    digest.update(json.dumps(MACDParams.coerce(params).to_dict(), sort_keys=True).encode())
+    digest.update(CODE_VERSION.encode())
+    return digest.hexdigest()
+
+
+def report_paths(symbol, output_dir, fmt='xlsx'):
+    """与judge_strategy.main相同的文件名，数据文件的扩展名随导出格式变化"""
+    return {
+        'chart': os.path.join(output_dir, f'stock_{symbol}_macd_chart_new.png'),
+        'excel': os.path.join(output_dir, f'stock_{symbol}_macd_analysis_new{EXPORT_FORMATS[fmt]}'),
+    }
+
+
+def load_manifest(output_dir):
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"读取报告记录失败，重新生成全部报告: {e}")
+        return {}
+
+
+def save_manifest(manifest, output_dir):
+    """先写临时文件再替换，避免中断时损坏记录"""
+    path = os.path.join(output_dir, MANIFEST_NAME)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def load_events(output_dir):
+    """上次保存的信号事件记录，没有或读取失败时返回空记录"""
+    path = os.path.join(output_dir, EVENTS_NAME)
+    if not os.path.exists(path):
+        return SignalEventLog()
+    try:
+        return SignalEventLog.load(path)
+    except Exception as e:
+        print(f"读取信号事件记录失败，重新生成: {e}")
+        return SignalEventLog()
+
+
+def save_events(events, output_dir):
+    path = os.path.join(output_dir, EVENTS_NAME)
+    tmp_path = path + '.tmp'
+    events.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def is_unchanged(manifest, symbol, digest, paths):
+    """源数据与上次生成时相同，且上次的输出文件都还在"""
+    entry = manifest.get(symbol)
+    return (entry is not None and entry.get('hash') == digest and
+            all(os.path.exists(path) for path in paths.values()))
+
+
+def render_chart(df, symbol, path):
+    plot_macd_system_new(df, symbol, output_path=path)
+    return path
+
+
+def export_workbook(df, path, fmt):
+    export_indicators(df, path, fmt)
+    return path
+
+
+class _InlineExecutor:
+    """在当前进程中立即执行的执行器，workers=1时使用，便于调试"""
+
+    def submit(self, func, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+def print_progress(done, total, report):
+    """默认的进度输出"""
+    status = report.get('error') or report['status']
+    print(f"[{done}/{total}] {report['symbol']} {status}")
+
+
+def generate_reports(symbols, output_dir='reports', workers=None, fetch_workers=4,
+                     provider=None, force=False, fmt='xlsx', params=None, progress=print_progress):
+    """
+    为每个品种生成MACD图表和Excel报告，返回处理结果汇总表（每个品种一行）
+    workers为计算和绘图的进程数，默认使用全部CPU核心，为1时在当前进程中串行处理；
+    fetch_workers为获取数据的线程数；force=True时忽略哈希记录，symbols全部重新生成
+    （报告记录和信号事件中其他品种的内容保留）；fmt为数据文件的导出格式（见exporters.EXPORT_FORMATS）；
+    params为指标参数（MACDParams或参数字典），默认为DEFAULT_PARAMS
+    """
+    symbols = list(dict.fromkeys(symbols))
+    provider = get_provider(provider)
+    os.makedirs(output_dir, exist_ok=True)
+    params = MACDParams.coerce(params)
+    manifest = load_manifest(output_dir)
+    events = load_events(output_dir)
+    workers = workers or os.cpu_count() or 1
+    total = len(symbols)
+
+    reports = {symbol: {'symbol': symbol} for symbol in symbols}
+    remaining = {}  # 每个品种还未完成的输出数量
+    finished = []
+
+    def finish(symbol, status, error=None):
+        report = reports[symbol]
+        report['status'] = status
+        if error:
+            report['error'] = error
+        if status == '已生成':
+            manifest[symbol] = {'hash': report['hash'], 'bars': report['bars'],
+                                'updated': pd.Timestamp.now().isoformat(timespec='seconds')}
+        finished.append(symbol)
+        if progress:
+            progress(len(finished), total, report)
+
+    if workers == 1:
+        fetchers, pool = _InlineExecutor(), _InlineExecutor()
+    else:
+        fetchers = ThreadPoolExecutor(max_workers=fetch_workers)
+        pool = ProcessPoolExecutor(max_workers=workers)
+
+    with fetchers, pool:
+        # 每个任务记录(阶段, 品种)，某一阶段完成后提交下一阶段
+        pending = {fetchers.submit(get_stock_data, symbol, provider=provider): ('fetch', symbol)
+                   for symbol in symbols}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, symbol = pending.pop(future)
+                report = reports[symbol]
+                if report.get('status') == '失败':
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    finish(symbol, '失败', f"{stage}: {type(e).__name__}: {e}")
+                    continue
+
+                if stage == 'fetch':
+                    if result is None or result.empty:
+                        finish(symbol, '失败', "数据获取失败")
+                        continue
+                    paths = report_paths(symbol, output_dir, fmt)
+                    report.update(paths, bars=len(result), hash=report_hash(result, params))
+                    if (not force and is_unchanged(manifest, symbol, report['hash'], paths) and
+                            symbol in events.symbols()):
+                        finish(symbol, '未变化，跳过')
+                    else:
+                        future = pool.submit(calculate_macd_indicators_new, result, params=params)
+                        pending[future] = ('compute', symbol)
+                elif stage == 'compute':
+                    events.add(symbol, result)
+                    # 图表和Excel使用同一份计算结果，同时提交
+                    pending[pool.submit(render_chart, result, symbol, report['chart'])] = ('chart', symbol)
+                    pending[pool.submit(export_workbook, result, report['excel'], fmt)] = ('excel', symbol)
+                    remaining[symbol] = 2
+                else:
+                    remaining[symbol] -= 1
+                    if remaining[symbol] == 0:
+                        finish(symbol, '已生成')
+
+    save_manifest(manifest, output_dir)
+    save_events(events, output_dir)
+    return pd.DataFrame([reports[symbol] for symbol in symbols], columns=REPORT_COLUMNS)
+
+
+def read_watchlist(path):
+    """自选列表文件，每行一个品种代码，#开头为注释"""
+    with open(path, encoding='utf-8') as f:
+        return [line.split('#')[0].strip() for line in f if line.split('#')[0].strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成MACD图表和Excel报告")
+    parser.add_argument('symbols', nargs='*', help="品种代码，默认为全部配置的指数")
+    parser.add_argument('--watchlist', action='append', default=[],
+                        help="自选列表文件，每行一个代码，可重复指定")
+    parser.add_argument('--output-dir', default='reports', help="输出目录，默认reports")
+    parser.add_argument('--workers', type=int, default=None, help="计算和绘图的进程数，默认使用全部CPU核心")
+    parser.add_argument('--fetch-workers', type=int, default=4, help="获取数据的线程数")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--force', action='store_true', help="忽略哈希记录，全部重新生成")
+    parser.add_argument('--format', choices=list(EXPORT_FORMATS), default='xlsx',
+                        help="数据文件的导出格式，默认为流式写入的xlsx")
+    args = parser.parse_args()
+
+    symbols = list(args.symbols)
+    if not symbols:
+        symbols = list(INDICES_CONFIG.values())
+    for path in args.watchlist:
+        symbols += read_watchlist(path)
+
+    start = time.perf_counter()
+    result = generate_reports(symbols, output_dir=args.output_dir, workers=args.workers,
+                              fetch_workers=args.fetch_workers, provider=args.provider,
+                              force=args.force, fmt=args.format)
+    print(result[['symbol', 'status', 'bars', 'error']].to_string())
+    print(f"完成 {len(result)} 个品种，耗时 {time.perf_counter() - start:.1f}秒，报告保存在: {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,349 @@
+"""
+信号事件记录
+把每个品种指标结果中的信号（TG/BG、各类背离、低位金叉、主升等）提取成紧凑的事件表：
+品种、日期、信号、当时的DIF和收盘价；按(信号, 日期)和(品种, 日期)建立索引，
+查询"最近30天全市场的直接TG"或"每个指数距上次BG多少天"时只做二分查找，不需要重新读取或计算指标
+"""
+import argparse
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 默认记录的信号
+EVENT_SIGNALS = [
+    'TG', '直接TG', '隔峰TG', 'BG', '直接BG', '隔峰BG',
+    '直接顶背离', '隔峰顶背离', '直接底背离', '隔峰底背离',
+    '低位金叉', '二次金叉', '主升', 'DIF顶转折', 'DIF底转折',
+]
+
+EVENT_COLUMNS = ['symbol', 'date', 'signal', 'bar', 'DIF', 'close']
+
+
+def extract_events(symbol, df, signals=None):
+    """
+    从calculate_macd_indicators_new的结果中提取信号事件，df中没有的信号列跳过
+    bar为事件所在K线的序号（从0开始），用于计算距今的K线数量
+    """
+    signals = [name for name in (signals or EVENT_SIGNALS) if name in df.columns]
+    if not signals or df.empty:
+        return pd.DataFrame(columns=EVENT_COLUMNS)
+    flags = np.stack([df[name].to_numpy(dtype=bool) for name in signals])
+    signal_ids, bars = np.nonzero(flags)
+    order = np.lexsort((signal_ids, bars))  # 按日期排列，同一天按信号顺序
+    signal_ids, bars = signal_ids[order], bars[order]
+    return pd.DataFrame({
+        'symbol': symbol,
+        'date': df.index[bars],
+        'signal': np.asarray(signals, dtype=object)[signal_ids],
+        'bar': bars.astype(np.int32),
+        'DIF': df['DIF'].to_numpy(dtype=float)[bars] if 'DIF' in df.columns else np.nan,
+        'close': df['close'].to_numpy(dtype=float)[bars] if 'close' in df.columns else np.nan,
+    }, columns=EVENT_COLUMNS)
+
+
+def panel_events(closes, panel, signals=None):
+    """
+    从macd_panel.calculate_macd_panel的结果（日期×品种）一次提取全部品种的事件，
+    返回(事件表, {品种: (K线数量, 最后日期)})，K线只计算该品种有效（已上市、未停牌）的部分
+    """
+    signals = [name for name in (signals or EVENT_SIGNALS) if name in panel]
+    valid = panel['valid'].to_numpy(dtype=bool) if 'valid' in panel else closes.notna().to_numpy()
+    bar_numbers = np.cumsum(valid, axis=0) - 1
+    dif = panel['DIF'].to_numpy(dtype=float) if 'DIF' in panel else np.full(valid.shape, np.nan)
+    close = closes.to_numpy(dtype=float)
+
+    frames = []
+    for code, name in enumerate(signals):
+        rows, cols = np.nonzero(panel[name].to_numpy(dtype=bool) & valid)
+        frames.append((rows, cols, np.full(len(rows), code)))
+    rows, cols, codes = (np.concatenate(parts) for parts in zip(*frames)) if frames else (np.zeros(0, int),) * 3
+    order = np.lexsort((codes, rows, cols))  # 按品种、日期、信号顺序排列
+    rows, cols, codes = rows[order], cols[order], codes[order]
+    events = pd.DataFrame({
+        'symbol': np.asarray(closes.columns, dtype=object)[cols],
+        'date': closes.index[rows],
+        'signal': np.asarray(signals, dtype=object)[codes],
+        'bar': bar_numbers[rows, cols].astype(np.int32),
+        'DIF': dif[rows, cols],
+        'close': close[rows, cols],
+    }, columns=EVENT_COLUMNS)
+
+    counts = valid.sum(axis=0)
+    last_rows = len(valid) - 1 - np.argmax(valid[::-1], axis=0)
+    symbols = {symbol: (int(counts[i]), closes.index[last_rows[i]] if counts[i] else pd.NaT)
+               for i, symbol in enumerate(closes.columns)}
+    return events, symbols
+
+
+def _slice(keys, dates, key, start, end):
+    """keys按(key, 日期)排序，返回key在[start, end]日期范围内的行号区间"""
+    lo, hi = np.searchsorted(keys, key, 'left'), np.searchsorted(keys, key, 'right')
+    if start is not None:
+        lo += np.searchsorted(dates[lo:hi], start, 'left')
+    if end is not None:
+        hi = lo + np.searchsorted(dates[lo:hi], end, 'right')
+    return lo, hi
+
+
+class SignalEventLog:
+    """
+    全部品种的信号事件，每个品种的事件整体替换（add），查询前按需重建索引：
+    按(信号, 日期)和(品种, 日期)排序的行号，以及每个(品种, 信号)最近一次事件的行号
+    预热线程写入、页面会话查询可以同时进行，查询使用建立索引时的快照
+    """
+
+    def __init__(self, signals=EVENT_SIGNALS):
+        self.signals = list(signals)
+        self._events = {}   # 品种 -> 事件表
+        self._symbols = {}  # 品种 -> (K线数量, 最后一根K线的日期)
+        self._index = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return sum(len(events) for events in self._events.values())
+
+    def symbols(self):
+        return list(self._symbols)
+
+    def add(self, symbol, df):
+        """用一个品种的指标结果替换该品种原有的事件"""
+        self.add_events(symbol, extract_events(symbol, df, self.signals),
+                        len(df), df.index[-1] if len(df) else pd.NaT)
+
+    def add_events(self, symbol, events, bars, last_date):
+        with self._lock:
+            self._events[symbol] = events
+            self._symbols[symbol] = (int(bars), pd.Timestamp(last_date))
+            self._index = None
+
+    def add_panel(self, closes, panel):
+        """用calculate_macd_panel的结果替换面板中全部品种的事件"""
+        events, symbols = panel_events(closes, panel, self.signals)
+        groups = dict(tuple(events.groupby('symbol', sort=False)))
+        for symbol, (bars, last_date) in symbols.items():
+            frame = groups.get(symbol, events.iloc[:0]).reset_index(drop=True)
+            self.add_events(symbol, frame, bars, last_date)
+
+    def remove(self, symbol):
+        with self._lock:
+            self._events.pop(symbol, None)
+            self._symbols.pop(symbol, None)
+            self._index = None
+
+    def _build(self):
+        """合并各品种的事件并建立索引"""
+        with self._lock:
+            self._index = self._build_index()
+            return self._index
+
+    def _build_index(self):
+        frames = [events for events in self._events.values() if len(events)]
+        events = (pd.concat(frames, ignore_index=True) if frames
+                  else pd.DataFrame(columns=EVENT_COLUMNS).astype({'date': 'datetime64[ns]'}))
+        symbols = list(self._symbols)
+        signals = list(dict.fromkeys(self.signals + list(events['signal'].unique())))
+        events['symbol'] = pd.Categorical(events['symbol'], categories=symbols)
+        events['signal'] = pd.Categorical(events['signal'], categories=signals)
+
+        dates = events['date'].to_numpy(dtype='datetime64[ns]')
+        symbol_codes = events['symbol'].cat.codes.to_numpy()
+        signal_codes = events['signal'].cat.codes.to_numpy()
+        by_signal = np.lexsort((dates, signal_codes))
+        by_symbol = np.lexsort((dates, symbol_codes))
+
+        # 每个(品种, 信号)最近一次事件的行号，没有事件为-1
+        latest = np.full((len(symbols), len(signals)), -1, dtype=np.int64)
+        order = np.lexsort((dates, signal_codes, symbol_codes))
+        pairs = symbol_codes[order].astype(np.int64) * len(signals) + signal_codes[order]
+        last = order[np.append(pairs[1:] != pairs[:-1], True)] if len(order) else order
+        latest[symbol_codes[last], signal_codes[last]] = last
+
+        return {
+            'events': events,
+            'symbols': symbols,
+            'signals': signals,
+            'by_signal': (by_signal, signal_codes[by_signal], dates[by_signal]),
+            'by_symbol': (by_symbol, symbol_codes[by_symbol], dates[by_symbol]),
+            'latest': latest,
+            'symbol_info': dict(self._symbols),
+            'as_of': max((last for _, last in self._symbols.values() if pd.notna(last)), default=pd.NaT),
+        }
+
+    @property
+    def index(self):
+        index = self._index
+        return index if index is not None else self._build()
+
+    @property
+    def as_of(self):
+        """全部品种中最新的K线日期"""
+        return self.index['as_of']
+
+    @property
+    def events(self):
+        """全部事件（按品种合并，品种和信号为分类类型）"""
+        return self.index['events']
+
+    def _codes(self, values, names):
+        values = [values] if isinstance(values, str) else list(values)
+        lookup = {name: code for code, name in enumerate(names)}
+        return [lookup[value] for value in values if value in lookup]
+
+    def query(self, signals=None, symbols=None, start=None, end=None, days=None):
+        """
+        查询事件，返回按日期排列的DataFrame
+        signals/symbols为单个名称或列表，None为全部；start/end为日期范围（含两端），
+        days为最近多少个自然日（相对全部品种的最新K线日期）
+        """
+        index = self.index
+        if days is not None and pd.notna(index['as_of']):
+            start = index['as_of'] - pd.Timedelta(days=days)
+        start = None if start is None else np.datetime64(pd.Timestamp(start), 'ns')
+        end = None if end is None else np.datetime64(pd.Timestamp(end), 'ns')
+
+        # 指定信号时用(信号, 日期)索引，只指定品种时用(品种, 日期)索引
+        if signals is not None:
+            order, keys, dates = index['by_signal']
+            codes = self._codes(signals, index['signals'])
+        elif symbols is not None:
+            order, keys, dates = index['by_symbol']
+            codes = self._codes(symbols, index['symbols'])
+        else:
+            order, keys, dates = index['by_signal']
+            codes = range(len(index['signals']))
+        rows = [order[slice(*_slice(keys, dates, code, start, end))] for code in codes]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+
+        result = index['events'].iloc[rows]
+        if signals is not None and symbols is not None:
+            result = result[result['symbol'].isin([symbols] if isinstance(symbols, str) else symbols)]
+        return result.sort_values(['date', 'symbol'], kind='stable').reset_index(drop=True)
+
+    def latest(self, signals=None, symbols=None, as_of=None):
+        """
+        每个品种每种信号最近一次出现的日期、距今自然日和K线数量、当时的DIF和收盘价，没有出现过时为空
+        as_of默认为全部品种的最新K线日期；K线数量按该品种自己的K线计算
+        """
+        index = self.index
+        signals = index['signals'] if signals is None else ([signals] if isinstance(signals, str) else signals)
+        symbols = index['symbols'] if symbols is None else ([symbols] if isinstance(symbols, str) else symbols)
+        as_of = pd.Timestamp(as_of) if as_of is not None else index['as_of']
+
+        symbol_lookup = {name: code for code, name in enumerate(index['symbols'])}
+        signal_lookup = {name: code for code, name in enumerate(index['signals'])}
+        symbol_codes = np.array([symbol_lookup.get(name, -1) for name in symbols], dtype=np.int64)
+        signal_codes = np.array([signal_lookup.get(name, -1) for name in signals], dtype=np.int64)
+        rows = index['latest'][symbol_codes[:, None], signal_codes[None, :]].ravel()
+        rows[(np.repeat(symbol_codes, len(signals)) < 0) | (np.tile(signal_codes, len(symbols)) < 0)] = -1
+        found = rows >= 0
+
+        events = index['events']
+        bars = np.array([index['symbol_info'].get(name, (0, None))[0] for name in symbols])
+        dates = np.full(len(rows), np.datetime64('NaT'), dtype='datetime64[ns]')
+        dates[found] = events['date'].to_numpy(dtype='datetime64[ns]')[rows[found]]
+        result = pd.DataFrame({
+            'symbol': np.repeat(np.asarray(symbols, dtype=object), len(signals)),
+            'signal': np.tile(np.asarray(signals, dtype=object), len(symbols)),
+            'date': dates,
+        })
+        result['days_since'] = (as_of - result['date']).dt.days.astype(float)
+        for name in ('bar', 'DIF', 'close'):
+            values = np.full(len(rows), np.nan)
+            values[found] = events[name].to_numpy(dtype=float)[rows[found]]
+            result[name] = values
+        result['bars_since'] = np.repeat(bars, len(signals)) - 1 - result.pop('bar')
+        return result[['symbol', 'signal', 'date', 'days_since', 'bars_since', 'DIF', 'close']]
+
+    def days_since(self, signal, symbols=None, bars=False):
+        """每个品种距上次出现signal的自然日（bars=True时为K线数量），没有出现过为NaN"""
+        latest = self.latest(signal, symbols)
+        return latest.set_index('symbol')['bars_since' if bars else 'days_since']
+
+    def counts(self, start=None, end=None, days=None):
+        """各品种各信号的事件数量（品种×信号）"""
+        events = self.query(start=start, end=end, days=days)
+        return pd.crosstab(events['symbol'], events['signal'])
+
+    def save(self, path):
+        """保存为Parquet文件，各品种的K线数量和最后日期保存在文件的元数据中"""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        index = self.index
+        events = index['events'].astype({'symbol': str, 'signal': str})
+        table = pa.Table.from_pandas(events, preserve_index=False)
+        meta = {
+            'signals': self.signals,
+            'symbols': {symbol: [bars, last.isoformat() if pd.notna(last) else None]
+                        for symbol, (bars, last) in index['symbol_info'].items()},
+        }
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}),
+                                               b'signal_events': json.dumps(meta, ensure_ascii=False).encode()})
+        pq.write_table(table, path)
+
+    @classmethod
+    def load(cls, path):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        meta = json.loads(table.schema.metadata[b'signal_events'].decode())
+        log = cls(meta['signals'])
+        events = table.to_pandas()
+        groups = dict(tuple(events.groupby('symbol', sort=False))) if len(events) else {}
+        for symbol, (bars, last) in meta['symbols'].items():
+            frame = groups.get(symbol, events.iloc[:0]).reset_index(drop=True)
+            log.add_events(symbol, frame, bars, last)
+        return log
+
+
+def benchmark(symbol_count=300, periods=1500):
+    """用面板模式的离线随机数据建立事件表并测试查询耗时"""
+    import time
+    from macd_panel import calculate_macd_panel, _synthetic_closes, PANEL_COLUMNS
+
+    closes = _synthetic_closes(symbol_count, periods)
+    panel = calculate_macd_panel(closes)
+    log = SignalEventLog([name for name in EVENT_SIGNALS if name in PANEL_COLUMNS])
+    start = time.perf_counter()
+    log.add_panel(closes, panel)
+    log.index
+    print(f"{symbol_count}个品种 × {periods}根K线：{len(log)}个事件，提取和建立索引 {time.perf_counter() - start:.2f}秒")
+
+    for label, func in (
+        ("最近30天的直接TG", lambda: log.query('直接TG', days=30)),
+        ("全部品种距上次BG", lambda: log.days_since('BG')),
+        ("单个品种的全部事件", lambda: log.query(symbols=closes.columns[0])),
+        ("最近一年的主升和低位金叉", lambda: log.query(['主升', '低位金叉'], days=365)),
+    ):
+        start = time.perf_counter()
+        for _ in range(20):
+            result = func()
+        print(f"{label}: {len(result)}行，{(time.perf_counter() - start) / 20 * 1000:.2f}毫秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查询保存的信号事件")
+    parser.add_argument('path', nargs='?', default='reports/signal_events.parquet',
+                        help="事件文件，默认为report_batch生成的reports/signal_events.parquet")
+    parser.add_argument('--signal', nargs='+', default=None, help="信号名称，如 直接TG 主升")
+    parser.add_argument('--symbol', nargs='+', default=None, help="品种代码")
+    parser.add_argument('--days', type=int, default=None, help="最近多少个自然日")
+    parser.add_argument('--since', default=None, help="列出每个品种距上次出现该信号的天数，如 BG")
+    parser.add_argument('--benchmark', action='store_true', help="用离线随机数据测试查询耗时")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    log = SignalEventLog.load(args.path)
+    if args.since:
+        print(log.latest(args.since, args.symbol).to_string())
+    else:
+        print(log.query(args.signal, args.symbol, days=args.days).to_string())
+
+
+if __name__ == "__main__":
+    main()
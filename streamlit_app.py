@@ -1,22 +1,63 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import akshare as ak
 from datetime import datetime, timedelta
 import warnings
 import os
-from judge_strategy import get_stock_data, calculate_macd_indicators_new
+from judge_strategy import get_stock_data, INDICES_CONFIG
+from exporters import export_bytes
+from indicator_cache import cached_indicators, default_cache as indicator_cache
+from prewarm import PrewarmScheduler
+from signal_events import EVENT_SIGNALS
+from timeframes import DEFAULT_TIMEFRAMES, TIMEFRAME_NAMES, resample_bars
+from profiling import PipelineProfile
+
+# 网页下载可选的格式：(导出格式, 扩展名, MIME类型)
+DOWNLOAD_FORMATS = {
+    "Excel": ('xlsx', '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    "Parquet": ('parquet', '.parquet', 'application/octet-stream'),
+    "Arrow": ('arrow', '.arrow', 'application/vnd.apache.arrow.file'),
+}
+
+# 页面用到的指标列（详细数据、指标卡片、下载和信号事件），只计算这些列及其依赖；
+# 直接TG/隔峰TG/直接BG/隔峰BG与TG/BG在同一步中算出，只为信号事件查询多保留几列
+PAGE_COLUMNS = [
+    'close', 'DIF', 'DEA', 'MACD',
+    '低位金叉', '二次金叉', 'TG', 'BG', 'TG_数值', 'BG_数值',
+    '直接顶背离', '隔峰顶背离', '直接底背离', '隔峰底背离',
+    '主升', 'DIF顶转折', 'DIF底转折', '直接TG', '隔峰TG', '直接BG', '隔峰BG'
+]
+
+@st.cache_resource
+def get_prewarm_scheduler(provider_spec=None):
+    """每个数据源在进程内启动一个收盘后预热线程，所有用户会话共享"""
+    return PrewarmScheduler(provider=provider_spec, columns=PAGE_COLUMNS).start()
 
 # 设置缓存
 @st.cache_data(ttl=3600)  # 缓存1小时
-def get_cached_stock_data(stock_code):
+def get_cached_stock_data(stock_code, provider_spec=None):
     """缓存股票数据获取"""
-    return get_stock_data(stock_code)
+    return get_stock_data(stock_code, provider=provider_spec)
 
-@st.cache_data(ttl=3600)  # 缓存1小时
-def get_cached_macd_indicators(df):
-    """缓存MACD指标计算"""
-    return calculate_macd_indicators_new(df)
+def get_stock_bars(stock_code, provider_spec=None, timeframe='D'):
+    """
+    优先使用预热好的K线（含合成的周线、月线，交易时段内超过1小时的先重新获取），
+    还没有预热的品种再获取日线并合成
+    """
+    df = get_prewarm_scheduler(provider_spec).current_bars(stock_code, timeframe)
+    if df is not None:
+        return df.copy()
+    df = get_cached_stock_data(stock_code, provider_spec)
+    if df is None or timeframe == 'D':
+        return df
+    return resample_bars(df, timeframe)
+
+def get_cached_macd_indicators(stock_code, df, provider_spec=None, timeframe='D'):
+    """
+    缓存MACD指标计算：按(品种, 周期, 最后K线日期, 参数)从进程内共享的缓存读取，
+    不对整张表求哈希，也不修改df，所有用户会话共用同一份计算结果；只计算页面用到的PAGE_COLUMNS
+    """
+    return cached_indicators(stock_code, df, provider=provider_spec, columns=PAGE_COLUMNS, timeframe=timeframe)
 
 warnings.filterwarnings('ignore')
 
@@ -65,38 +106,37 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# 指数配置 - 使用akshare要求的完整代码格式
-INDICES_CONFIG = {
-    "上证指数 (000001.SH)": "sh000001",
-    "深证成指 (399001.SZ)": "sz399001", 
-    "创业板指 (399006.SZ)": "sz399006",
-    "沪深300 (000300.SH)": "sh000300",
-    "上证50 (000016.SH)": "sh000016",
-    "中证500 (000905.SH)": "sh000905",
-    "中证1000 (000852.SH)": "sh000852",
-    "中证2000ETF (159531.SZ)": "sz159531",
-    "科创综指 (000680.SH)": "sh000688"
-}
-
-def get_latest_data_info():
-    """获取最新数据信息"""
+def get_latest_data_info(provider_spec=None):
+    """获取最新数据信息（来自预热记录，不访问网络）"""
     try:
-        # 尝试获取一个指数的数据来检查最新日期
-        import akshare as ak
-        test_df = ak.stock_zh_index_daily(symbol="sh000001")
-        if not test_df.empty:
-            # 检查是否有date列
-            if 'date' in test_df.columns:
-                latest_date = test_df['date'].iloc[-1].strftime('%Y-%m-%d')
-            else:
-                latest_date = test_df.index[-1].strftime('%Y-%m-%d')
-            return f"最新数据截止至{latest_date},正在尝试补充当日数据..."
-        else:
-            return "数据获取中..."
+        return get_prewarm_scheduler(provider_spec).status_text()
     except:
         return "数据获取中..."
 
 
+def show_signal_events(provider_spec=None):
+    """全部指数最近出现的信号和距上次出现的天数，直接查询预热时记录的事件"""
+    events = get_prewarm_scheduler(provider_spec).events
+    if not events.symbols():
+        st.caption("数据预热中，稍后再查询信号事件")
+        return
+    names = {code: name for name, code in INDICES_CONFIG.items()}
+    col1, col2 = st.columns(2)
+    with col1:
+        signal = st.selectbox("信号", EVENT_SIGNALS, index=EVENT_SIGNALS.index('直接TG'))
+    with col2:
+        days = st.selectbox("时间范围（自然日）", [30, 60, 90, 365], index=0)
+
+    recent = events.query(signal, days=days)
+    recent.insert(1, '指数', recent['symbol'].astype(str).map(names))
+    st.write(f"最近{days}天出现{signal}: {len(recent)}次")
+    st.dataframe(recent.drop(columns=['bar']), use_container_width=True)
+
+    latest = events.latest(signal)
+    latest.insert(1, '指数', latest['symbol'].map(names))
+    st.write(f"各指数距上次出现{signal}")
+    st.dataframe(latest.drop(columns=['signal']), use_container_width=True)
+
 
 def main():
     # 主标题
@@ -113,6 +153,28 @@ def main():
             index=0
         )
         
+        # 数据源选择，默认使用环境变量DATA_PROVIDER配置的数据源
+        provider_options = {"网络数据 (akshare)": "akshare", "离线模拟数据": "synthetic"}
+        default_provider = os.environ.get('DATA_PROVIDER', 'akshare')
+        if default_provider not in provider_options.values():
+            provider_options[f"环境变量配置 ({default_provider})"] = default_provider
+        selected_provider = st.selectbox(
+            "数据源",
+            list(provider_options.keys()),
+            index=list(provider_options.values()).index(default_provider)
+        )
+        provider_spec = provider_options[selected_provider]
+        
+        # 下载数据的格式
+        export_format = st.selectbox("导出格式", list(DOWNLOAD_FORMATS.keys()))
+        
+        # 指标缓存状态
+        cache_stats = indicator_cache.stats()
+        st.caption(f"指标缓存：命中 {cache_stats['hits']} 次，未命中 {cache_stats['misses']} 次，"
+                   f"{cache_stats['entries']} 项，{cache_stats['bytes'] / 1024 / 1024:.1f} MB")
+        
+        # 调试用：显示各阶段的耗时和内存峰值（记录内存会使计算变慢）
+        show_profile = st.checkbox("显示性能分析", value=False)
 
     
     # 主内容区域
@@ -123,6 +185,13 @@ def main():
         index=3  # 默认选择沪深300
     )
     
+    # K线周期，周线和月线由日线合成，预热时已经算好
+    timeframe = st.selectbox(
+        "K线周期",
+        list(DEFAULT_TIMEFRAMES),
+        format_func=lambda code: TIMEFRAME_NAMES[code]
+    )
+    
     # 计算按钮 - 移到指数列表框下面
     if st.button("计算指标", type="primary", use_container_width=True):
         st.session_state.calculate_clicked = True
@@ -130,24 +199,30 @@ def main():
         st.session_state.calculate_clicked = False
     
     # 状态信息
-    status_info = get_latest_data_info()
+    status_info = get_latest_data_info(provider_spec)
     st.markdown(f'<div class="status-box">{status_info}</div>', unsafe_allow_html=True)
     
+    # 全部指数的信号事件查询
+    with st.expander("信号事件", expanded=False):
+        show_signal_events(provider_spec)
+    
     # 如果点击了计算按钮
     if st.session_state.get('calculate_clicked', False):
         # 创建进度条
         progress_bar = st.progress(0)
         status_text = st.empty()
         
+        # 记录本次运行各阶段的耗时，结束时输出一行性能日志
+        stock_code = INDICES_CONFIG[selected_index]
+        file_code = stock_code if timeframe == 'D' else f'{stock_code}_{timeframe}'
+        profile = PipelineProfile(stock_code, memory=show_profile).start()
+        
         try:
             status_text.text("正在获取数据...")
             progress_bar.progress(25)
             
-            # 获取股票代码
-            stock_code = INDICES_CONFIG[selected_index]
-            
             # 获取数据
-            df = get_cached_stock_data(stock_code)
+            df = get_stock_bars(stock_code, provider_spec, timeframe)
             if df is None:
                 st.error("数据获取失败，请检查网络连接或股票代码")
                 return
@@ -156,7 +231,7 @@ def main():
             progress_bar.progress(50)
             
             # 计算指标
-            df = get_cached_macd_indicators(df)
+            df = get_cached_macd_indicators(stock_code, df, provider_spec, timeframe)
             
             status_text.text("正在处理数据...")
             progress_bar.progress(75)
@@ -272,15 +347,12 @@ def main():
             st.download_button(
                 label="下载完整数据 (CSV)",
                 data=csv,
-                file_name=f'{stock_code}_macd_data.csv',
+                file_name=f'{file_code}_macd_data.csv',
                 mime='text/csv'
             )
             
-            # Excel下载功能
+            # Excel/Parquet/Arrow下载功能
             try:
-                # 确保有openpyxl依赖
-                import openpyxl
-                
                 # 选择要导出的列
                 export_columns = [
                     'close', 'DIF', 'DEA', 'MACD',
@@ -320,29 +392,35 @@ def main():
                 if 'MACD' in export_df.columns:
                     export_df['MACD'] = export_df['MACD'].round(3)
                 
-                # 将数据转换为Excel格式的字节流
-                from io import BytesIO
-                output = BytesIO()
-                with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                    export_df.to_excel(writer, index=True, sheet_name='MACD分析数据')
-                excel_data = output.getvalue()
+                # 按侧边栏选择的格式流式导出为字节流
+                fmt, ext, mime = DOWNLOAD_FORMATS[export_format]
+                export_data = export_bytes(export_df, fmt, sheet_name='MACD分析数据')
                 
-                # 提供Excel下载按钮
+                # 提供下载按钮
                 st.download_button(
-                    label="下载Excel数据",
-                    data=excel_data,
-                    file_name=f'{stock_code}_macd_analysis.xlsx',
-                    mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+                    label=f"下载{export_format}数据",
+                    data=export_data,
+                    file_name=f'{file_code}_macd_analysis{ext}',
+                    mime=mime
                 )
                 
-            except ImportError:
-                st.error("缺少openpyxl依赖，请运行: pip install openpyxl")
+            except ImportError as e:
+                st.error(f"缺少导出依赖，请运行: pip install -r requirements.txt（{e}）")
             except Exception as e:
-                st.error(f"生成Excel文件时出错: {e}")
+                st.error(f"生成导出文件时出错: {e}")
         
         except Exception as e:
             st.error(f"计算过程中出现错误: {e}")
             st.exception(e)
+        
+        finally:
+            profile.stop()
+            print(profile.log_line())
+            if show_profile:
+                with st.expander("性能分析", expanded=True):
+                    st.caption(f"总耗时 {profile.total_seconds:.3f} 秒（命中指标缓存时不包含指标计算各阶段）")
+                    st.dataframe(profile.to_frame(), use_container_width=True)
+                    st.json(profile.to_dict(), expanded=False)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
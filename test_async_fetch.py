@@ -0,0 +1,127 @@
+"""
+并发获取的超时、重试、限速和并发上限，使用模拟延迟和失败的FlakyProvider
+    python -m pytest -q test_async_fetch.py
+"""
+import asyncio
+import time
+
+import pytest
+
+from async_fetch import AsyncFetcher, TokenBucket, fetch_all, iter_fetch
+from data_providers import FlakyProvider
+
+SYMBOLS = [f"syn{i:05d}" for i in range(12)]
+
+
+def flaky(**options):
+    return FlakyProvider(**{'latency': 0, 'jitter': 0, 'failure_rate': 0, 'periods': 50, **options})
+
+
+def failing_first(failures):
+    """前failures次调用抛出ConnectionError，之后正常返回"""
+    provider = flaky(failure_rate=1.0)
+
+    def fetch(symbol):
+        if provider.calls == failures:
+            provider.failure_rate = 0.0
+        return provider.fetch(symbol)
+    return provider, fetch
+
+
+def test_hanging_fetch_times_out():
+    provider = flaky(hang_rate=1.0, hang_seconds=1.0)
+    start = time.perf_counter()
+    result = fetch_all(['syn00000'], fetch=provider.fetch, retries=1, backoff=0.01, timeout=0.1, rate=0)
+    elapsed = time.perf_counter() - start
+    result = result['syn00000']
+    assert not result.ok and '超时' in result.error
+    assert result.attempts == 2 and provider.calls == 2
+    assert elapsed < 0.8
+
+
+def test_transient_failure_is_retried():
+    provider, fetch = failing_first(2)
+    result = fetch_all(['syn00000'], fetch=fetch, retries=3, backoff=0.01, rate=0)['syn00000']
+    assert result.ok and result.error is None
+    assert result.attempts == 3 and provider.calls == 3
+
+
+def test_gives_up_after_retries():
+    provider, fetch = failing_first(5)
+    result = fetch_all(['syn00000'], fetch=fetch, retries=2, backoff=0.01, rate=0)['syn00000']
+    assert not result.ok and result.error.startswith('ConnectionError')
+    assert result.attempts == 3 and provider.calls == 3
+
+
+def test_empty_frame_is_failure():
+    result = fetch_all(['syn00000'], fetch=lambda symbol: None, retries=1, backoff=0.01, rate=0)['syn00000']
+    assert not result.ok and result.error == "数据获取失败" and result.attempts == 2
+
+
+def test_one_failure_does_not_block_others():
+    provider = flaky(failure_rate=0.3, latency=0.01, seed=3)
+    results = fetch_all(SYMBOLS, fetch=provider.fetch, retries=0, rate=0, concurrency=4)
+    assert list(results) == SYMBOLS
+    assert provider.calls == len(SYMBOLS)
+    assert 0 < sum(result.ok for result in results.values()) < len(SYMBOLS)
+
+
+def test_concurrency_limit():
+    provider = flaky(latency=0.05)
+    results = fetch_all(SYMBOLS, fetch=provider.fetch, concurrency=3, rate=0)
+    assert all(result.ok for result in results.values())
+    assert provider.max_active == 3
+
+
+def test_token_bucket_paces_requests():
+    """burst个请求立即发出，之后每1/rate秒一个"""
+    provider = flaky()
+    calls = []
+
+    def fetch(symbol):
+        calls.append(time.monotonic())
+        return provider.fetch(symbol)
+
+    rate, burst = 20.0, 3
+    results = fetch_all(SYMBOLS, fetch=fetch, concurrency=len(SYMBOLS), rate=rate, burst=burst)
+    assert all(result.ok for result in results.values())
+    calls = sorted(calls)
+    offsets = [t - calls[0] for t in calls]
+    assert offsets[burst - 1] < 0.5 / rate
+    for i in range(burst, len(calls)):
+        assert offsets[i] >= (i - burst + 1) / rate * 0.9
+
+
+def test_token_bucket_refill():
+    now = [0.0]
+    bucket = TokenBucket(rate=2, capacity=3, clock=lambda: now[0])
+
+    async def take(count):
+        for _ in range(count):
+            await bucket.acquire()
+
+    asyncio.run(take(3))
+    assert bucket.tokens == 0
+    now[0] += 1.0
+    bucket._refill()
+    assert bucket.tokens == 2
+    now[0] += 10.0
+    bucket._refill()
+    assert bucket.tokens == 3
+
+
+def test_iter_fetch_stops_early():
+    provider = flaky(latency=0.02)
+    stream = iter_fetch(SYMBOLS, fetch=provider.fetch, concurrency=1, rate=0)
+    first = next(stream)
+    stream.close()
+    assert first.ok
+    time.sleep(0.1)
+    assert provider.calls < len(SYMBOLS)
+
+
+@pytest.mark.parametrize('attempt', [1, 2, 3, 10])
+def test_backoff_delay(attempt):
+    fetcher = AsyncFetcher(fetch=lambda symbol: None, backoff=0.5, max_backoff=2.0)
+    delay = min(2.0, 0.5 * 2 ** (attempt - 1))
+    assert delay * 0.5 <= fetcher.backoff_delay(attempt) <= delay
@@ -0,0 +1,134 @@
+"""
+向量化回测（backtest_panel）与逐根K线循环的参考实现的一致性检查：持有期、交易成本、出场规则和做空
+    python -m pytest -q test_backtest.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from backtest import SignalRule, backtest_panel, positions
+
+BARS = 400
+SYMBOLS = 6
+SIGNALS = ['A', 'B', 'C']
+METRICS = ['bars', 'total_return', 'annual_return', 'volatility', 'sharpe', 'max_drawdown',
+           'trades', 'hit_rate', 'avg_trade', 'exposure']
+
+
+def _panel():
+    rng = np.random.default_rng(17)
+    index = pd.date_range('2020-01-01', periods=BARS, freq='B')
+    closes = pd.DataFrame(100 * np.exp(np.cumsum(rng.normal(0, 0.02, (BARS, SYMBOLS)), axis=0)),
+                          index=index, columns=[f's{i}' for i in range(SYMBOLS)])
+    closes.iloc[:30, 1] = np.nan       # 上市前
+    closes.iloc[100:110, 2] = np.nan   # 停牌
+    closes.iloc[rng.random((BARS, SYMBOLS)) < 0.02] = np.nan
+    signals = {name: pd.DataFrame(rng.random((BARS, SYMBOLS)) < density, index=index, columns=closes.columns)
+               for name, density in zip(SIGNALS, (0.04, 0.04, 0.1))}
+    return closes, signals
+
+
+CLOSES, SIGNAL_PANEL = _panel()
+
+
+def loop_backtest(closes, signals, rule, periods_per_year=250):
+    """逐品种、逐根K线按SignalRule的文字描述回测"""
+    rows = []
+    for symbol in closes.columns:
+        close = closes[symbol].to_numpy(dtype=float)
+        valid = ~np.isnan(close)
+        entry = np.zeros(len(close), dtype=bool)
+        exit = np.zeros(len(close), dtype=bool)
+        for name in rule.entry:
+            entry |= signals[name][symbol].to_numpy(dtype=bool)
+        for name in rule.exit:
+            exit |= signals[name][symbol].to_numpy(dtype=bool)
+        entry &= valid
+        exit &= valid
+
+        equity, peak, max_drawdown = 1.0, 1.0, 0.0
+        held, entry_bar, last_close = False, -1, np.nan
+        trades, trade_value = [], 1.0
+        simple, exposure = [], 0
+        for t in range(len(close)):
+            ret = 0.0
+            if valid[t]:
+                if not np.isnan(last_close):
+                    ret = close[t] / last_close - 1
+                last_close = close[t]
+
+            was_held = held
+            if exit[t]:
+                held = False
+            elif entry[t]:
+                held, entry_bar = True, t
+            elif held and rule.hold is not None and t - entry_bar >= rule.hold:
+                held = False
+
+            factor = 1 + rule.direction * ret if was_held else 1.0
+            if held != was_held:
+                factor *= 1 - rule.cost
+            equity *= factor
+            peak = max(peak, equity)
+            max_drawdown = min(max_drawdown, equity / peak - 1)
+            if was_held or held:
+                trade_value *= factor
+            if was_held and not held:
+                trades.append(trade_value - 1)
+            if held and not was_held:
+                trade_value = 1 - rule.cost
+            if valid[t]:
+                simple.append(factor - 1)
+                exposure += held
+        if held:
+            trades.append(trade_value - 1)
+
+        bars = int(valid.sum())
+        total = equity - 1
+        mean, std = np.mean(simple), np.std(simple, ddof=1)
+        rows.append({
+            'symbol': symbol,
+            'bars': bars,
+            'total_return': total,
+            'annual_return': (1 + total) ** (periods_per_year / bars) - 1,
+            'volatility': std * np.sqrt(periods_per_year),
+            'sharpe': mean / std * np.sqrt(periods_per_year) if std > 0 else np.nan,
+            'max_drawdown': max_drawdown,
+            'trades': len(trades),
+            'hit_rate': np.mean(np.array(trades) > 0) if trades else np.nan,
+            'avg_trade': np.mean(trades) if trades else np.nan,
+            'exposure': exposure / bars,
+        })
+    return pd.DataFrame(rows)
+
+
+RULES = [
+    SignalRule(entry='A', exit='B', cost=0),
+    SignalRule(entry='A', exit='B', cost=0.001),
+    SignalRule(entry=('A', 'C'), exit=('B',), cost=0.0005),
+    SignalRule(entry='C', exit=(), hold=5, cost=0.001),
+    SignalRule(entry='A', exit='B', hold=10, cost=0.002),
+    SignalRule(entry='C', exit='A', hold=1, cost=0),
+    SignalRule(entry='A', exit='B', hold=15, cost=0.001, direction=-1),
+]
+
+
+@pytest.mark.parametrize('rule', RULES, ids=lambda rule: rule.name)
+def test_panel_matches_loop(rule):
+    result = backtest_panel(CLOSES, SIGNAL_PANEL, [rule])
+    expected = loop_backtest(CLOSES, SIGNAL_PANEL, rule)
+    assert list(result['symbol']) == list(expected['symbol'])
+    assert (result['rule'] == rule.name).all()
+    for name in METRICS:
+        np.testing.assert_allclose(result[name].to_numpy(dtype=float), expected[name].to_numpy(dtype=float),
+                                   rtol=1e-9, atol=1e-12, err_msg=name)
+
+
+def test_positions_rules():
+    """同一根K线同时入场和出场不持仓，持仓期间再次入场重新计时，持有满hold根后平仓"""
+    entry = np.array([1, 0, 0, 1, 0, 0, 0, 0, 1, 0], dtype=bool)[:, None]
+    exit = np.array([0, 0, 0, 0, 0, 0, 0, 0, 1, 0], dtype=bool)[:, None]
+    np.testing.assert_array_equal(positions(entry, exit, hold=3)[:, 0],
+                                  [1, 1, 1, 1, 1, 1, 0, 0, 0, 0])
+    np.testing.assert_array_equal(positions(entry, exit)[:, 0],
+                                  [1, 1, 1, 1, 1, 1, 1, 1, 0, 0])
@@ -0,0 +1,80 @@
+"""
+本地K线库的增量更新：重叠的最后几根K线被修订时只覆盖这几根，更早的K线变化时重新获取完整历史
+    python -m pytest -q test_bar_store.py
+"""
+import pandas as pd
+import pytest
+
+from bar_store import OVERLAP_BARS, read_bars, sync_bars
+from data_providers import DataProvider, SyntheticProvider, _since
+
+SYMBOL = 'sh000001'
+
+
+class RecordingProvider(DataProvider):
+    """返回可以修改的固定K线，并记录每次获取的起始日期"""
+
+    name = 'recording'
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.starts = []
+
+    def fetch(self, symbol, start_date=None):
+        self.starts.append(start_date)
+        return _since(self.bars.copy(), start_date)
+
+
+def assert_same_bars(df, expected):
+    pd.testing.assert_frame_equal(df, expected, check_freq=False)
+
+
+@pytest.fixture
+def provider(tmp_path):
+    provider = RecordingProvider(SyntheticProvider(periods=300).fetch(SYMBOL))
+    full = provider.bars
+    provider.bars = full.iloc[:-3]
+    sync_bars(SYMBOL, root=tmp_path, provider=provider)
+    provider.bars = full
+    provider.starts.clear()
+    return provider
+
+
+def test_appends_new_bars(provider, tmp_path):
+    df = sync_bars(SYMBOL, root=tmp_path, provider=provider)
+    assert_same_bars(df, provider.bars)
+    assert_same_bars(read_bars(SYMBOL, tmp_path), provider.bars)
+    assert provider.starts == [provider.bars.index[-4 - OVERLAP_BARS]]
+
+
+def test_unchanged_when_up_to_date(provider, tmp_path):
+    sync_bars(SYMBOL, root=tmp_path, provider=provider)
+    provider.starts.clear()
+    assert_same_bars(sync_bars(SYMBOL, root=tmp_path, provider=provider), provider.bars)
+    assert len(provider.starts) == 1
+
+
+@pytest.mark.parametrize('position', range(1, OVERLAP_BARS + 1))
+def test_revised_tail_is_overwritten(provider, tmp_path, position):
+    """倒数第position根已保存的K线被修订：只覆盖重叠部分，不重新获取完整历史"""
+    row = len(provider.bars) - 3 - position
+    provider.bars.iloc[row, provider.bars.columns.get_loc('close')] *= 1.01
+    df = sync_bars(SYMBOL, root=tmp_path, provider=provider)
+    assert_same_bars(df, provider.bars)
+    assert None not in provider.starts
+
+
+@pytest.mark.parametrize('unadjusted', [0, 2, OVERLAP_BARS])
+def test_adjusted_history_refetches(provider, tmp_path, unadjusted):
+    """除权后之前的复权价格全部变化（最后unadjusted根已保存的K线在除权日之后），重新获取完整历史"""
+    close = provider.bars.columns.get_loc('close')
+    provider.bars.iloc[:len(provider.bars) - 3 - unadjusted, close] *= 0.5
+    df = sync_bars(SYMBOL, root=tmp_path, provider=provider)
+    assert_same_bars(df, provider.bars)
+    assert provider.starts[-1] is None
+
+
+def test_missing_tail_bar_is_dropped(provider, tmp_path):
+    """网络数据中已删除的最后几根K线不再保留"""
+    provider.bars = provider.bars.drop(provider.bars.index[-5])
+    assert_same_bars(sync_bars(SYMBOL, root=tmp_path, provider=provider), provider.bars)
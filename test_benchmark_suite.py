@@ -0,0 +1,59 @@
+"""
+benchmark_suite的结果回归检查：每个可用的计算内核与golden目录中的标准结果逐列比较，绘图与标准图片在容差内比较
+计时基准使用pytest-benchmark（未安装时跳过），只检查结果时可以加--benchmark-skip跳过计时
+    python -m pytest -q test_benchmark_suite.py
+    python -m pytest -q test_benchmark_suite.py --benchmark-skip
+"""
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+
+import benchmark_suite
+import kernels
+from judge_strategy import BAR_COLUMNS, calculate_macd_indicators_new
+
+HAS_PYTEST_BENCHMARK = importlib.util.find_spec('pytest_benchmark') is not None
+TIMING_SIZES = dict(calc_sizes=(500, 5000), plot_sizes=(500,), export_sizes=(500,))
+
+
+@pytest.mark.parametrize('backend', kernels.available_backends())
+def test_golden_results(backend):
+    assert benchmark_suite.check_golden(backends=[backend])
+
+
+@pytest.mark.skipif(not os.path.exists(benchmark_suite.golden_plot_path()), reason="缺少标准图片")
+def test_golden_render():
+    assert benchmark_suite.check_render()
+
+
+def test_compare_columns_reports_changed_signal():
+    expected = pd.read_parquet(benchmark_suite.golden_path(benchmark_suite.GOLDEN_PLOT_CASE))
+    result = calculate_macd_indicators_new(expected[list(BAR_COLUMNS)])
+    assert benchmark_suite.compare_columns(result, expected) == []
+    result['TG'] = ~result['TG']
+    problems = benchmark_suite.compare_columns(result, expected)
+    assert len(problems) == 1 and problems[0].startswith('TG:')
+
+
+def _timing_ids():
+    names = [(name, periods) for name in ('EMA', 'CROSS', 'BARSLAST', 'calculate_macd_indicators_new')
+             for periods in TIMING_SIZES['calc_sizes']]
+    names += [('plot_macd_system_new', periods) for periods in TIMING_SIZES['plot_sizes']]
+    names += [('export_indicators', periods) for periods in TIMING_SIZES['export_sizes']]
+    return [f'{name}@{periods}' for name, periods in names]
+
+
+@pytest.fixture(scope='module')
+def timing_cases(tmp_path_factory):
+    """与run_benchmarks相同的待测函数（输入数据只准备一次）"""
+    tmp_dir = str(tmp_path_factory.mktemp('timing'))
+    return {f'{name}@{periods}': func
+            for name, periods, func in benchmark_suite.benchmark_cases(tmp_dir=tmp_dir, **TIMING_SIZES)}
+
+
+@pytest.mark.skipif(not HAS_PYTEST_BENCHMARK, reason="未安装pytest-benchmark")
+@pytest.mark.parametrize('case', _timing_ids())
+def test_timing(case, timing_cases, benchmark):
+    benchmark(timing_cases[case])
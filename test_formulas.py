@@ -0,0 +1,84 @@
+"""
+BARSLASTN/HHV/LLV/REF的向量化实现与原来逐根循环（benchmark_suite中的loop_*）的一致性检查
+    python -m pytest -q test_formulas.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from benchmark_suite import formula_inputs, loop_barslastn, loop_hhv, loop_llv, loop_ref
+from judge_strategy import BARSLASTN, HHV, LLV, REF
+
+LENGTH = 300
+
+
+def _masks():
+    rng = np.random.default_rng(7)
+    masks = {
+        '全为False': np.zeros(LENGTH, dtype=bool),
+        '全为True': np.ones(LENGTH, dtype=bool),
+        '只有第一根': np.eye(1, LENGTH, 0, dtype=bool)[0],
+        '只有最后一根': np.eye(1, LENGTH, LENGTH - 1, dtype=bool)[0],
+    }
+    for density in (0.01, 0.1, 0.5):
+        masks[f'随机{density:g}'] = rng.random(LENGTH) < density
+    return masks
+
+
+def _values():
+    rng = np.random.default_rng(11)
+    walk = np.cumsum(rng.normal(size=LENGTH))
+    leading_nan = walk.copy()
+    leading_nan[:30] = np.nan
+    scattered_nan = walk.copy()
+    scattered_nan[rng.random(LENGTH) < 0.1] = np.nan
+    return {'随机游走': walk, '开头NaN': leading_nan, '夹杂NaN': scattered_nan,
+            '全为NaN': np.full(LENGTH, np.nan), '常数': np.ones(LENGTH)}
+
+
+def _periods():
+    rng = np.random.default_rng(13)
+    return {'固定1': 1, '固定5': 5, '超过长度': LENGTH + 10,
+            '逐根变化': rng.integers(1, 60, LENGTH), '随位置增长': np.arange(LENGTH) + 1}
+
+
+MASKS = _masks()
+VALUES = _values()
+PERIODS = _periods()
+
+
+@pytest.mark.parametrize('n', [1, 2, 3])
+@pytest.mark.parametrize('name', list(MASKS))
+def test_barslastn_matches_loop(name, n):
+    condition = pd.Series(MASKS[name])
+    expected = loop_barslastn(condition, n)
+    result = BARSLASTN(condition, n)
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+
+@pytest.mark.parametrize('periods', list(PERIODS))
+@pytest.mark.parametrize('name', list(VALUES))
+@pytest.mark.parametrize('func,loop', [(HHV, loop_hhv), (LLV, loop_llv)], ids=['HHV', 'LLV'])
+def test_window_extreme_matches_loop(func, loop, name, periods):
+    series = pd.Series(VALUES[name])
+    expected = loop(series, PERIODS[periods])
+    result = func(series, PERIODS[periods])
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+
+@pytest.mark.parametrize('periods', list(PERIODS))
+@pytest.mark.parametrize('name', list(VALUES))
+def test_ref_matches_loop(name, periods):
+    series = pd.Series(VALUES[name])
+    expected = loop_ref(series, PERIODS[periods])
+    result = REF(series, PERIODS[periods])
+    np.testing.assert_array_equal(result.to_numpy(), expected.to_numpy())
+
+
+def test_indicator_inputs_match_loop():
+    """指标计算中的实际用法：金叉信号、DIF和由BARSLAST得到的窗口长度"""
+    golden_cross, dif, window = formula_inputs(1000, seed=3)
+    np.testing.assert_array_equal(BARSLASTN(golden_cross, 2).to_numpy(), loop_barslastn(golden_cross, 2).to_numpy())
+    np.testing.assert_array_equal(HHV(dif, window).to_numpy(), loop_hhv(dif, window).to_numpy())
+    np.testing.assert_array_equal(LLV(dif, window).to_numpy(), loop_llv(dif, window).to_numpy())
+    np.testing.assert_array_equal(REF(dif, window - 1).to_numpy(), loop_ref(dif, window - 1).to_numpy())
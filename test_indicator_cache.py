@@ -0,0 +1,59 @@
+"""
+指标缓存：键随K线内容变化，最后一根K线被修订时不能返回旧的指标
+    python -m pytest -q test_indicator_cache.py
+"""
+import numpy as np
+import pytest
+
+from data_providers import SyntheticProvider
+from indicator_cache import IndicatorCache, cache_key, cached_indicators
+from judge_strategy import calculate_macd_indicators_new
+
+
+@pytest.fixture
+def bars():
+    return SyntheticProvider(periods=300, start='2020-01-01').fetch('sh000001')
+
+
+def revised(bars, row=-1, factor=0.9):
+    bars = bars.copy()
+    bars.iloc[row, bars.columns.get_loc('close')] *= factor
+    return bars
+
+
+def test_same_bars_hit_cache(bars):
+    cache = IndicatorCache()
+    first = cached_indicators('sh000001', bars, cache=cache)
+    second = cached_indicators('sh000001', bars.copy(), cache=cache)
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert second.equals(first)
+
+
+@pytest.mark.parametrize('row', [-1, -5, 0])
+def test_revised_bar_changes_key(bars, row):
+    assert cache_key('sh000001', bars) != cache_key('sh000001', revised(bars, row))
+
+
+def test_revised_last_bar_is_recomputed(bars):
+    cache = IndicatorCache()
+    cached_indicators('sh000001', bars, cache=cache, columns=['DIF', 'MACD'])
+    new_bars = revised(bars)
+    result = cached_indicators('sh000001', new_bars, cache=cache, columns=['DIF', 'MACD'])
+    expected = calculate_macd_indicators_new(new_bars)
+    assert cache.misses == 2
+    np.testing.assert_array_equal(result['DIF'].to_numpy(), expected['DIF'].to_numpy())
+    np.testing.assert_array_equal(result['MACD'].to_numpy(), expected['MACD'].to_numpy())
+    np.testing.assert_array_equal(result['close'].to_numpy(), new_bars['close'].to_numpy())
+
+
+def test_failed_compute_releases_key_lock(bars):
+    cache = IndicatorCache()
+
+    def failing(df):
+        raise RuntimeError("计算失败")
+
+    key = cache_key('sh000001', bars)
+    with pytest.raises(RuntimeError):
+        cache.get_or_compute(key, bars, failing)
+    assert cache._computing == {}
+    assert 'DIF' in cache.get_or_compute(key, bars).columns
@@ -0,0 +1,12 @@
+"""
+各计算内核（kernels）与逐根循环的一致性检查，当前环境中可用的每个内核分别作为一个测试
+    python -m pytest -q test_kernels.py
+"""
+import pytest
+
+import kernels
+
+
+@pytest.mark.parametrize('backend', kernels.available_backends())
+def test_backend_matches_loop(backend):
+    assert kernels.check_equivalence(backends=[backend]) == []
@@ -0,0 +1,87 @@
+"""
+MACD指标增量计算与全量计算（calculate_macd_indicators_new）的一致性检查，包括收盘价含NaN的K线
+    python -m pytest -q test_macd_incremental.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import macd_incremental
+from data_providers import SyntheticProvider
+from judge_strategy import MACDParams, calculate_macd_indicators_new
+from macd_incremental import MACDState, update_macd_indicators
+
+LENGTH = 600
+CUSTOM = MACDParams(short=8, long=21, mid=5, trend_short=60, trend_long=130, second_cross_window=15,
+                    low_cross_level=0)
+
+
+def _bars(kind):
+    bars = SyntheticProvider(periods=LENGTH, seed=5, start='2020-01-01').fetch('sh000001')
+    close = bars.columns.get_loc('close')
+    rng = np.random.default_rng(3)
+    if kind in ('夹杂NaN', '开头和夹杂NaN'):
+        bars.iloc[np.flatnonzero(rng.random(LENGTH) < 0.03), close] = np.nan
+    if kind in ('开头NaN', '开头和夹杂NaN'):
+        bars.iloc[:15, close] = np.nan
+    return bars
+
+
+BARS = {kind: _bars(kind) for kind in ('无NaN', '夹杂NaN', '开头NaN', '开头和夹杂NaN')}
+
+
+def assert_same(result, expected):
+    assert list(result.index) == list(expected.index)
+    for name in expected.columns:
+        np.testing.assert_array_equal(result[name].to_numpy(dtype=expected[name].dtype),
+                                      expected[name].to_numpy(), err_msg=name)
+
+
+@pytest.mark.parametrize('params', [None, CUSTOM], ids=['默认参数', '自定义参数'])
+@pytest.mark.parametrize('kind', list(BARS))
+def test_from_empty_state_matches_full(kind, params):
+    bars = BARS[kind]
+    expected = calculate_macd_indicators_new(bars, params=params)
+    assert_same(update_macd_indicators(MACDState(params), bars), expected)
+
+
+@pytest.mark.parametrize('split', [1, 2, 10, 15, 16, 130, 131, 299, LENGTH - 1])
+@pytest.mark.parametrize('kind', list(BARS))
+def test_split_matches_full(kind, split):
+    bars = BARS[kind]
+    expected = calculate_macd_indicators_new(bars, params=CUSTOM)
+    macd_incremental._states.clear()
+    previous = calculate_macd_indicators_new(bars.iloc[:split], params=CUSTOM)
+    assert_same(update_macd_indicators(previous, bars, params=CUSTOM), expected.iloc[split:])
+
+
+def test_split_after_nan_close():
+    """前一段以NaN收盘价结束时也能恢复状态"""
+    bars = BARS['夹杂NaN']
+    splits = np.flatnonzero(bars['close'].isna().to_numpy())[:5] + 1
+    expected = calculate_macd_indicators_new(bars)
+    for split in splits:
+        macd_incremental._states.clear()
+        previous = calculate_macd_indicators_new(bars.iloc[:split])
+        assert_same(update_macd_indicators(previous, bars), expected.iloc[split:])
+
+
+@pytest.mark.parametrize('kind', ['无NaN', '开头和夹杂NaN'])
+def test_repeated_updates_reuse_state(kind, monkeypatch):
+    """逐根追加并拼接结果时只在第一次扫描历史，之后沿用保存的状态"""
+    bars = BARS[kind]
+    macd_incremental._states.clear()
+    frame = calculate_macd_indicators_new(bars.iloc[:400])
+    calls = []
+    from_frame = MACDState.from_frame.__func__
+    monkeypatch.setattr(MACDState, 'from_frame',
+                        classmethod(lambda cls, df, params=None: calls.append(len(df)) or from_frame(cls, df, params)))
+    for end in range(401, LENGTH + 1, 7):
+        frame = pd.concat([frame, update_macd_indicators(frame, bars.iloc[:end])])
+    assert calls == [400]
+    assert_same(frame, calculate_macd_indicators_new(bars.iloc[:frame.index.size]))
+
+
+def test_compact_result_is_rejected():
+    with pytest.raises(ValueError):
+        MACDState.from_frame(calculate_macd_indicators_new(BARS['无NaN'], compact=True))
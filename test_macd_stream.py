@@ -0,0 +1,36 @@
+"""
+逐根回放K线的流式计算与全量计算（calculate_macd_indicators_new）的一致性检查，包括收盘价含NaN的K线
+    python -m pytest -q test_macd_stream.py
+"""
+import numpy as np
+import pytest
+
+from judge_strategy import INDICATOR_OUTPUTS, calculate_macd_indicators_new
+from macd_stream import STREAM_COLUMNS, MACDStream
+from test_macd_incremental import BARS, CUSTOM, assert_same
+
+
+@pytest.mark.parametrize('params', [None, CUSTOM], ids=['默认参数', '自定义参数'])
+@pytest.mark.parametrize('kind', list(BARS))
+def test_replay_matches_full(kind, params):
+    bars = BARS[kind]
+    expected = calculate_macd_indicators_new(bars, params=params)[STREAM_COLUMNS]
+    assert_same(MACDStream(params=params).replay(bars), expected)
+
+
+@pytest.mark.parametrize('split', [1, 15, 16, 300])
+@pytest.mark.parametrize('kind', ['无NaN', '开头和夹杂NaN'])
+def test_from_frame_continues(kind, split):
+    bars = BARS[kind]
+    expected = calculate_macd_indicators_new(bars)
+    stream = MACDStream.from_frame(calculate_macd_indicators_new(bars.iloc[:split]), columns=list(INDICATOR_OUTPUTS))
+    assert_same(stream.replay(bars.iloc[split:]), expected[list(INDICATOR_OUTPUTS)].iloc[split:])
+
+
+def test_update_rejects_old_bar():
+    bars = BARS['无NaN']
+    stream = MACDStream()
+    stream.replay(bars.iloc[:10])
+    with pytest.raises(ValueError):
+        stream.update({'close': 1.0}, bars.index[9])
+    assert np.isfinite(stream.update(1.0, bars.index[10])['DIF'])
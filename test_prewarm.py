@@ -0,0 +1,72 @@
+"""
+收盘后预热：交易时段内按需重新获取的K线被修订时，页面得到的指标随之更新
+    python -m pytest -q test_prewarm.py
+"""
+import numpy as np
+import pytest
+
+import prewarm
+from data_providers import DataProvider, SyntheticProvider
+from indicator_cache import IndicatorCache, cached_indicators
+from judge_strategy import calculate_macd_indicators_new
+from prewarm import PrewarmScheduler
+
+SYMBOL = 'sh000001'
+COLUMNS = ['DIF', 'DEA', 'MACD', 'TG', 'BG']
+
+
+class RevisingProvider(DataProvider):
+    """返回可以修改的固定K线，模拟盘中最后一根K线的变化"""
+
+    name = 'revising'
+
+    def __init__(self, bars):
+        self.bars = bars
+
+    def fetch(self, symbol, start_date=None):
+        return self.bars.copy()
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    monkeypatch.setattr(prewarm, 'in_trading_session', lambda now, refresh_time=None: True)
+    provider = RevisingProvider(SyntheticProvider(periods=400).fetch(SYMBOL))
+    scheduler = PrewarmScheduler([SYMBOL], provider=provider, cache=IndicatorCache(), columns=COLUMNS,
+                                 intraday_ttl=0)
+    scheduler.refresh(SYMBOL)
+    return scheduler
+
+
+def page_indicators(scheduler, timeframe='D'):
+    """与streamlit_app.get_stock_bars和get_cached_macd_indicators相同的读取方式"""
+    df = scheduler.current_bars(SYMBOL, timeframe)
+    return df, cached_indicators(SYMBOL, df, provider=scheduler.provider, cache=scheduler.cache,
+                                 columns=COLUMNS, timeframe=timeframe)
+
+
+def test_not_prewarmed_returns_none(scheduler):
+    assert scheduler.current_bars('sz399001') is None
+
+
+def test_not_stale_outside_trading_session(scheduler, monkeypatch):
+    monkeypatch.setattr(prewarm, 'in_trading_session', lambda now, refresh_time=None: False)
+    assert not scheduler.is_stale(SYMBOL)
+
+
+@pytest.mark.parametrize('timeframe', ['D', 'W'])
+def test_intraday_revision_changes_served_indicators(scheduler, timeframe):
+    _, before = page_indicators(scheduler, timeframe)
+
+    bars = scheduler.provider.bars
+    bars.iloc[-1, bars.columns.get_loc('close')] *= 0.95
+    df, after = page_indicators(scheduler, timeframe)
+
+    assert df['close'].iloc[-1] == pytest.approx(bars['close'].iloc[-1])
+    expected = calculate_macd_indicators_new(df)
+    for name in ('DIF', 'MACD'):
+        np.testing.assert_array_equal(after[name].to_numpy(), expected[name].to_numpy())
+    assert after['DIF'].iloc[-1] != before['DIF'].iloc[-1]
+    # 页面读取的是预热时算好的结果，不需要重新计算
+    misses = scheduler.cache.misses
+    page_indicators(scheduler, timeframe)
+    assert scheduler.cache.misses == misses
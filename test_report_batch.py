@@ -0,0 +1,67 @@
+"""
+批量报告的跳过和重新生成：哈希值包含指标参数和代码版本，force=True只替换本次处理的品种
+    python -m pytest -q test_report_batch.py
+"""
+import json
+import os
+
+import pytest
+
+import report_batch
+from data_providers import SyntheticProvider
+from report_batch import MANIFEST_NAME, generate_reports, load_events
+
+PROVIDER = SyntheticProvider(periods=300)
+SYMBOLS = ['sh000001', 'sz399001', 'sz399006']
+
+
+def run(output_dir, symbols=SYMBOLS, **kwargs):
+    result = generate_reports(symbols, output_dir=str(output_dir), workers=1, provider=PROVIDER,
+                              fmt='parquet', progress=None, **kwargs)
+    return dict(zip(result['symbol'], result['status']))
+
+
+def manifest(output_dir):
+    with open(os.path.join(output_dir, MANIFEST_NAME), encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture(autouse=True)
+def fast_chart(monkeypatch):
+    """绘图较慢且与跳过逻辑无关，只写入空文件"""
+    def render_chart(df, symbol, path):
+        open(path, 'wb').close()
+        return path
+    monkeypatch.setattr(report_batch, 'render_chart', render_chart)
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    assert set(run(tmp_path).values()) == {'已生成'}
+    return tmp_path
+
+
+def test_unchanged_symbols_are_skipped(output_dir):
+    assert set(run(output_dir).values()) == {'未变化，跳过'}
+
+
+def test_force_keeps_other_symbols(output_dir):
+    before = manifest(output_dir)
+    assert run(output_dir, symbols=SYMBOLS[:1], force=True) == {SYMBOLS[0]: '已生成'}
+    after = manifest(output_dir)
+    assert sorted(after) == sorted(SYMBOLS)
+    assert all(after[symbol] == before[symbol] for symbol in SYMBOLS[1:])
+    assert sorted(load_events(str(output_dir)).symbols()) == sorted(SYMBOLS)
+    assert set(run(output_dir).values()) == {'未变化，跳过'}
+
+
+def test_params_change_regenerates(output_dir):
+    params = {'short': 8, 'long': 21}
+    assert set(run(output_dir, params=params).values()) == {'已生成'}
+    assert set(run(output_dir, params=params).values()) == {'未变化，跳过'}
+    assert set(run(output_dir).values()) == {'已生成'}
+
+
+def test_code_version_change_regenerates(output_dir, monkeypatch):
+    monkeypatch.setattr(report_batch, 'CODE_VERSION', 'changed')
+    assert set(run(output_dir).values()) == {'已生成'}
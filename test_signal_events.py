@@ -0,0 +1,142 @@
+"""
+信号事件记录的查询与直接扫描指标结果的比较：query(days=…)、latest/bars_since、保存和读取
+    python -m pytest -q test_signal_events.py
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_providers import SyntheticProvider
+from judge_strategy import calculate_macd_indicators_new
+from signal_events import EVENT_SIGNALS, SignalEventLog
+
+# 品种 -> (K线数量, 最后一根K线的日期)，最后日期和长度各不相同
+SYMBOLS = {
+    'sh000001': (900, '2024-06-28'),
+    'sz399001': (700, '2024-06-21'),
+    'sz399006': (1200, '2024-05-31'),
+    'new00001': (40, '2024-06-28'),  # K线很少，几乎没有信号
+}
+QUERY_SIGNALS = ['TG', 'BG', '低位金叉', '主升']
+
+
+def _frames():
+    frames = {}
+    for seed, (symbol, (periods, end)) in enumerate(SYMBOLS.items()):
+        bars = SyntheticProvider(periods=periods, end=end, seed=seed).fetch(symbol)
+        frames[symbol] = calculate_macd_indicators_new(bars)
+    return frames
+
+
+FRAMES = _frames()
+AS_OF = max(df.index[-1] for df in FRAMES.values())
+
+
+@pytest.fixture(scope='module')
+def log():
+    log = SignalEventLog()
+    for symbol, df in FRAMES.items():
+        log.add(symbol, df)
+    return log
+
+
+def scan(signals=EVENT_SIGNALS, symbols=None, start=None):
+    """直接扫描每个品种的指标结果，返回(品种, 日期, 信号)的集合"""
+    found = set()
+    for symbol, df in FRAMES.items():
+        if symbols is not None and symbol not in symbols:
+            continue
+        for signal in signals:
+            dates = df.index[df[signal].to_numpy(dtype=bool)]
+            found.update((symbol, date, signal) for date in dates if start is None or date >= start)
+    return found
+
+
+def as_set(events):
+    return set(zip(events['symbol'].astype(str), events['date'], events['signal'].astype(str)))
+
+
+def test_as_of(log):
+    assert log.as_of == AS_OF
+    assert sorted(log.symbols()) == sorted(SYMBOLS)
+
+
+@pytest.mark.parametrize('days', [0, 7, 30, 90, 365, 5000])
+@pytest.mark.parametrize('signals,symbols', [
+    (None, None),
+    (QUERY_SIGNALS, None),
+    ('TG', None),
+    (None, ['sh000001', 'sz399006']),
+    (QUERY_SIGNALS, ['sz399001', 'new00001']),
+], ids=['全部', '多个信号', '单个信号', '指定品种', '信号和品种'])
+def test_query_days(log, days, signals, symbols):
+    result = log.query(signals=signals, symbols=symbols, days=days)
+    expected = scan([signals] if isinstance(signals, str) else signals or EVENT_SIGNALS, symbols,
+                    AS_OF - pd.Timedelta(days=days))
+    assert as_set(result) == expected
+    assert len(result) == len(expected)
+    assert result['date'].is_monotonic_increasing
+
+
+def test_query_date_range(log):
+    start, end = pd.Timestamp('2023-01-01'), pd.Timestamp('2023-12-31')
+    result = log.query(signals=QUERY_SIGNALS, start=start, end=end)
+    expected = {event for event in scan(QUERY_SIGNALS) if start <= event[1] <= end}
+    assert as_set(result) == expected
+
+
+def test_latest_and_bars_since(log):
+    latest = log.latest(signals=QUERY_SIGNALS).set_index(['symbol', 'signal'])
+    for symbol, df in FRAMES.items():
+        for signal in QUERY_SIGNALS:
+            row = latest.loc[(symbol, signal)]
+            positions = np.flatnonzero(df[signal].to_numpy(dtype=bool))
+            if not len(positions):
+                assert pd.isna(row['date']) and np.isnan(row['bars_since']) and np.isnan(row['days_since'])
+                continue
+            last = positions[-1]
+            assert row['date'] == df.index[last]
+            assert row['days_since'] == (AS_OF - df.index[last]).days
+            assert row['bars_since'] == len(df) - 1 - last
+            assert row['DIF'] == df['DIF'].iloc[last] and row['close'] == df['close'].iloc[last]
+
+
+def test_days_since(log):
+    bars_since = log.days_since('BG', bars=True)
+    latest = log.latest('BG').set_index('symbol')['bars_since']
+    pd.testing.assert_series_equal(bars_since, latest)
+
+
+def test_latest_unknown_names(log):
+    latest = log.latest(signals=['TG', '未知信号'], symbols=['sh000001', '未知品种'])
+    assert len(latest) == 4
+    known = (latest['symbol'] == 'sh000001') & (latest['signal'] == 'TG')
+    assert latest.loc[~known, 'date'].isna().all()
+
+
+def test_add_replaces_symbol(log):
+    log = SignalEventLog()
+    df = FRAMES['sh000001']
+    log.add('sh000001', df)
+    log.add('sh000001', df.iloc[:300])
+    assert as_set(log.query()) == {event for event in scan(symbols=['sh000001']) if event[1] <= df.index[299]}
+    assert log.latest('TG')['bars_since'].iloc[0] == 299 - np.flatnonzero(df['TG'].iloc[:300])[-1]
+
+
+def test_save_load_round_trip(tmp_path):
+    log = SignalEventLog()
+    for symbol, df in FRAMES.items():
+        log.add(symbol, df)
+    log.add('empty', FRAMES['new00001'].iloc[:2])  # 没有事件的品种也保留K线数量和最后日期
+    assert len(log.query(symbols='empty')) == 0
+    path = tmp_path / 'signal_events.parquet'
+    log.save(path)
+    loaded = SignalEventLog.load(path)
+    assert loaded.symbols() == log.symbols()
+    assert loaded.index['symbol_info'] == log.index['symbol_info']
+    assert loaded.signals == log.signals
+    assert loaded.as_of == log.as_of
+    assert len(loaded) == len(log)
+    pd.testing.assert_frame_equal(loaded.query(days=365), log.query(days=365))
+    pd.testing.assert_frame_equal(loaded.latest(), log.latest())
+    pd.testing.assert_frame_equal(loaded.counts(), log.counts())
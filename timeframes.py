@@ -0,0 +1,279 @@
+"""
+多周期K线
+从同一份基础K线合成日线、周线、月线和N分钟线（开盘取第一根、最高/最低取极值、收盘取最后一根、成交量求和），
+每根合成K线的日期取其中最后一根基础K线的日期，未完成的周线、月线显示到最新一天；
+分钟基础K线只在末尾追加时增量合成，只重新计算最后一根（可能未完成的）合成K线及之后的部分；
+日线基础K线全量合成只需约1毫秒，增量合成并不更快，总是全量合成。
+calculate_timeframes一次计算全部周期的指标，每个周期分别缓存（见indicator_cache）
+    python timeframes.py sh000300 --timeframes D W M
+    python timeframes.py --benchmark
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+# 周期代码和显示名称；分钟线需要分钟级的基础K线
+TIMEFRAME_NAMES = {
+    'D': '日线',
+    'W': '周线',
+    'M': '月线',
+    '60min': '60分钟',
+    '30min': '30分钟',
+    '15min': '15分钟',
+    '5min': '5分钟',
+}
+
+DEFAULT_TIMEFRAMES = ('D', 'W', 'M')
+
+# 日线、周线、月线对应的pandas周期，周线以周五为一周的结束
+PERIOD_FREQS = {'D': 'D', 'W': 'W-FRI', 'M': 'M'}
+
+# A股交易时段（开始, 结束）的分钟数，分钟K线的时间为该分钟结束的时间（9:31为第一根）
+SESSIONS = ((9 * 60 + 30, 11 * 60 + 30), (13 * 60, 15 * 60))
+
+# 合成时各列的取值方式，其他列取最后一根
+AGGREGATIONS = {'open': 'first', 'high': 'max', 'low': 'min', 'close': 'last', 'volume': 'sum', 'amount': 'sum'}
+
+
+def parse_timeframe(timeframe):
+    """返回('period', pandas周期)或('minutes', 分钟数)，不支持的周期抛出ValueError"""
+    if timeframe in PERIOD_FREQS:
+        return 'period', PERIOD_FREQS[timeframe]
+    if isinstance(timeframe, str) and timeframe.endswith('min') and timeframe[:-3].isdigit():
+        minutes = int(timeframe[:-3])
+        if minutes > 0:
+            return 'minutes', minutes
+    raise ValueError(f"不支持的周期: {timeframe}，可选 D、W、M 或 N分钟（如 60min）")
+
+
+def day_numbers(index):
+    """每根K线所在的日期编号（按当地时间，自1970-01-01起的天数），比index.normalize()快得多"""
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.asi8 // 86_400_000_000_000
+
+
+def is_intraday(index):
+    """基础K线是否为分钟线（同一天有多根K线）"""
+    if len(index) < 2:
+        return False
+    days = day_numbers(index)
+    return bool((days[1:] == days[:-1]).any())
+
+
+def base_minutes(index):
+    """分钟基础K线的周期（同一天内相邻K线最常见的间隔，分钟）"""
+    values = index.asi8
+    same_day = day_numbers(index)
+    gaps = np.diff(values)[same_day[1:] == same_day[:-1]] // 60_000_000_000
+    gaps = gaps[gaps > 0]
+    return int(np.bincount(gaps).argmax()) if len(gaps) else 1
+
+
+def session_minutes(index):
+    """
+    每根分钟K线在当天交易时段内经过的分钟数（9:31为1，11:30为120，13:01为121，15:00为240），
+    午休和开盘前的K线并入前一时段的最后一根
+    """
+    clock = index.hour * 60 + index.minute
+    elapsed = np.zeros(len(index), dtype=np.int64)
+    offset = 0
+    for start, end in SESSIONS:
+        inside = clock > start
+        elapsed = np.where(inside, offset + np.minimum(clock, end) - start, elapsed)
+        offset += end - start
+    return elapsed
+
+
+def bin_keys(index, timeframe):
+    """每根基础K线所属的合成K线编号（非递减的整数数组）"""
+    kind, value = parse_timeframe(timeframe)
+    if kind == 'period':
+        return index.to_period(value).asi8
+    step = base_minutes(index)
+    if value % step:
+        raise ValueError(f"{timeframe}不是基础K线周期（{step}分钟）的整数倍")
+    days = day_numbers(index)
+    slot = (session_minutes(index) + value - 1) // value  # 向上取整：10:30属于9:31-10:30这一根
+    return days * 10_000 + slot
+
+
+def bin_start(label, timeframe):
+    """合成K线label所在周期的起始时间，分钟线取当天0点（增量合成时重新合成当天全部分钟线）"""
+    kind, value = parse_timeframe(timeframe)
+    if kind == 'period':
+        return pd.Period(label, freq=value).start_time
+    return label.normalize()
+
+
+def _aggregate(base, timeframe):
+    """按bin_keys分组合成，基础K线须按时间升序排列"""
+    if base.empty:
+        return base.copy()
+    keys = bin_keys(base.index, timeframe)
+    ends = np.append(np.flatnonzero(keys[1:] != keys[:-1]), len(keys) - 1)
+    if len(ends) == len(base):  # 每根基础K线自成一根，如日线合成日线
+        return base.copy()
+    starts = np.append(0, ends[:-1] + 1)
+
+    columns = {}
+    for name in base.columns:
+        values = base[name].to_numpy()
+        how = AGGREGATIONS.get(name, 'last')
+        if how == 'first':
+            columns[name] = values[starts]
+        elif how == 'max':
+            columns[name] = np.maximum.reduceat(values, starts)
+        elif how == 'min':
+            columns[name] = np.minimum.reduceat(values, starts)
+        elif how == 'sum':
+            columns[name] = np.add.reduceat(values, starts)
+        else:
+            columns[name] = values[ends]
+    return pd.DataFrame(columns, index=base.index[ends], columns=base.columns)
+
+
+def resample_bars(base, timeframe, previous=None):
+    """
+    把基础K线合成为timeframe周期的K线
+    previous为上次用同一份基础K线（之后只在末尾追加或更新了最后几根）合成的结果时，
+    保留最后一根之前的合成K线，只合成其所在周期起的部分
+    """
+    if previous is None or previous.empty or base.empty:
+        return _aggregate(base, timeframe)
+    start = bin_start(previous.index[-1], timeframe)
+    tail = base.iloc[base.index.searchsorted(start):]
+    return pd.concat([previous.iloc[:previous.index.searchsorted(start)], _aggregate(tail, timeframe)])
+
+
+class TimeframeBars:
+    """
+    一个品种的基础K线和由它合成的各周期K线
+    分钟基础K线update时开头与上次相同、且上次的最后一根仍在原来的位置，视为只在末尾追加，增量合成；
+    否则（日线基础K线，或如K线库重新获取了完整历史）全部重新合成
+    """
+
+    def __init__(self, timeframes=DEFAULT_TIMEFRAMES):
+        self.timeframes = list(timeframes)
+        self.base = None
+        self.bars = {}
+
+    def _appended(self, base):
+        old = self.base
+        if old is None or old.empty or len(base) < len(old):
+            return False
+        return base.index[0] == old.index[0] and base.index[len(old) - 1] == old.index[-1]
+
+    def supported(self, timeframe, base=None):
+        """分钟线只能由分钟基础K线合成"""
+        base = self.base if base is None else base
+        return parse_timeframe(timeframe)[0] == 'period' or is_intraday(base.index)
+
+    def update(self, base):
+        """用新的基础K线更新全部周期，返回{周期: K线}；不能合成的周期跳过并输出提示"""
+        intraday = is_intraday(base.index)
+        incremental = intraday and self._appended(base)
+        bars = {}
+        for timeframe in self.timeframes:
+            if parse_timeframe(timeframe)[0] != 'period' and not intraday:
+                print(f"基础K线不是分钟线，无法合成{TIMEFRAME_NAMES.get(timeframe, timeframe)}")
+                continue
+            previous = self.bars.get(timeframe) if incremental else None
+            bars[timeframe] = resample_bars(base, timeframe, previous)
+        self.base = base
+        self.bars = bars
+        return bars
+
+    def __getitem__(self, timeframe):
+        return self.bars[timeframe]
+
+    def __contains__(self, timeframe):
+        return timeframe in self.bars
+
+
+def calculate_timeframes(symbol, base, timeframes=DEFAULT_TIMEFRAMES, params=None, provider=None,
+                         cache=None, columns=None, bars=None):
+    """
+    一次计算全部周期的指标，返回{周期: calculate_macd_indicators_new的结果}
+    每个周期按(品种, 周期, 最后K线日期, 参数)分别缓存；bars为该品种的TimeframeBars时增量合成K线
+    """
+    from indicator_cache import cached_indicators
+
+    bars = bars if bars is not None else TimeframeBars(timeframes)
+    bars.timeframes = list(timeframes)
+    resampled = bars.update(base)
+    return {timeframe: cached_indicators(symbol, frame, params=params, provider=provider, cache=cache,
+                                         columns=columns, timeframe=timeframe)
+            for timeframe, frame in resampled.items()}
+
+
+def _session_index(days, start='2020-01-02'):
+    """days个工作日的A股交易时段1分钟K线时间（每天240根）"""
+    minutes = np.concatenate([np.arange(open_ + 1, close + 1) for open_, close in SESSIONS])
+    dates = pd.bdate_range(start, periods=days)
+    return pd.DatetimeIndex((dates.asi8[:, None] + minutes[None, :] * 60_000_000_000).ravel(), name='date')
+
+
+def benchmark(days=2000, minute_days=250, repeat=20):
+    """比较全量合成与增量合成的耗时（各取repeat次中最短的一次），并检查两者结果一致"""
+    from data_providers import SyntheticProvider
+
+    def best_of(func):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = func()
+            times.append(time.perf_counter() - start)
+        return result, min(times)
+
+    daily = SyntheticProvider(periods=days).fetch('benchmark')
+    minute_index = _session_index(minute_days)
+    minute = SyntheticProvider(periods=len(minute_index), volatility=0.001).fetch('benchmark')
+    minute.index = minute_index
+
+    for label, base, timeframes in (("日线", daily, ('W', 'M')), ("1分钟线", minute, ('5min', '60min', 'D', 'W'))):
+        used = '增量' if is_intraday(base.index) else '全量'
+        for timeframe in timeframes:
+            full, full_seconds = best_of(lambda: resample_bars(base, timeframe))
+            previous = resample_bars(base.iloc[:-1], timeframe)
+            incremental, incremental_seconds = best_of(lambda: resample_bars(base, timeframe, previous))
+            same = incremental.equals(full)
+            print(f"{label} {len(base)}根 -> {TIMEFRAME_NAMES[timeframe]} {len(full)}根: "
+                  f"全量 {full_seconds * 1000:.2f}ms，增量 {incremental_seconds * 1000:.2f}ms，"
+                  f"{'结果一致' if same else '结果不一致'}，TimeframeBars使用{used}")
+        start = time.perf_counter()
+        for _ in range(repeat):
+            is_intraday(base.index)
+        print(f"{label}判断是否为分钟线: {(time.perf_counter() - start) / repeat * 1000:.2f}ms")
+
+
+def main():
+    from judge_strategy import get_stock_data
+
+    parser = argparse.ArgumentParser(description="由同一份基础K线计算多个周期的MACD结构指标")
+    parser.add_argument('symbol', nargs='?', default='sh000300', help="品种代码，默认sh000300")
+    parser.add_argument('--timeframes', nargs='+', default=list(DEFAULT_TIMEFRAMES),
+                        help="周期，D、W、M或N分钟（如60min，需要分钟级的基础K线），默认 D W M")
+    parser.add_argument('--provider', default=None,
+                        help="数据源：akshare、local:目录 或 synthetic，默认读取环境变量DATA_PROVIDER")
+    parser.add_argument('--benchmark', action='store_true', help="用离线随机数据测试合成耗时")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark()
+        return
+
+    base = get_stock_data(args.symbol, provider=args.provider)
+    if base is None:
+        return
+    results = calculate_timeframes(args.symbol, base, args.timeframes, provider=args.provider)
+    for timeframe, df in results.items():
+        last = df.iloc[-1]
+        print(f"{TIMEFRAME_NAMES.get(timeframe, timeframe)}: {len(df)}根，最后 {df.index[-1]:%Y-%m-%d %H:%M}，"
+              f"DIF {last['DIF']:.3f}，TG {bool(last['TG'])}，BG {bool(last['BG'])}，主升 {bool(last['主升'])}")
+
+
+if __name__ == "__main__":
+    main()